@@ -3,22 +3,61 @@ API REST para Sistema de Recomendação de Filmes
 Serve o modelo de Machine Learning através de endpoints HTTP
 """
 
-from flask import Flask, request, jsonify
-import joblib
-import pandas as pd
+from flask import Flask, Response, g, request, jsonify
+import json
+import math
+import os
+import signal
+import threading
 from pathlib import Path
+from servico_recomendacao import (CRONOMETRO_NULO, CacheRespostas, Cronometro, MetricasRequisicoes,
+                                  RecarregadorModelo, modelo_padrao)
 
 # Inicializar Flask
 app = Flask(__name__)
 
 # Caminhos
 MODEL_PATH = Path('models')
+DATA_PATH = Path('ml-100k')
+
+# Modelo servido pela API: popularity, svd, als, knn_item ou knn_user
+# (padrão: o melhor modelo do último treinamento, gravado em models/artefatos/MELHOR)
+NOME_MODELO = os.environ.get('MODELO_API') or modelo_padrao(MODEL_PATH)
+
+# Modo de serviço: 'ao_vivo' (calcula os scores) ou 'materializado' (top 50 pré-calculado no treino)
+MODO_SERVICO = os.environ.get('MODO_SERVICO', 'ao_vivo')
+
+# Segundos entre verificações de nova versão do modelo (0 = só via SIGHUP)
+INTERVALO_RECARGA = float(os.environ.get('INTERVALO_RECARGA', 5))
+
+# Segundos entre compactações das avaliações recebidas em /avaliar (0 = nunca)
+INTERVALO_COMPACTACAO = float(os.environ.get('INTERVALO_COMPACTACAO', 300))
+
+# Máximo de usuários por requisição em /recomendar/lote
+MAX_USUARIOS_LOTE = 1000
+
+# Máximo de recomendações por usuário
+MAX_RECOMENDACOES = 50
+
+# Cache LRU das respostas de /recomendar (CACHE_MAX_ITENS=0 desativa)
+cache_respostas = CacheRespostas(
+    max_itens=int(os.environ.get('CACHE_MAX_ITENS', 10000)),
+    ttl=float(os.environ.get('CACHE_TTL', 300))
+)
+
+# Histogramas de latência por etapa e contadores de requisições/erros, expostos em /metrics
+metricas = MetricasRequisicoes()
 
 # Carregar modelo e dados na inicialização (para melhor performance)
-print("🔄 Carregando modelo e dados...")
-modelo = joblib.load(MODEL_PATH / 'modelo_popularity.pkl')
-dados = joblib.load(MODEL_PATH / 'dados_auxiliares.pkl')
-print("✅ Modelo carregado com sucesso!")
+print(f"🔄 Carregando modelo '{NOME_MODELO}' e dados...")
+recarregador = RecarregadorModelo(MODEL_PATH, DATA_PATH, NOME_MODELO, intervalo=INTERVALO_RECARGA,
+                                  materializado=(MODO_SERVICO == 'materializado'),
+                                  compactar_a_cada=INTERVALO_COMPACTACAO).iniciar()
+print(f"✅ Modelo carregado com sucesso! (versão {recarregador.atual.versao})")
+
+# SIGHUP pede a troca imediata para a versão apontada por models/artefatos/<modelo>/ATUAL
+if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+    signal.signal(signal.SIGHUP, lambda signum, frame: recarregador.solicitar_recarga())
 
 
 def gerar_recomendacoes(user_id, n_recomendacoes=5):
@@ -32,45 +71,75 @@ def gerar_recomendacoes(user_id, n_recomendacoes=5):
     Returns:
         list: Lista de dicionários com recomendações
     """
-    movies = dados['movies']
-    ratings = dados['ratings']
-    
-    # Filmes já avaliados pelo usuário
-    filmes_avaliados = ratings[ratings['user_id'] == user_id]['item_id'].values
-    
-    # Todos os filmes disponíveis
-    todos_filmes = movies['item_id'].values
-    
-    # Filmes não avaliados (candidatos para recomendação)
-    filmes_nao_avaliados = [f for f in todos_filmes if f not in filmes_avaliados]
-    
-    # Gerar predições usando o modelo
-    if 'item_means' in modelo:
-        predicoes = []
-        for item_id in filmes_nao_avaliados:
-            pred = modelo['item_means'].get(item_id, modelo['global_mean'])
-            predicoes.append((item_id, pred))
-    else:
-        global_mean = ratings['rating'].mean()
-        predicoes = [(item_id, global_mean) for item_id in filmes_nao_avaliados]
-    
-    # Ordenar por rating predito (maior para menor)
-    predicoes.sort(key=lambda x: x[1], reverse=True)
-    top_n = predicoes[:n_recomendacoes]
-    
-    # Montar resposta com títulos dos filmes
-    recomendacoes = []
-    for item_id, rating_pred in top_n:
-        titulo = movies[movies['item_id'] == item_id]['title'].values[0]
-        recomendacoes.append({
-            'item_id': int(item_id),
-            'titulo': titulo,
-            'rating_predito': float(rating_pred)
-        })
+    # Scorer do modelo ativo + exclusão dos filmes já avaliados + top N
+    recomendacoes = recarregador.atual.recomendar(user_id, n_recomendacoes)
     
     return recomendacoes
 
 
+def gerar_recomendacoes_serializadas(user_id, n_recomendacoes=5, cronometro=None):
+    """
+    Recomendações do usuário já serializadas em JSON (um fragmento por filme)
+    
+    Consulta o cache antes; em caso de falha calcula o máximo de recomendações,
+    assim pedidos futuros com qualquer N são atendidos fatiando o resultado
+    (com o cache desativado, calcula só as N pedidas).
+    
+    Args:
+        user_id (int): ID do usuário
+        n_recomendacoes (int): Número de recomendações a retornar
+        cronometro (Cronometro): Recebe o tempo de cada etapa (opcional)
+    
+    Returns:
+        list: Fragmentos JSON (bytes) das recomendações
+    """
+    cronometro = cronometro or CRONOMETRO_NULO
+    recomendador = recarregador.atual
+    versao = recomendador.versao or id(recomendador)
+    
+    fragmentos = cache_respostas.obter(versao, user_id, n_recomendacoes)
+    cronometro.marcar('cache')
+    if fragmentos is None:
+        # Geração lida antes do cálculo: se /avaliar invalidar o usuário no meio, a resposta não é guardada
+        geracao = cache_respostas.geracao(user_id)
+        n_calculado = MAX_RECOMENDACOES if cache_respostas.max_itens > 0 else n_recomendacoes
+        recomendacoes = recomendador.recomendar(user_id, n_calculado, cronometro=cronometro)
+        fragmentos = [json.dumps(r).encode() for r in recomendacoes]
+        cronometro.marcar('serializacao')
+        cache_respostas.guardar(versao, user_id, n_calculado, fragmentos, geracao)
+        fragmentos = fragmentos[:n_recomendacoes]
+    
+    return fragmentos
+
+
+def gerar_recomendacoes_lote(user_ids, n_recomendacoes=5, cronometro=None):
+    """
+    Gera recomendações para vários usuários em uma única passada
+    
+    Args:
+        user_ids (list): IDs dos usuários
+        n_recomendacoes (int): Número de recomendações por usuário
+        cronometro (Cronometro): Recebe o tempo de cada etapa (opcional)
+    
+    Returns:
+        list: Uma lista de recomendações por usuário, na ordem de user_ids
+    """
+    # Scores do lote como matriz (usuários x filmes), exclusão e top N por linha
+    return recarregador.atual.recomendar_lote(user_ids, n_recomendacoes, cronometro=cronometro)
+
+
+@app.before_request
+def iniciar_cronometro():
+    g.cronometro = Cronometro()
+
+
+@app.after_request
+def registrar_metricas(response):
+    # Rotas inexistentes ficam agrupadas em um único rótulo
+    metricas.registrar(request.endpoint or 'nao_encontrado', response.status_code, g.cronometro)
+    return response
+
+
 @app.route('/', methods=['GET'])
 def home():
     """
@@ -82,7 +151,11 @@ def home():
         'endpoints': {
             '/': 'GET - Informações da API',
             '/recomendar': 'POST - Gerar recomendações de filmes',
-            '/health': 'GET - Status da API'
+            '/recomendar/lote': 'POST - Gerar recomendações para vários usuários',
+            '/avaliar': 'POST - Registrar a avaliação de um filme',
+            '/similares/<item_id>': 'GET - Filmes similares a um filme',
+            '/health': 'GET - Status da API',
+            '/metrics': 'GET - Métricas de latência e erros (formato Prometheus)'
         },
         'exemplo_uso': {
             'url': '/recomendar',
@@ -100,9 +173,16 @@ def health():
     """
     Endpoint de health check - Verifica se a API está funcionando
     """
+    recomendador = recarregador.atual
     return jsonify({
         'status': 'OK',
-        'modelo_carregado': True,
+        'modelo_carregado': recomendador is not None,
+        'modelo': recomendador.nome_modelo,
+        'versao_modelo': recomendador.versao,
+        'modo_servico': 'materializado' if recomendador.materializado is not None else 'ao_vivo',
+        'modelo_carregado_em': recarregador.carregado_em,
+        'avaliacoes_pendentes': recomendador.n_recentes,
+        'cache': cache_respostas.estatisticas(),
         'mensagem': 'API funcionando corretamente'
     }), 200
 
@@ -157,34 +237,319 @@ def recomendar():
             }), 400
         
         # Validar valores
-        if user_id < 1 or user_id > 943:
+        # Usuários novos (fora do treino) são aceitos: fold-in no SVD ou popularidade
+        if user_id < 1:
+            return jsonify({
+                'erro': 'user_id deve ser um inteiro positivo'
+            }), 400
+        
+        if n_recomendacoes < 1 or n_recomendacoes > MAX_RECOMENDACOES:
+            return jsonify({
+                'erro': f'n_recomendacoes deve estar entre 1 e {MAX_RECOMENDACOES}'
+            }), 400
+        g.cronometro.marcar('validacao')
+        
+        # Gerar recomendações (fragmentos JSON, possivelmente do cache)
+        fragmentos = gerar_recomendacoes_serializadas(user_id, n_recomendacoes, g.cronometro)
+        
+        # Retornar resposta montada direto dos fragmentos já serializados
+        corpo = b'{"user_id": %d, "n_recomendacoes": %d, "total_recomendacoes": %d, "recomendacoes": [%s]}' % (
+            user_id, n_recomendacoes, len(fragmentos), b', '.join(fragmentos)
+        )
+        g.cronometro.marcar('serializacao')
+        return Response(corpo, status=200, mimetype='application/json')
+    
+    except Exception as e:
+        metricas.contar_erro(request.endpoint, e)
+        return jsonify({
+            'erro': 'Erro interno do servidor',
+            'detalhes': str(e)
+        }), 500
+
+
+@app.route('/recomendar/lote', methods=['POST'])
+def recomendar_lote():
+    """
+    Endpoint em lote - Gera recomendações para vários usuários em uma requisição
+    
+    Espera JSON no body:
+    {
+        "user_ids": [1, 2, 3],
+        "n_recomendacoes": 5
+    }
+    
+    Retorna JSON com recomendações de cada usuário:
+    {
+        "n_recomendacoes": 5,
+        "total_usuarios": 3,
+        "resultados": [{"user_id": 1, "recomendacoes": [...]}, ...]
+    }
+    """
+    try:
+        # Validar se a requisição é JSON
+        if not request.is_json:
+            return jsonify({
+                'erro': 'Content-Type deve ser application/json'
+            }), 400
+        
+        # Obter dados da requisição
+        data = request.get_json()
+        
+        # Validar campos obrigatórios
+        if 'user_ids' not in data:
+            return jsonify({
+                'erro': 'Campo "user_ids" é obrigatório'
+            }), 400
+        
+        # Extrair parâmetros
+        user_ids = data['user_ids']
+        n_recomendacoes = data.get('n_recomendacoes', 5)  # Default: 5
+        
+        # Validar tipos
+        if not isinstance(user_ids, list) or not all(isinstance(u, int) for u in user_ids):
+            return jsonify({
+                'erro': 'Campo "user_ids" deve ser uma lista de números inteiros'
+            }), 400
+        
+        if not isinstance(n_recomendacoes, int):
+            return jsonify({
+                'erro': 'Campo "n_recomendacoes" deve ser um número inteiro'
+            }), 400
+        
+        # Validar valores
+        if len(user_ids) < 1 or len(user_ids) > MAX_USUARIOS_LOTE:
+            return jsonify({
+                'erro': f'user_ids deve ter entre 1 e {MAX_USUARIOS_LOTE} usuários'
+            }), 400
+        
+        # Usuários novos (fora do treino) são aceitos: fold-in no SVD ou popularidade
+        if any(u < 1 for u in user_ids):
             return jsonify({
-                'erro': 'user_id deve estar entre 1 e 943'
+                'erro': 'Todos os user_ids devem ser inteiros positivos'
             }), 400
         
-        if n_recomendacoes < 1 or n_recomendacoes > 50:
+        if n_recomendacoes < 1 or n_recomendacoes > MAX_RECOMENDACOES:
             return jsonify({
-                'erro': 'n_recomendacoes deve estar entre 1 e 50'
+                'erro': f'n_recomendacoes deve estar entre 1 e {MAX_RECOMENDACOES}'
             }), 400
+        g.cronometro.marcar('validacao')
         
-        # Gerar recomendações
-        recomendacoes = gerar_recomendacoes(user_id, n_recomendacoes)
+        # Gerar recomendações de todos os usuários de uma vez
+        resultados = gerar_recomendacoes_lote(user_ids, n_recomendacoes, g.cronometro)
+        
+        # Retornar resposta
+        resposta = jsonify({
+            'n_recomendacoes': n_recomendacoes,
+            'total_usuarios': len(user_ids),
+            'resultados': [
+                {'user_id': user_id, 'recomendacoes': recomendacoes}
+                for user_id, recomendacoes in zip(user_ids, resultados)
+            ]
+        })
+        g.cronometro.marcar('serializacao')
+        return resposta, 200
+    
+    except Exception as e:
+        metricas.contar_erro(request.endpoint, e)
+        return jsonify({
+            'erro': 'Erro interno do servidor',
+            'detalhes': str(e)
+        }), 500
+
+
+@app.route('/avaliar', methods=['POST'])
+def avaliar():
+    """
+    Endpoint de avaliação - Registra a nota de um usuário para um filme
+    
+    A avaliação vale imediatamente (o filme sai das recomendações do usuário
+    e, no modelo de popularidade, a média do filme é atualizada) e é gravada
+    no modelo na próxima compactação.
+    
+    Espera JSON no body:
+    {
+        "user_id": 1,
+        "item_id": 50,
+        "rating": 5
+    }
+    
+    Retorna JSON com a avaliação registrada:
+    {
+        "user_id": 1,
+        "item_id": 50,
+        "rating": 5,
+        "avaliacoes_pendentes": 1
+    }
+    """
+    try:
+        # Validar se a requisição é JSON
+        if not request.is_json:
+            return jsonify({
+                'erro': 'Content-Type deve ser application/json'
+            }), 400
+        
+        # Obter dados da requisição
+        data = request.get_json()
+        
+        # Validar campos obrigatórios
+        for campo in ('user_id', 'item_id', 'rating'):
+            if campo not in data:
+                return jsonify({
+                    'erro': f'Campo "{campo}" é obrigatório'
+                }), 400
+        
+        # Extrair parâmetros
+        user_id = data['user_id']
+        item_id = data['item_id']
+        rating = data['rating']
+        
+        # Validar tipos
+        if not isinstance(user_id, int) or not isinstance(item_id, int):
+            return jsonify({
+                'erro': 'Campos "user_id" e "item_id" devem ser números inteiros'
+            }), 400
+        
+        if isinstance(rating, bool) or not isinstance(rating, (int, float)):
+            return jsonify({
+                'erro': 'Campo "rating" deve ser um número'
+            }), 400
+        
+        # Validar valores
+        # Usuários novos (fora do treino) são aceitos: fold-in no SVD ou popularidade
+        if user_id < 1:
+            return jsonify({
+                'erro': 'user_id deve ser um inteiro positivo'
+            }), 400
+        
+        # NaN passaria pela verificação de faixa (comparações com NaN são sempre falsas)
+        if not math.isfinite(rating):
+            return jsonify({
+                'erro': 'Campo "rating" deve ser um número finito'
+            }), 400
+        
+        if rating < 1 or rating > 5:
+            return jsonify({
+                'erro': 'rating deve estar entre 1 e 5'
+            }), 400
+        
+        recomendador = recarregador.atual
+        if recomendador.catalogo.posicoes([item_id])[0] < 0:
+            return jsonify({
+                'erro': f'item_id {item_id} não encontrado no catálogo'
+            }), 400
+        g.cronometro.marcar('validacao')
+        
+        # Registrar e descartar as recomendações em cache do usuário (de todos, se a avaliação
+        # muda os scores de todos, como a média do filme na popularidade)
+        pendentes = recarregador.registrar_avaliacao(user_id, item_id, rating)
+        if getattr(recomendador.scorer, 'estado_global', False):
+            cache_respostas.invalidar_todos()
+        else:
+            cache_respostas.invalidar(recomendador.versao or id(recomendador), user_id)
+        g.cronometro.marcar('registro')
         
         # Retornar resposta
         return jsonify({
             'user_id': user_id,
-            'n_recomendacoes': n_recomendacoes,
-            'total_recomendacoes': len(recomendacoes),
-            'recomendacoes': recomendacoes
+            'item_id': item_id,
+            'rating': rating,
+            'avaliacoes_pendentes': pendentes
         }), 200
     
     except Exception as e:
+        metricas.contar_erro(request.endpoint, e)
         return jsonify({
             'erro': 'Erro interno do servidor',
             'detalhes': str(e)
         }), 500
 
 
+@app.route('/similares/<int:item_id>', methods=['GET'])
+def similares(item_id):
+    """
+    Endpoint de filmes similares - "mais como este filme"
+    
+    Consulta o índice de vizinhos calculado no treinamento (uma fatia de
+    linha, sem calcular similaridades na requisição).
+    
+    Parâmetro opcional na query string: n (padrão 10, máximo 50)
+    
+    Retorna JSON com os filmes similares:
+    {
+        "item_id": 50,
+        "titulo": "Star Wars (1977)",
+        "n_similares": 10,
+        "similares": [...]
+    }
+    """
+    try:
+        # Validar parâmetros
+        n = request.args.get('n', '10')
+        if not n.isdigit() or not 1 <= int(n) <= MAX_RECOMENDACOES:
+            return jsonify({
+                'erro': f'n deve ser um inteiro entre 1 e {MAX_RECOMENDACOES}'
+            }), 400
+        n = int(n)
+        
+        recomendador = recarregador.atual
+        if recomendador.vizinhos is None:
+            return jsonify({
+                'erro': 'Índice de filmes similares indisponível: retreine o modelo'
+            }), 503
+        g.cronometro.marcar('validacao')
+        
+        # Vizinhos pré-calculados do filme
+        resultado = recomendador.similares(item_id, n, cronometro=g.cronometro)
+        if resultado is None:
+            return jsonify({
+                'erro': f'item_id {item_id} não encontrado no catálogo'
+            }), 404
+        
+        # Retornar resposta
+        pos = int(recomendador.catalogo.posicoes([item_id])[0])
+        resposta = jsonify({
+            'item_id': item_id,
+            'titulo': str(recomendador.catalogo.titulos[pos]),
+            'n_similares': len(resultado),
+            'similares': resultado
+        })
+        g.cronometro.marcar('serializacao')
+        return resposta, 200
+    
+    except Exception as e:
+        metricas.contar_erro(request.endpoint, e)
+        return jsonify({
+            'erro': 'Erro interno do servidor',
+            'detalhes': str(e)
+        }), 500
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Endpoint de métricas no formato texto do Prometheus
+    
+    Histogramas de latência por endpoint e etapa (validacao, cache, exclusao,
+    scores, top_n, titulos, serializacao...), contadores de requisições por
+    status e de erros, além do estado do cache e do modelo.
+    """
+    recomendador = recarregador.atual
+    cache = cache_respostas.estatisticas()
+    modo = 'materializado' if recomendador.materializado is not None else 'ao_vivo'
+    extras = [
+        ('recomendacao_cache_acertos_total', 'counter', 'Acertos do cache de respostas', [({}, cache['acertos'])]),
+        ('recomendacao_cache_falhas_total', 'counter', 'Falhas do cache de respostas', [({}, cache['falhas'])]),
+        ('recomendacao_cache_remocoes_total', 'counter', 'Entradas removidas do cache de respostas',
+         [({}, cache['remocoes'])]),
+        ('recomendacao_cache_itens', 'gauge', 'Entradas no cache de respostas', [({}, cache['itens'])]),
+        ('recomendacao_avaliacoes_pendentes', 'gauge', 'Avaliações recebidas aguardando compactação',
+         [({}, recomendador.n_recentes)]),
+        ('recomendacao_modelo_info', 'gauge', 'Modelo servido',
+         [({'modelo': recomendador.nome_modelo, 'versao': recomendador.versao or '', 'modo': modo}, 1)]),
+    ]
+    return Response(metricas.texto_prometheus(extras), status=200, mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == '__main__':
     # Rodar servidor Flask
     # debug=True: recarrega automaticamente ao modificar código
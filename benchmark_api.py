@@ -0,0 +1,315 @@
+"""
+Benchmark da API de Recomendação
+Mede vazão, latência (p50/p95/p99) e alocações de /recomendar e o custo de cada etapa
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import subprocess
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+
+def gerar_usuarios(n_requisicoes, distribuicao='uniforme', n_usuarios=943, expoente_zipf=1.1, seed=42):
+    """
+    Sequência de user_ids das requisições
+
+    Na distribuição zipf o usuário de posição k no ranking recebe peso 1/k^s;
+    o ranking é uma permutação aleatória dos ids, então os usuários "quentes"
+    não são sempre os de id baixo.
+
+    Args:
+        n_requisicoes (int): Tamanho da sequência
+        distribuicao (str): 'uniforme' ou 'zipf'
+        n_usuarios (int): user_ids sorteados entre 1 e n_usuarios
+        expoente_zipf (float): Expoente s da distribuição zipf
+        seed (int): Semente do gerador
+
+    Returns:
+        np.ndarray: user_ids
+    """
+    rng = np.random.default_rng(seed)
+    if distribuicao == 'uniforme':
+        return rng.integers(1, n_usuarios + 1, size=n_requisicoes)
+
+    pesos = 1.0 / np.arange(1, n_usuarios + 1) ** expoente_zipf
+    ranking = rng.permutation(np.arange(1, n_usuarios + 1))
+    return ranking[rng.choice(n_usuarios, size=n_requisicoes, p=pesos / pesos.sum())]
+
+
+def resumir_latencias(latencias, duracao, erros=0):
+    """Vazão e percentis (em ms) de uma lista de latências em segundos"""
+    latencias_ms = np.asarray(latencias) * 1000
+    return {
+        'requisicoes': len(latencias_ms),
+        'erros': erros,
+        'duracao_s': round(duracao, 4),
+        'vazao_req_s': round(len(latencias_ms) / duracao, 2) if duracao > 0 else None,
+        'latencia_ms': {
+            'media': round(float(latencias_ms.mean()), 4),
+            'p50': round(float(np.percentile(latencias_ms, 50)), 4),
+            'p95': round(float(np.percentile(latencias_ms, 95)), 4),
+            'p99': round(float(np.percentile(latencias_ms, 99)), 4),
+            'max': round(float(latencias_ms.max()), 4),
+        },
+    }
+
+
+def executar_carga(requisitar, user_ids, concorrencia):
+    """
+    Executa as requisições com concorrência fixa (cada thread envia uma por vez)
+
+    Args:
+        requisitar (callable): requisitar(user_id) -> status HTTP
+        user_ids (np.ndarray): Sequência de user_ids
+        concorrencia (int): Número de threads enviando requisições
+
+    Returns:
+        dict: Resumo de vazão e latência
+    """
+    latencias = [[] for _ in range(concorrencia)]
+    erros = [0] * concorrencia
+
+    def trabalhador(i):
+        for user_id in user_ids[i::concorrencia]:
+            inicio = time.perf_counter()
+            status = requisitar(int(user_id))
+            latencias[i].append(time.perf_counter() - inicio)
+            if status != 200:
+                erros[i] += 1
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as pool:
+        list(pool.map(trabalhador, range(concorrencia)))
+    duracao = time.perf_counter() - inicio
+    return resumir_latencias([l for lista in latencias for l in lista], duracao, sum(erros))
+
+
+def requisitor_cliente_teste(app, n_recomendacoes):
+    """requisitar(user_id) via test client do Flask (sem rede), um cliente por thread"""
+    local = threading.local()
+
+    def requisitar(user_id):
+        if not hasattr(local, 'cliente'):
+            local.cliente = app.test_client()
+        resposta = local.cliente.post('/recomendar', json={'user_id': user_id, 'n_recomendacoes': n_recomendacoes})
+        resposta.get_data()
+        return resposta.status_code
+
+    return requisitar
+
+
+def requisitor_socket(porta, n_recomendacoes):
+    """requisitar(user_id) via HTTP em um socket local"""
+    def requisitar(user_id):
+        conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=30)
+        try:
+            corpo = json.dumps({'user_id': user_id, 'n_recomendacoes': n_recomendacoes})
+            conexao.request('POST', '/recomendar', corpo, {'Content-Type': 'application/json'})
+            resposta = conexao.getresponse()
+            resposta.read()
+            return resposta.status
+        finally:
+            conexao.close()
+
+    return requisitar
+
+
+def iniciar_servidor(app):
+    """Sobe a API em uma porta livre de 127.0.0.1 (servidor com threads do werkzeug)"""
+    from werkzeug.serving import make_server
+
+    # Sem o log de cada requisição no terminal
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    servidor = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, name='servidor-benchmark', daemon=True).start()
+    return servidor
+
+
+def medir_alocacoes(requisitar, user_ids):
+    """Bytes alocados por requisição (pico e retidos) medidos com tracemalloc, em sequência"""
+    picos, retidos = [], []
+    tracemalloc.start()
+    try:
+        for user_id in user_ids:
+            antes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            requisitar(int(user_id))
+            atual, pico = tracemalloc.get_traced_memory()
+            picos.append(pico - antes)
+            retidos.append(atual - antes)
+    finally:
+        tracemalloc.stop()
+    return {
+        'requisicoes': len(picos),
+        'pico_bytes_medio': int(np.mean(picos)),
+        'pico_bytes_p95': int(np.percentile(picos, 95)),
+        'retidos_bytes_medio': int(np.mean(retidos)),
+    }
+
+
+def cronometrar(funcao, argumentos):
+    """Tempo (em µs) de funcao(*args) para cada tupla de argumentos"""
+    tempos = []
+    for args in argumentos:
+        inicio = time.perf_counter()
+        funcao(*args)
+        tempos.append(time.perf_counter() - inicio)
+    tempos_us = np.asarray(tempos) * 1e6
+    return {
+        'chamadas': len(tempos_us),
+        'media_us': round(float(tempos_us.mean()), 3),
+        'p50_us': round(float(np.percentile(tempos_us, 50)), 3),
+        'p99_us': round(float(np.percentile(tempos_us, 99)), 3),
+    }
+
+
+def micro_benchmarks(recomendador, user_ids, n_recomendacoes):
+    """
+    Custo de cada etapa de uma recomendação ao vivo, isolada das demais
+
+    scores (scorer do modelo), exclusão (máscara dos filmes avaliados),
+    top_n (argpartition), titulos (montagem das respostas pelo catálogo)
+    e serializacao (json.dumps de cada filme).
+    """
+    from servico_recomendacao import selecionar_top_n
+
+    user_ids = [int(u) for u in user_ids]
+    scores = {u: recomendador.scorer.scores(u, recomendador.indice) for u in user_ids}
+    mascaras = {u: recomendador.mascara(u) for u in user_ids}
+    tops = {u: selecionar_top_n(scores[u], n_recomendacoes, excluir=mascaras[u]) for u in user_ids}
+    respostas = {u: recomendador.respostas(tops[u], scores[u][tops[u]]) for u in user_ids}
+
+    return {
+        'scores': cronometrar(lambda u: recomendador.scorer.scores(u, recomendador.indice), [(u,) for u in user_ids]),
+        'exclusao': cronometrar(recomendador.mascara, [(u,) for u in user_ids]),
+        'top_n': cronometrar(lambda u: selecionar_top_n(scores[u], n_recomendacoes, excluir=mascaras[u]),
+                             [(u,) for u in user_ids]),
+        'titulos': cronometrar(lambda u: recomendador.respostas(tops[u], scores[u][tops[u]]),
+                               [(u,) for u in user_ids]),
+        'serializacao': cronometrar(lambda u: [json.dumps(r).encode() for r in respostas[u]],
+                                    [(u,) for u in user_ids]),
+        'recomendar_completo': cronometrar(recomendador.recomendar, [(u, n_recomendacoes) for u in user_ids]),
+    }
+
+
+def commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de carga e latência da API de recomendação')
+    parser.add_argument('--requisicoes', type=int, default=2000,
+                        help='Requisições por cenário (padrão: 2000)')
+    parser.add_argument('--concorrencia', type=int, default=8,
+                        help='Requisições simultâneas (padrão: 8)')
+    parser.add_argument('--distribuicoes', nargs='+', default=['uniforme', 'zipf'], choices=['uniforme', 'zipf'],
+                        help='Distribuições de user_id (padrão: uniforme zipf)')
+    parser.add_argument('--n-usuarios', type=int, default=943,
+                        help='user_ids sorteados entre 1 e n (padrão: 943)')
+    parser.add_argument('--expoente-zipf', type=float, default=1.1,
+                        help='Expoente da distribuição zipf (padrão: 1.1)')
+    parser.add_argument('--n-recomendacoes', type=int, default=10,
+                        help='n_recomendacoes de cada requisição (padrão: 10)')
+    parser.add_argument('--modelo', default=None,
+                        help='Modelo servido (padrão: MODELO_API ou o melhor do treino, models/artefatos/MELHOR)')
+    parser.add_argument('--modo', default=None, choices=['ao_vivo', 'materializado'],
+                        help='Modo de serviço (MODO_SERVICO)')
+    parser.add_argument('--sem-cache', action='store_true',
+                        help='Desativar o cache de respostas (CACHE_MAX_ITENS=0)')
+    parser.add_argument('--sem-socket', action='store_true',
+                        help='Medir só pelo test client do Flask')
+    parser.add_argument('--saida', default='.cache/benchmark_api.json',
+                        help='Arquivo JSON com os resultados (padrão: .cache/benchmark_api.json)')
+    args = parser.parse_args()
+
+    # A API lê a configuração do ambiente ao ser importada; recarga e compactação ficam desligadas
+    if args.modelo:
+        os.environ['MODELO_API'] = args.modelo
+    if args.modo:
+        os.environ['MODO_SERVICO'] = args.modo
+    if args.sem_cache:
+        os.environ['CACHE_MAX_ITENS'] = '0'
+    os.environ.setdefault('INTERVALO_RECARGA', '0')
+    os.environ.setdefault('INTERVALO_COMPACTACAO', '0')
+    import app as api
+
+    recomendador = api.recarregador.atual
+    resultados = {
+        'commit': commit_atual(),
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'modelo': recomendador.nome_modelo,
+        'versao_modelo': recomendador.versao,
+        'modo_servico': 'materializado' if recomendador.materializado is not None else 'ao_vivo',
+        'cache': not args.sem_cache,
+        'parametros': {
+            'requisicoes': args.requisicoes,
+            'concorrencia': args.concorrencia,
+            'n_recomendacoes': args.n_recomendacoes,
+            'n_usuarios': args.n_usuarios,
+            'expoente_zipf': args.expoente_zipf,
+        },
+        'cenarios': {},
+    }
+
+    transportes = {'cliente_teste': requisitor_cliente_teste(api.app, args.n_recomendacoes)}
+    servidor = None
+    if not args.sem_socket:
+        servidor = iniciar_servidor(api.app)
+        transportes['socket'] = requisitor_socket(servidor.server_port, args.n_recomendacoes)
+
+    try:
+        for distribuicao in args.distribuicoes:
+            user_ids = gerar_usuarios(args.requisicoes, distribuicao, args.n_usuarios, args.expoente_zipf)
+            for transporte, requisitar in transportes.items():
+                # Cada cenário começa com o cache vazio e algumas requisições de aquecimento
+                api.cache_respostas.limpar()
+                for user_id in user_ids[:20]:
+                    requisitar(int(user_id))
+
+                nome = f'{transporte}_{distribuicao}'
+                print(f"⏱️  {nome}: {args.requisicoes} requisições, concorrência {args.concorrencia}...")
+                resultados['cenarios'][nome] = executar_carga(requisitar, user_ids, args.concorrencia)
+                resumo = resultados['cenarios'][nome]
+                print(f"   {resumo['vazao_req_s']:.0f} req/s | p50 {resumo['latencia_ms']['p50']:.2f}ms | "
+                      f"p95 {resumo['latencia_ms']['p95']:.2f}ms | p99 {resumo['latencia_ms']['p99']:.2f}ms | "
+                      f"erros {resumo['erros']}")
+
+        print("🧠 Medindo alocações por requisição...")
+        api.cache_respostas.limpar()
+        amostra = gerar_usuarios(200, 'uniforme', args.n_usuarios, seed=7)
+        resultados['alocacoes'] = medir_alocacoes(transportes['cliente_teste'], amostra)
+
+        print("🔬 Micro-benchmarks das etapas...")
+        resultados['etapas'] = micro_benchmarks(recomendador, amostra, args.n_recomendacoes)
+        for etapa, tempos in resultados['etapas'].items():
+            print(f"   {etapa:20} | média {tempos['media_us']:9.1f}µs | p99 {tempos['p99_us']:9.1f}µs")
+    finally:
+        if servidor is not None:
+            servidor.shutdown()
+
+    diretorio_saida = os.path.dirname(args.saida)
+    if diretorio_saida:
+        os.makedirs(diretorio_saida, exist_ok=True)
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(resultados, f, indent=2, ensure_ascii=False)
+    print(f"\n✅ Resultados salvos em: {args.saida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""
+Leitura dos datasets MovieLens (100k, 1M, 10M, 20M/25M)
+Detecta o formato dos arquivos e carrega as avaliações em blocos, com tipos compactos.
+O resultado fica em um cache colunar (.npy por coluna) para as próximas leituras.
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# Arquivos de cada formato, na ordem de detecção
+FORMATOS = {
+    '100k': {'avaliacoes': 'u.data', 'filmes': 'u.item', 'usuarios': 'u.user'},   # ML-100k (tab e pipe)
+    'dat': {'avaliacoes': 'ratings.dat', 'filmes': 'movies.dat', 'usuarios': 'users.dat'},   # ML-1M, ML-10M (::)
+    'csv': {'avaliacoes': 'ratings.csv', 'filmes': 'movies.csv', 'usuarios': None},   # ML-20M, ML-25M
+}
+
+# Linhas de avaliações lidas por bloco
+TAMANHO_BLOCO = 1_000_000
+
+# Cache colunar dentro do diretório do dataset: <data_path>/.cache/<nome>/<coluna>.npy
+PASTA_CACHE = '.cache'
+FORMATO_CACHE = 1
+
+COLUNAS_AVALIACOES = ['user_id', 'item_id', 'rating', 'timestamp']
+TIPOS_AVALIACOES = {'user_id': np.int32, 'item_id': np.int32, 'rating': np.float32, 'timestamp': np.int32}
+
+
+def detectar_formato(data_path):
+    """Formato do dataset em data_path ('100k', 'dat' ou 'csv'), pelo arquivo de avaliações presente"""
+    for formato, arquivos in FORMATOS.items():
+        if (data_path / arquivos['avaliacoes']).exists():
+            return formato
+    esperados = ', '.join(arquivos['avaliacoes'] for arquivos in FORMATOS.values())
+    raise FileNotFoundError(f'Nenhum arquivo de avaliações em {data_path} (esperado: {esperados})')
+
+
+def _chave_fontes(fontes):
+    """Identifica a versão dos arquivos de origem pelo nome, tamanho e mtime"""
+    chave = []
+    for caminho in fontes:
+        info = caminho.stat()
+        chave.append([caminho.name, info.st_size, info.st_mtime_ns])
+    return chave
+
+
+def _gravar_cache(diretorio, chave, arrays, meta):
+    temporario = diretorio.parent / f'.{diretorio.name}.{os.getpid()}.tmp'
+    shutil.rmtree(temporario, ignore_errors=True)
+    temporario.mkdir(parents=True)
+    for nome, array in arrays.items():
+        np.save(temporario / f'{nome}.npy', np.ascontiguousarray(array))
+    with open(temporario / 'manifest.json', 'w', encoding='utf-8') as f:
+        json.dump({'chave': chave, 'arrays': list(arrays), 'meta': meta}, f, ensure_ascii=False)
+
+    shutil.rmtree(diretorio, ignore_errors=True)
+    os.rename(temporario, diretorio)
+
+
+def em_cache(data_path, nome, fontes, calcular, mmap=False, usar_cache=True):
+    """
+    Resultado de calcular() guardado no cache colunar do dataset
+
+    calcular devolve (arrays, meta): um dict de arrays numpy, salvos um por
+    arquivo .npy, e um dict serializável em JSON com o restante. O cache vale
+    enquanto nome, tamanho e mtime dos arquivos em fontes não mudarem; depois
+    disso a próxima chamada lê os arquivos de novo e regrava o cache.
+
+    Args:
+        data_path (Path): Diretório do dataset (o cache fica em data_path/.cache)
+        nome (str): Nome da entrada no cache
+        fontes (list): Arquivos dos quais o resultado depende
+        calcular (callable): Lê os arquivos e devolve (arrays, meta)
+        mmap (bool): Abrir os arrays do cache com mmap em vez de lê-los
+        usar_cache (bool): False ignora o cache (sempre chama calcular)
+
+    Returns:
+        tuple: (arrays, meta)
+    """
+    if not usar_cache:
+        return calcular()
+
+    diretorio = data_path / PASTA_CACHE / nome
+    chave = {'formato': FORMATO_CACHE, 'fontes': _chave_fontes(fontes)}
+    try:
+        with open(diretorio / 'manifest.json', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest['chave'] == chave:
+            arrays = {n: np.load(diretorio / f'{n}.npy', mmap_mode='r' if mmap else None)
+                      for n in manifest['arrays']}
+            return arrays, manifest['meta']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    arrays, meta = calcular()
+    try:
+        _gravar_cache(diretorio, chave, arrays, meta)
+    except OSError as e:
+        # Diretório somente leitura: segue sem cache
+        print(f"⚠️  Não foi possível gravar o cache em {diretorio}: {e}")
+    return arrays, meta
+
+
+def _arrays_dataframe(df):
+    """Colunas do DataFrame como arrays sem objetos Python (texto vira unicode de tamanho fixo)"""
+    arrays = {}
+    for coluna in df.columns:
+        valores = df[coluna]
+        if pd.api.types.is_numeric_dtype(valores):
+            arrays[coluna] = valores.values
+            continue
+        nulos = valores.isna().values
+        arrays[coluna] = np.asarray(valores.fillna('').astype(str).tolist(), dtype=str)
+        if nulos.any():
+            arrays[f'{coluna}__nulos'] = nulos
+    return arrays, {'colunas': list(df.columns)}
+
+
+def _dataframe_de_arrays(arrays, meta):
+    colunas = {}
+    for coluna in meta['colunas']:
+        serie = pd.Series(arrays[coluna])
+        if f'{coluna}__nulos' in arrays:
+            serie = serie.where(~arrays[f'{coluna}__nulos'])
+        colunas[coluna] = serie
+    return pd.DataFrame(colunas)
+
+
+def _ler_blocos_avaliacoes(data_path, formato, tamanho_bloco):
+    """Leitor em blocos do arquivo de avaliações, já com os tipos compactos"""
+    caminho = data_path / FORMATOS[formato]['avaliacoes']
+    if formato == '100k':
+        opcoes = {'sep': '\t', 'header': None, 'names': COLUNAS_AVALIACOES}
+    elif formato == 'dat':
+        # 'u::i::r::t' separado por ':' vira u, '', i, '', r, '', t (o leitor em C não aceita '::')
+        opcoes = {'sep': ':', 'header': None, 'usecols': [0, 2, 4, 6],
+                  'names': ['user_id', '_1', 'item_id', '_2', 'rating', '_3', 'timestamp']}
+    else:
+        opcoes = {'sep': ',', 'header': 0, 'names': COLUNAS_AVALIACOES}
+    return pd.read_csv(caminho, dtype=TIPOS_AVALIACOES, chunksize=tamanho_bloco, **opcoes)
+
+
+class _MapaIds:
+    """Remapeia ids originais para índices densos 0..n-1, na ordem em que aparecem"""
+
+    def __init__(self):
+        self.tabela = np.full(0, -1, dtype=np.int32)
+        self.novos = []
+        self.n = 0
+
+    def mapear(self, ids):
+        maior = int(ids.max()) if len(ids) else -1
+        if maior >= len(self.tabela):
+            crescimento = max(maior + 1, 2 * len(self.tabela)) - len(self.tabela)
+            self.tabela = np.concatenate([self.tabela, np.full(crescimento, -1, dtype=np.int32)])
+
+        novos = np.unique(ids[self.tabela[ids] < 0])
+        self.tabela[novos] = np.arange(self.n, self.n + len(novos), dtype=np.int32)
+        self.n += len(novos)
+        self.novos.append(novos.astype(np.int32))
+        return self.tabela[ids]
+
+    def ids(self):
+        """Id original de cada índice denso"""
+        return np.concatenate(self.novos) if self.novos else np.empty(0, dtype=np.int32)
+
+
+class AvaliacoesCompactas:
+    """
+    Avaliações em arrays compactos, com usuários e filmes como índices densos
+
+    user_idx e item_idx (int32) indexam user_ids e item_ids, que guardam os
+    ids originais. As notas ficam em int8 quando todas são inteiras (100k, 1M)
+    e em float32 quando há meias estrelas (10M em diante).
+    """
+
+    def __init__(self, user_idx, item_idx, notas, timestamps, user_ids, item_ids):
+        self.user_idx = user_idx
+        self.item_idx = item_idx
+        self.notas = notas
+        self.timestamps = timestamps
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+
+    def __len__(self):
+        return len(self.notas)
+
+    def dataframe(self):
+        """DataFrame com user_id, item_id (ids originais), rating e timestamp"""
+        return pd.DataFrame({
+            'user_id': self.user_ids[self.user_idx],
+            'item_id': self.item_ids[self.item_idx],
+            'rating': self.notas,
+            'timestamp': self.timestamps,
+        })
+
+
+def carregar_avaliacoes(data_path, tamanho_bloco=TAMANHO_BLOCO, mmap=False, usar_cache=True):
+    """
+    Carrega as avaliações de qualquer formato MovieLens em blocos
+
+    Cada bloco é lido já com tipos compactos e tem os ids remapeados para
+    índices densos; só os arrays compactos dos blocos ficam em memória, então
+    o pico da leitura é cerca de duas vezes o tamanho final (mais um bloco).
+    As leituras seguintes vêm do cache colunar, sem passar pelo texto.
+
+    Args:
+        data_path (Path): Diretório do dataset
+        tamanho_bloco (int): Linhas lidas por bloco
+        mmap (bool): Abrir os arrays do cache com mmap
+        usar_cache (bool): Usar (e gravar) o cache colunar
+
+    Returns:
+        AvaliacoesCompactas: Avaliações na ordem do arquivo
+    """
+    formato = detectar_formato(data_path)
+    arrays, _ = em_cache(data_path, 'avaliacoes', [data_path / FORMATOS[formato]['avaliacoes']],
+                         lambda: (_ler_avaliacoes(data_path, formato, tamanho_bloco), {}),
+                         mmap=mmap, usar_cache=usar_cache)
+    return AvaliacoesCompactas(**arrays)
+
+
+def _ler_avaliacoes(data_path, formato, tamanho_bloco):
+    usuarios, filmes = _MapaIds(), _MapaIds()
+    blocos = {'user_idx': [], 'item_idx': [], 'notas': [], 'timestamps': []}
+    notas_inteiras = True
+
+    for bloco in _ler_blocos_avaliacoes(data_path, formato, tamanho_bloco):
+        notas = bloco['rating'].values
+        notas_inteiras = notas_inteiras and bool(np.all(notas == np.floor(notas)))
+        blocos['user_idx'].append(usuarios.mapear(bloco['user_id'].values))
+        blocos['item_idx'].append(filmes.mapear(bloco['item_id'].values))
+        blocos['notas'].append(notas)
+        blocos['timestamps'].append(bloco['timestamp'].values)
+
+    arrays = {}
+    for nome, partes in blocos.items():
+        arrays[nome] = np.concatenate(partes)
+        partes.clear()
+    if notas_inteiras:
+        arrays['notas'] = arrays['notas'].astype(np.int8)
+    arrays['user_ids'] = usuarios.ids()
+    arrays['item_ids'] = filmes.ids()
+    return arrays
+
+
+def carregar_filmes(data_path, usar_cache=True):
+    """
+    Carrega os filmes com item_id, title e uma coluna genre_<i> (0/1) por gênero
+
+    Args:
+        data_path (Path): Diretório do dataset
+        usar_cache (bool): Usar (e gravar) o cache colunar
+
+    Returns:
+        tuple: (DataFrame de filmes, lista com o nome de cada gênero)
+    """
+    formato = detectar_formato(data_path)
+    fontes = [data_path / FORMATOS[formato]['filmes']]
+    if formato == '100k':
+        fontes.append(data_path / 'u.genre')
+
+    def calcular():
+        filmes, nomes_generos = _ler_filmes(data_path, formato)
+        arrays, meta = _arrays_dataframe(filmes)
+        return arrays, {**meta, 'nomes_generos': nomes_generos}
+
+    arrays, meta = em_cache(data_path, 'filmes', fontes, calcular, usar_cache=usar_cache)
+    return _dataframe_de_arrays(arrays, meta), meta['nomes_generos']
+
+
+def _ler_filmes(data_path, formato):
+    caminho = data_path / FORMATOS[formato]['filmes']
+
+    if formato == '100k':
+        nomes_generos = pd.read_csv(data_path / 'u.genre', sep='|', names=['genero', 'id'])['genero'].tolist()
+        colunas_generos = [f'genre_{i}' for i in range(len(nomes_generos))]
+        filmes = pd.read_csv(caminho, sep='|', encoding='latin-1',
+                             names=['item_id', 'title', 'release_date', 'video_release_date', 'imdb_url'] +
+                             colunas_generos,
+                             dtype={'item_id': np.int32, **{c: np.int8 for c in colunas_generos}})
+        return filmes, nomes_generos
+
+    if formato == 'dat':
+        filmes = pd.read_csv(caminho, sep='::', engine='python', encoding='latin-1',
+                             names=['item_id', 'title', 'genres'], dtype={'item_id': np.int32})
+    else:
+        filmes = pd.read_csv(caminho, header=0, names=['item_id', 'title', 'genres'], dtype={'item_id': np.int32})
+
+    # Gêneros 'A|B|C' viram colunas 0/1, como no u.item do 100k
+    generos = filmes.pop('genres').str.get_dummies(sep='|').astype(np.int8)
+    nomes_generos = generos.columns.tolist()
+    generos.columns = [f'genre_{i}' for i in range(len(nomes_generos))]
+    return pd.concat([filmes, generos], axis=1), nomes_generos
+
+
+def carregar_usuarios(data_path, usar_cache=True):
+    """Dados demográficos dos usuários (None nos formatos que não os têm)"""
+    formato = detectar_formato(data_path)
+    arquivo = FORMATOS[formato]['usuarios']
+    if arquivo is None or not (data_path / arquivo).exists():
+        return None
+
+    def calcular():
+        if formato == '100k':
+            usuarios = pd.read_csv(data_path / arquivo, sep='|',
+                                   names=['user_id', 'age', 'gender', 'occupation', 'zip_code'])
+        else:
+            usuarios = pd.read_csv(data_path / arquivo, sep='::', engine='python',
+                                   names=['user_id', 'gender', 'age', 'occupation', 'zip_code'])
+        return _arrays_dataframe(usuarios)
+
+    arrays, meta = em_cache(data_path, 'usuarios', [data_path / arquivo], calcular, usar_cache=usar_cache)
+    return _dataframe_de_arrays(arrays, meta)
@@ -7,6 +7,13 @@ Análise estatística para validar se o sistema de recomendação
 melhora a taxa de conversão do e-commerce.
 """
 
+import argparse
+import io
+import json
+import os
+import time
+from pathlib import Path
+
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -14,6 +21,8 @@ import seaborn as sns
 from scipy import stats
 from datetime import datetime
 
+CHECKPOINT_PADRAO = '.cache/ab_checkpoint.json'
+
 def carregar_dados():
     """Carrega e prepara os dados do teste A/B"""
     df = pd.read_csv('ab_test_data.csv')
@@ -21,6 +30,151 @@ def carregar_dados():
     df['date'] = df['timestamp'].dt.date
     return df
 
+def agregados_vazios(arquivo='ab_test_data.csv'):
+    """
+    Estatísticas suficientes do teste A/B: usuários e conversões por grupo e por dia
+    
+    'offset' é a posição (em bytes) até onde o log já foi lido; com ele a
+    análise retoma de um checkpoint processando só os eventos novos.
+    """
+    return {'arquivo': str(arquivo), 'offset': 0, 'cabecalho': None, 'eventos': 0, 'grupos': {}, 'dias': {}}
+
+def _acumular(agregados, dias, grupos, convertidos):
+    """Soma contagens e conversões de um bloco de eventos aos agregados"""
+    contagens = pd.DataFrame({'dia': dias, 'grupo': grupos, 'convertido': convertidos}) \
+        .groupby(['dia', 'grupo'])['convertido'].agg(['count', 'sum'])
+    
+    for (dia, grupo), n, x in zip(contagens.index, contagens['count'], contagens['sum']):
+        total = agregados['grupos'].setdefault(grupo, {'n': 0, 'conversoes': 0})
+        total['n'] += int(n)
+        total['conversoes'] += int(x)
+        diario = agregados['dias'].setdefault(str(dia), {}).setdefault(grupo, {'n': 0, 'conversoes': 0})
+        diario['n'] += int(n)
+        diario['conversoes'] += int(x)
+    agregados['eventos'] += len(grupos)
+
+def agregados_de_dataframe(df):
+    """Agregados de um DataFrame já carregado (mesmo formato do modo streaming)"""
+    agregados = agregados_vazios()
+    _acumular(agregados, df['timestamp'].astype(str).str.slice(0, 10), df['group'], df['converted'])
+    return agregados
+
+def atualizar_agregados(agregados, arquivo='ab_test_data.csv', tamanho_bloco=64 * 1024 * 1024,
+                        seguir=False, checkpoint=None):
+    """
+    Lê o log de eventos a partir do offset dos agregados, em blocos, e atualiza as contagens
+    
+    Cada bloco é completado até o fim da linha e lido pelo pandas só com as
+    colunas usadas (a data é o prefixo do timestamp, sem conversão para datetime).
+    Com seguir=True uma última linha sem quebra de linha é considerada ainda em
+    escrita e fica para a próxima leitura (modo tail). Se o arquivo ficou menor
+    que o offset (log rotacionado), a análise recomeça do início.
+    
+    Args:
+        agregados (dict): Agregados a atualizar (de agregados_vazios ou de um checkpoint)
+        arquivo (str): Log de eventos CSV (user_id, timestamp, group, converted)
+        tamanho_bloco (int): Bytes lidos por bloco
+        seguir (bool): Modo tail: não consumir a última linha incompleta
+        checkpoint (str): Se informado, o checkpoint é salvo após cada bloco
+    
+    Returns:
+        int: Número de eventos novos processados
+    """
+    novos = 0
+    with open(arquivo, 'rb') as log:
+        if os.fstat(log.fileno()).st_size < agregados['offset']:
+            print("⚠️  Log menor que o checkpoint (rotacionado?): reprocessando do início")
+            agregados.update(agregados_vazios(arquivo))
+        
+        if agregados['offset'] == 0:
+            cabecalho = log.readline()
+            if not cabecalho.endswith(b'\n'):
+                return 0
+            agregados['cabecalho'] = cabecalho.decode()
+            agregados['offset'] = len(cabecalho)
+        cabecalho = agregados['cabecalho'].encode()
+        log.seek(agregados['offset'])
+        
+        while True:
+            bloco = log.read(tamanho_bloco)
+            if not bloco:
+                break
+            bloco += log.readline()
+            incompleto = seguir and not bloco.endswith(b'\n')
+            if incompleto:
+                bloco = bloco[:bloco.rfind(b'\n') + 1]
+            
+            df = pd.read_csv(io.BytesIO(cabecalho + bloco), usecols=['timestamp', 'group', 'converted'],
+                             dtype={'timestamp': str})
+            _acumular(agregados, df['timestamp'].str.slice(0, 10), df['group'], df['converted'])
+            agregados['offset'] += len(bloco)
+            novos += len(df)
+            if checkpoint:
+                salvar_checkpoint(agregados, checkpoint)
+            if incompleto:
+                break
+    return novos
+
+def salvar_checkpoint(agregados, caminho=CHECKPOINT_PADRAO):
+    """Salva os agregados em JSON (escrita atômica: um checkpoint pela metade nunca é lido)"""
+    caminho = Path(caminho)
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    temporario = caminho.with_suffix('.tmp')
+    temporario.write_text(json.dumps(agregados, ensure_ascii=False))
+    os.replace(temporario, caminho)
+
+def carregar_checkpoint(caminho=CHECKPOINT_PADRAO, arquivo='ab_test_data.csv'):
+    """Agregados salvos para o mesmo log, ou agregados vazios se não houver checkpoint"""
+    caminho = Path(caminho)
+    if caminho.exists():
+        agregados = json.loads(caminho.read_text())
+        if agregados['arquivo'] == str(arquivo):
+            return agregados
+        print(f"⚠️  Checkpoint {caminho} é de outro log ({agregados['arquivo']}): começando do zero")
+    return agregados_vazios(arquivo)
+
+def conversao_diaria(agregados):
+    """Taxa de conversão por dia (linhas) e grupo (colunas) a partir dos agregados"""
+    return pd.DataFrame({
+        dia: {grupo: c['conversoes'] / c['n'] for grupo, c in grupos.items()}
+        for dia, grupos in sorted(agregados['dias'].items())
+    }).T
+
+def teste_z_proporcoes(n1, x1, n2, x2, confianca=0.95):
+    """
+    Teste Z bicaudal para duas proporções, só com as contagens (tempo constante)
+    
+    Args:
+        n1, x1 (int): Usuários e conversões do controle
+        n2, x2 (int): Usuários e conversões do treatment
+        confianca (float): Nível de confiança do intervalo
+    
+    Returns:
+        dict: Proporções, estatística Z, p-valor, diferença e intervalo de confiança
+    """
+    p1, p2 = x1/n1, x2/n2
+    
+    # Proporção combinada e erro padrão
+    p_combined = (x1 + x2) / (n1 + n2)
+    se = np.sqrt(p_combined * (1 - p_combined) * (1/n1 + 1/n2))
+    
+    z_stat = (p2 - p1) / se
+    p_value = 2 * (1 - stats.norm.cdf(abs(z_stat)))
+    z_critical = stats.norm.ppf(1 - (1 - confianca) / 2)
+    
+    diff = p2 - p1
+    return {
+        'p1': p1,
+        'p2': p2,
+        'p_combined': p_combined,
+        'se': se,
+        'z_stat': z_stat,
+        'z_critical': z_critical,
+        'p_value': p_value,
+        'diferenca': diff,
+        'ic_95': (diff - z_critical * se, diff + z_critical * se)
+    }
+
 def estatisticas_descritivas(df):
     """Calcula estatísticas descritivas por grupo"""
     print("=" * 60)
@@ -88,20 +242,18 @@ def visualizacoes(df):
     plt.tight_layout()
     plt.show()
 
-def teste_hipotese(df):
-    """Executa teste de hipótese bicaudal para comparar proporções"""
+def teste_hipotese(dados):
+    """Executa teste de hipótese bicaudal para comparar proporções (DataFrame ou agregados do streaming)"""
     print("\n" + "=" * 60)
     print("🧪 TESTE DE HIPÓTESE - TESTE Z PARA PROPORÇÕES")
     print("=" * 60)
     
-    # Separar dados por grupo
-    control = df[df['group'] == 'control']['converted']
-    treatment = df[df['group'] == 'treatment']['converted']
-    
-    # Estatísticas dos grupos
-    n1, n2 = len(control), len(treatment)
-    x1, x2 = control.sum(), treatment.sum()
-    p1, p2 = x1/n1, x2/n2
+    # Contagens por grupo: o teste só precisa delas
+    grupos = dados['grupos'] if isinstance(dados, dict) else agregados_de_dataframe(dados)['grupos']
+    n1, x1 = grupos['control']['n'], grupos['control']['conversoes']
+    n2, x2 = grupos['treatment']['n'], grupos['treatment']['conversoes']
+    resultado = teste_z_proporcoes(n1, x1, n2, x2)
+    p1, p2 = resultado['p1'], resultado['p2']
     
     print(f"\n📋 Dados do Teste:")
     print(f"Grupo Controle: {x1}/{n1} conversões (p1 = {p1:.4f})")
@@ -115,20 +267,9 @@ def teste_hipotese(df):
     print(f"Teste: Bicaudal")
     
     # Teste Z para duas proporções
-    # Proporção combinada
-    p_combined = (x1 + x2) / (n1 + n2)
-    
-    # Erro padrão
-    se = np.sqrt(p_combined * (1 - p_combined) * (1/n1 + 1/n2))
-    
-    # Estatística Z
-    z_stat = (p2 - p1) / se
-    
-    # P-valor (teste bicaudal)
-    p_value = 2 * (1 - stats.norm.cdf(abs(z_stat)))
-    
-    # Valor crítico para α = 0.05 (bicaudal)
-    z_critical = stats.norm.ppf(0.975)  # 1.96
+    p_combined, se = resultado['p_combined'], resultado['se']
+    z_stat, p_value = resultado['z_stat'], resultado['p_value']
+    z_critical = resultado['z_critical']  # 1.96
     
     print(f"\n📊 Resultados do Teste:")
     print(f"Proporção combinada: {p_combined:.4f}")
@@ -152,10 +293,7 @@ def teste_hipotese(df):
         print(f"🤔 O sistema de recomendação não tem impacto significativo.")
     
     # Intervalo de confiança para a diferença
-    diff = p2 - p1
-    se_diff = se
-    ic_lower = diff - z_critical * se_diff
-    ic_upper = diff + z_critical * se_diff
+    ic_lower, ic_upper = resultado['ic_95']
     
     print(f"\n📏 Intervalo de Confiança (95%) para a diferença:")
     print(f"[{ic_lower:.4f}, {ic_upper:.4f}]")
@@ -163,7 +301,7 @@ def teste_hipotese(df):
     return {
         'z_stat': z_stat,
         'p_value': p_value,
-        'diferenca': diff,
+        'diferenca': resultado['diferenca'],
         'ic_95': (ic_lower, ic_upper)
     }
 
@@ -204,5 +342,67 @@ def main():
     else:
         print(f"\n🤷 CONCLUSÃO: Não há evidência de impacto significativo.")
 
+def relatorio_streaming(agregados):
+    """Conversão diária e teste de hipótese a partir dos agregados"""
+    if {'control', 'treatment'} <= agregados['grupos'].keys():
+        print(f"\n📈 Taxa de Conversão por Dia:")
+        print(conversao_diaria(agregados).tail(14))
+        teste_hipotese(agregados)
+    else:
+        print("⚠️  Ainda não há eventos dos dois grupos")
+
+def main_streaming(arquivo, checkpoint, tamanho_bloco, seguir=None):
+    """Análise incremental: retoma do checkpoint, processa só os eventos novos e refaz o teste"""
+    print("🚀 Iniciando Análise do Teste A/B (streaming)")
+    
+    agregados = carregar_checkpoint(checkpoint, arquivo)
+    if agregados['eventos']:
+        print(f"📌 Checkpoint: {agregados['eventos']:,} eventos já processados (offset {agregados['offset']:,} bytes)")
+    
+    try:
+        while True:
+            inicio = time.perf_counter()
+            novos = atualizar_agregados(agregados, arquivo, tamanho_bloco, seguir=seguir is not None,
+                                        checkpoint=checkpoint)
+            salvar_checkpoint(agregados, checkpoint)
+            print(f"\n📥 {novos:,} eventos novos em {time.perf_counter() - inicio:.2f}s "
+                  f"(total: {agregados['eventos']:,})")
+            
+            if novos or seguir is None:
+                relatorio_streaming(agregados)
+            
+            if seguir is None:
+                break
+            time.sleep(seguir)
+    except KeyboardInterrupt:
+        if seguir is None:
+            raise
+        # Fim do stream: uma última linha sem quebra de linha não será mais completada e entra na
+        # contagem. Recomeça do checkpoint, que só tem blocos inteiros (a interrupção pode cair no meio de um)
+        agregados = carregar_checkpoint(checkpoint, arquivo)
+        novos = atualizar_agregados(agregados, arquivo, tamanho_bloco, checkpoint=checkpoint)
+        salvar_checkpoint(agregados, checkpoint)
+        if novos:
+            print(f"\n📥 {novos:,} eventos finais (total: {agregados['eventos']:,})")
+            relatorio_streaming(agregados)
+        raise
+    return agregados
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Teste A/B - Sistema de Recomendação vs Controle')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Ler o log em blocos e manter agregados incrementais (retoma do checkpoint)')
+    parser.add_argument('--arquivo', default='ab_test_data.csv', help='Log de eventos CSV')
+    parser.add_argument('--checkpoint', default=CHECKPOINT_PADRAO, help='Arquivo JSON dos agregados')
+    parser.add_argument('--tamanho-bloco', type=int, default=64, metavar='MB', help='Tamanho dos blocos lidos (MB)')
+    parser.add_argument('--seguir', type=float, default=None, metavar='SEGUNDOS',
+                        help='Modo tail: reler o log a cada N segundos (Ctrl+C para parar)')
+    args = parser.parse_args()
+    
+    if args.streaming or args.seguir is not None:
+        try:
+            main_streaming(args.arquivo, args.checkpoint, args.tamanho_bloco * 1024 * 1024, args.seguir)
+        except KeyboardInterrupt:
+            print("\n👋 Análise interrompida (checkpoint salvo)")
+    else:
+        main()
\ No newline at end of file
@@ -2,11 +2,10 @@
 Exploração dos Dados - MovieLens 100k
 """
 
-import pandas as pd
-import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 from pathlib import Path
+from dados_movielens import carregar_avaliacoes, carregar_filmes, carregar_usuarios
 
 sns.set_style('whitegrid')
 plt.rcParams['figure.figsize'] = (12, 6)
@@ -14,11 +13,9 @@ plt.rcParams['figure.figsize'] = (12, 6)
 DATA_PATH = Path('ml-100k')
 
 def carregar_dados():
-    ratings = pd.read_csv(DATA_PATH / 'u.data', sep='\t', names=['user_id', 'item_id', 'rating', 'timestamp'])
-    movies = pd.read_csv(DATA_PATH / 'u.item', sep='|', encoding='latin-1', 
-                         names=['item_id', 'title', 'release_date', 'video_release_date', 'imdb_url'] + 
-                         [f'genre_{i}' for i in range(19)], usecols=range(24))
-    users = pd.read_csv(DATA_PATH / 'u.user', sep='|', names=['user_id', 'age', 'gender', 'occupation', 'zip_code'])
+    ratings = carregar_avaliacoes(DATA_PATH).dataframe()
+    movies, _ = carregar_filmes(DATA_PATH)
+    users = carregar_usuarios(DATA_PATH)
     return ratings, movies, users
 
 def analise_basica(ratings, movies, users):
@@ -0,0 +1,1895 @@
+"""
+Estruturas de serviço para o Sistema de Recomendação
+Índices pré-computados usados pela API e pelo script CLI
+"""
+
+from bisect import bisect_left
+import json
+import os
+from collections import OrderedDict
+import shutil
+import threading
+import time
+from datetime import datetime
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.linalg import svds
+
+from dados_movielens import carregar_filmes
+
+# Versão do formato do pacote de artefatos (manifest.json + arrays .npy)
+FORMATO_ARTEFATOS = 1
+
+# Vizinhos guardados por filme no índice de filmes similares
+VIZINHOS_POR_ITEM = 50
+
+# Acima deste número de filmes o índice de similares é aproximado (IVF)
+LIMITE_VIZINHOS_EXATO = 20000
+
+# Recall mínimo do IVF em relação à busca exata (abaixo dele o treino avisa)
+RECALL_MINIMO_IVF = 0.9
+
+# Limites (em segundos) dos buckets dos histogramas de latência
+LIMITES_LATENCIA = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def posicoes_ordenadas(valores_ordenados, valores):
+    """Posição de cada valor em um array ordenado (-1 se ausente)"""
+    valores = np.asarray(valores)
+    if len(valores_ordenados) == 0:
+        return np.full(valores.shape, -1, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(valores_ordenados, valores), len(valores_ordenados) - 1)
+    return np.where(valores_ordenados[pos] == valores, pos, -1)
+
+
+def posicoes_itens(item_ids_catalogo, item_ids):
+    """
+    Converte item_ids para posições no catálogo (array ordenado de item_ids)
+
+    Args:
+        item_ids_catalogo (np.ndarray): item_ids do catálogo, em ordem crescente
+        item_ids (array-like): item_ids a converter
+
+    Returns:
+        np.ndarray: Posições no catálogo (-1 para itens fora do catálogo)
+    """
+    return posicoes_ordenadas(item_ids_catalogo, item_ids)
+
+
+class Catalogo:
+    """
+    Metadados dos filmes indexados pela posição no catálogo
+
+    Títulos e gêneros ficam em arrays alinhados a item_ids, então montar a
+    resposta de uma recomendação é uma consulta O(1) por filme.
+    """
+
+    def __init__(self, item_ids, titulos, generos, nomes_generos):
+        self.item_ids = item_ids
+        self.titulos = titulos
+        self.generos = generos
+        self.nomes_generos = nomes_generos
+
+        # Lista de gêneros de cada filme, pronta para serializar
+        self._generos_filme = [
+            [nomes_generos[g] for g in np.flatnonzero(linha)] for linha in generos
+        ]
+
+    @classmethod
+    def de_arquivos(cls, data_path):
+        """
+        Carrega os filmes do dataset MovieLens (u.item/u.genre, movies.dat ou movies.csv)
+
+        Args:
+            data_path (Path): Diretório do dataset
+
+        Returns:
+            Catalogo: Catálogo ordenado por item_id
+        """
+        movies, nomes_generos = carregar_filmes(data_path)
+        movies = movies.sort_values('item_id')
+
+        return cls(movies['item_id'].values,
+                   movies['title'].values,
+                   movies[[f'genre_{i}' for i in range(len(nomes_generos))]].values.astype(np.int8),
+                   nomes_generos)
+
+    def __len__(self):
+        return len(self.item_ids)
+
+    def arrays(self):
+        """Arrays do catálogo para o pacote de artefatos"""
+        return {
+            'item_ids': self.item_ids,
+            'titulos': np.asarray(self.titulos, dtype=str),
+            'generos': self.generos,
+            'nomes_generos': np.asarray(self.nomes_generos, dtype=str),
+        }
+
+    @classmethod
+    def de_arrays(cls, arrays):
+        return cls(arrays['item_ids'], arrays['titulos'], arrays['generos'],
+                   [str(nome) for nome in arrays['nomes_generos']])
+
+    def posicoes(self, item_ids):
+        """Posições no catálogo dos item_ids informados (-1 se ausente)"""
+        return posicoes_itens(self.item_ids, item_ids)
+
+    def recomendacao(self, pos, rating_predito):
+        """Monta o dicionário de resposta para o filme na posição pos"""
+        return {
+            'item_id': int(self.item_ids[pos]),
+            'titulo': str(self.titulos[pos]),
+            'generos': self._generos_filme[pos],
+            'rating_predito': float(rating_predito)
+        }
+
+    def similar(self, pos, similaridade):
+        """Monta o dicionário de resposta de um filme similar"""
+        return {
+            'item_id': int(self.item_ids[pos]),
+            'titulo': str(self.titulos[pos]),
+            'generos': self._generos_filme[pos],
+            'similaridade': float(similaridade)
+        }
+
+
+class IndiceAvaliacoes:
+    """
+    Índice CSR usuário -> itens avaliados
+
+    Os itens de cada usuário ficam em indices[indptr[u]:indptr[u + 1]],
+    já convertidos para posições do catálogo, com as notas alinhadas em notas.
+    """
+
+    def __init__(self, user_ids, indptr, indices, notas, n_itens):
+        self.user_ids = user_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.notas = notas
+        self.n_itens = n_itens
+
+    @classmethod
+    def de_avaliacoes(cls, ratings, item_ids_catalogo):
+        """
+        Constrói o índice a partir do DataFrame de avaliações
+
+        Args:
+            ratings (pd.DataFrame): Avaliações com user_id, item_id e rating
+            item_ids_catalogo (np.ndarray): item_ids do catálogo, em ordem crescente
+
+        Returns:
+            IndiceAvaliacoes: Índice pronto para consultas
+        """
+        item_pos = posicoes_itens(item_ids_catalogo, ratings['item_id'].values)
+        validos = item_pos >= 0
+
+        user_ids, user_pos = np.unique(ratings['user_id'].values[validos], return_inverse=True)
+        item_pos = item_pos[validos]
+        notas = ratings['rating'].values[validos]
+
+        # Ordenar por usuário e depois por item
+        ordem = np.lexsort((item_pos, user_pos))
+        contagens = np.bincount(user_pos, minlength=len(user_ids))
+        indptr = np.zeros(len(user_ids) + 1, dtype=np.int64)
+        np.cumsum(contagens, out=indptr[1:])
+
+        return cls(user_ids, indptr,
+                   item_pos[ordem].astype(np.int32),
+                   notas[ordem].astype(np.float32),
+                   len(item_ids_catalogo))
+
+    def arrays(self):
+        """Arrays do índice para o pacote de artefatos"""
+        return {'user_ids': self.user_ids, 'indptr': self.indptr, 'indices': self.indices, 'notas': self.notas}
+
+    @classmethod
+    def de_arrays(cls, arrays, n_itens):
+        return cls(arrays['user_ids'], arrays['indptr'], arrays['indices'], arrays['notas'], n_itens)
+
+    def posicao_usuario(self, user_id):
+        """Retorna a linha do usuário no índice (-1 se não houver avaliações)"""
+        pos = np.searchsorted(self.user_ids, user_id)
+        if pos < len(self.user_ids) and self.user_ids[pos] == user_id:
+            return int(pos)
+        return -1
+
+    def itens(self, user_id):
+        """Posições dos itens avaliados pelo usuário"""
+        pos = self.posicao_usuario(user_id)
+        if pos < 0:
+            return self.indices[:0]
+        return self.indices[self.indptr[pos]:self.indptr[pos + 1]]
+
+    def nota(self, user_id, pos_item):
+        """Nota do usuário para o item (posição do catálogo), ou None se ele não o avaliou"""
+        linha = self.posicao_usuario(user_id)
+        if linha < 0:
+            return None
+        inicio, fim = self.indptr[linha], self.indptr[linha + 1]
+        # Itens de cada usuário estão em ordem crescente de posição
+        entrada = inicio + int(np.searchsorted(self.indices[inicio:fim], pos_item))
+        if entrada < fim and self.indices[entrada] == pos_item:
+            return float(self.notas[entrada])
+        return None
+
+    def mascara(self, user_id):
+        """Máscara booleana (n_itens) com True nos itens já avaliados"""
+        mascara = np.zeros(self.n_itens, dtype=bool)
+        mascara[self.itens(user_id)] = True
+        return mascara
+
+    def _entradas(self, user_ids):
+        """Linha (no lote) e posição em indices/notas de cada avaliação dos usuários"""
+        pos = posicoes_ordenadas(self.user_ids, user_ids)
+        inicio = np.where(pos >= 0, self.indptr[np.maximum(pos, 0)], 0)
+        contagens = np.where(pos >= 0, self.indptr[np.maximum(pos, 0) + 1] - inicio, 0)
+
+        linhas = np.repeat(np.arange(len(pos)), contagens)
+        deslocamento = np.repeat(inicio - (np.cumsum(contagens) - contagens), contagens)
+        return linhas, deslocamento + np.arange(len(linhas))
+
+    def mascara_lote(self, user_ids):
+        """Máscara booleana (usuários x n_itens) com True nos itens já avaliados"""
+        linhas, entradas = self._entradas(user_ids)
+        mascara = np.zeros((len(user_ids), self.n_itens), dtype=bool)
+        mascara[linhas, self.indices[entradas]] = True
+        return mascara
+
+    def matriz(self, user_ids):
+        """Matriz esparsa CSR (usuários x n_itens) com as notas dos usuários"""
+        linhas, entradas = self._entradas(user_ids)
+        return sparse.csr_matrix((self.notas[entradas], (linhas, self.indices[entradas])),
+                                 shape=(len(user_ids), self.n_itens))
+
+
+def somas_popularidade(ratings, catalogo):
+    """
+    Soma e contagem das notas de cada filme e o vetor de médias, alinhados ao catálogo
+
+    Filmes sem notas recebem a média global, a mesma regra de
+    ScorerPopularidade.registrar ao atualizar as médias online.
+
+    Args:
+        ratings (pd.DataFrame): Avaliações com item_id e rating
+        catalogo (Catalogo): Catálogo de filmes
+
+    Returns:
+        tuple: (soma, contagem, scores) com um valor por posição do catálogo
+    """
+    pos = catalogo.posicoes(ratings['item_id'].values)
+    validos = pos >= 0
+    soma = np.bincount(pos[validos], weights=ratings['rating'].values[validos], minlength=len(catalogo))
+    contagem = np.bincount(pos[validos], minlength=len(catalogo))
+
+    scores = np.full(len(catalogo), soma.sum() / max(contagem.sum(), 1))
+    np.divide(soma, contagem, out=scores, where=contagem > 0)
+    return soma, contagem, scores
+
+
+def selecionar_top_n(scores, n, excluir=None):
+    """
+    Seleciona as posições dos n maiores scores
+
+    Usa np.argpartition (O(n_itens)) em vez de ordenar todo o vetor.
+    Empates são resolvidos pela menor posição, como na ordenação estável.
+
+    Args:
+        scores (np.ndarray): Score de cada posição do catálogo
+        n (int): Número de posições a retornar
+        excluir (np.ndarray): Máscara booleana de posições a descartar
+
+    Returns:
+        np.ndarray: Posições ordenadas do maior para o menor score
+    """
+    if excluir is not None:
+        scores = np.where(excluir, -np.inf, scores)
+        n = min(n, len(scores) - int(np.count_nonzero(excluir)))
+    n = min(n, len(scores))
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    # n-ésimo maior score define o limiar de corte
+    limiar = scores[np.argpartition(scores, len(scores) - n)[len(scores) - n]]
+    acima = np.flatnonzero(scores > limiar)
+    empatados = np.flatnonzero(scores == limiar)[:n - len(acima)]
+    selecionados = np.concatenate([acima, empatados])
+
+    ordem = np.lexsort((selecionados, -scores[selecionados]))
+    return selecionados[ordem]
+
+
+def selecionar_top_n_lote(scores, n, excluir=None):
+    """
+    Versão em lote de selecionar_top_n: top N de cada linha da matriz de scores
+
+    O limiar de cada linha vem de um np.partition sobre a matriz inteira;
+    a ordem final (score decrescente, posição crescente) é a mesma da versão
+    por usuário.
+
+    Args:
+        scores (np.ndarray): Matriz (usuários x n_itens) de scores
+        n (int): Número de posições por usuário
+        excluir (np.ndarray): Máscara booleana (usuários x n_itens) de posições a descartar
+
+    Returns:
+        list: Um array de posições por usuário, do maior para o menor score
+    """
+    if excluir is not None:
+        scores = np.where(excluir, -np.inf, scores)
+    n_linhas, n_colunas = scores.shape
+    n = min(n, n_colunas)
+    if n <= 0 or n_linhas == 0:
+        return [np.empty(0, dtype=np.int64) for _ in range(n_linhas)]
+
+    # Candidatos: tudo que empata ou supera o n-ésimo maior score da linha
+    limiar = np.partition(scores, n_colunas - n, axis=1)[:, n_colunas - n]
+    linhas, colunas = np.nonzero((scores >= limiar[:, None]) & (scores > -np.inf))
+    valores = scores[linhas, colunas]
+
+    ordem = np.lexsort((colunas, -valores, linhas))
+    linhas, colunas = linhas[ordem], colunas[ordem]
+
+    # Mantém as n primeiras posições de cada linha
+    inicio_linha = np.searchsorted(linhas, np.arange(n_linhas))
+    manter = np.arange(len(linhas)) - inicio_linha[linhas] < n
+    linhas, colunas = linhas[manter], colunas[manter]
+    return np.split(colunas, np.searchsorted(linhas, np.arange(1, n_linhas)))
+
+
+def _denso(matriz):
+    """Converte o resultado de um produto (denso ou esparso) para np.ndarray"""
+    return matriz.toarray() if sparse.issparse(matriz) else np.asarray(matriz)
+
+
+def _arrays_matriz(nome, matriz):
+    """Arrays que representam uma matriz densa ou esparsa (CSR/CSC) no pacote de artefatos"""
+    if not sparse.issparse(matriz):
+        return {nome: np.asarray(matriz)}
+    formato = 'csc' if matriz.format == 'csc' else 'csr'
+    matriz = matriz.asformat(formato)
+    return {
+        f'{nome}_{formato}_data': matriz.data,
+        f'{nome}_{formato}_indices': matriz.indices,
+        f'{nome}_{formato}_indptr': matriz.indptr,
+        f'{nome}_{formato}_shape': np.asarray(matriz.shape),
+    }
+
+
+def _matriz_de_arrays(nome, arrays):
+    """Reconstrói a matriz salva por _arrays_matriz (sem copiar os arrays)"""
+    if nome in arrays:
+        return arrays[nome]
+    for formato, classe in (('csr', sparse.csr_matrix), ('csc', sparse.csc_matrix)):
+        if f'{nome}_{formato}_data' in arrays:
+            return classe((arrays[f'{nome}_{formato}_data'], arrays[f'{nome}_{formato}_indices'],
+                           arrays[f'{nome}_{formato}_indptr']),
+                          shape=tuple(arrays[f'{nome}_{formato}_shape']))
+    raise KeyError(nome)
+
+
+def _linhas_para_catalogo(matriz, pos_itens, n_itens):
+    """Reposiciona as linhas de uma matriz (espaço do modelo) nas posições do catálogo"""
+    validos = pos_itens >= 0
+    alinhada = np.zeros((n_itens,) + matriz.shape[1:], dtype=matriz.dtype)
+    alinhada[pos_itens[validos]] = matriz[validos]
+    return alinhada
+
+
+def _matriz_avaliacoes(train_data, user_ids, item_ids_catalogo):
+    """Matriz esparsa (usuários do modelo x catálogo) com as notas de treino"""
+    linhas = np.searchsorted(user_ids, train_data['user_id'].values)
+    colunas = posicoes_itens(item_ids_catalogo, train_data['item_id'].values)
+    validos = colunas >= 0
+    return sparse.csr_matrix(
+        (train_data['rating'].values[validos].astype(np.float64), (linhas[validos], colunas[validos])),
+        shape=(len(user_ids), len(item_ids_catalogo))
+    )
+
+
+class ScorerPopularidade:
+    """
+    Mesmo vetor de scores (média de cada filme) para todos os usuários
+
+    Com a soma e a contagem de notas de cada filme, uma nova avaliação
+    atualiza a média do filme e a média global em O(1) (registrar).
+    """
+
+    tipo = 'popularity'
+    # Uma avaliação muda os scores de todos os usuários (não só os de quem avaliou)
+    estado_global = True
+
+    def __init__(self, scores, soma=None, contagem=None):
+        self.scores_itens = scores
+        self.soma = soma
+        self.contagem = contagem
+        self._totais = None
+
+    def arrays(self):
+        arrays = {'scores': self.scores_itens}
+        if self.soma is not None:
+            arrays.update(soma=self.soma, contagem=self.contagem)
+        return arrays
+
+    @classmethod
+    def de_arrays(cls, arrays):
+        return cls(arrays['scores'], arrays.get('soma'), arrays.get('contagem'))
+
+    def registrar(self, user_id, pos, nota, nota_anterior, indice):
+        """
+        Incorpora uma avaliação à média do filme e à média global
+
+        nota_anterior é a nota do usuário que está sendo substituída (recente
+        ou do índice, já somada); sem ela a avaliação conta como um voto novo.
+        """
+        if self.soma is None:
+            return
+        if self._totais is None:
+            # Cópias graváveis: os arrays do pacote são mapeados somente leitura
+            self.soma = np.array(self.soma, dtype=np.float64)
+            self.contagem = np.array(self.contagem, dtype=np.int64)
+            self.scores_itens = np.array(self.scores_itens, dtype=np.float64)
+            self._totais = [float(self.soma.sum()), int(self.contagem.sum())]
+            self._sem_notas = np.flatnonzero(self.contagem == 0)
+
+        if nota_anterior is None:
+            if self.contagem[pos] == 0:
+                self._sem_notas = self._sem_notas[self._sem_notas != pos]
+            self.contagem[pos] += 1
+            self._totais[1] += 1
+            nota_anterior = 0.0
+        self.soma[pos] += nota - nota_anterior
+        self._totais[0] += nota - nota_anterior
+
+        self.scores_itens[pos] = self.soma[pos] / self.contagem[pos]
+        # Filmes ainda sem notas usam a média global
+        self.scores_itens[self._sem_notas] = self._totais[0] / self._totais[1]
+
+    def scores(self, user_id, indice):
+        return self.scores_itens
+
+    def scores_lote(self, user_ids, indice):
+        return np.broadcast_to(self.scores_itens, (len(user_ids), len(self.scores_itens)))
+
+
+class ScorerSVD:
+    """
+    Score = fatores do usuário x fatores dos itens (um produto matriz-vetor)
+
+    Usuários fora do treino e usuários com avaliações novas recebem fatores
+    por fold-in: no TruncatedSVD os fatores do usuário são suas notas
+    projetadas nos fatores dos itens (notas @ item_factors), então a projeção
+    é a mesma do treino e cada nova nota soma nota * item_factors[filme].
+    Os vetores calculados ficam em fatores_dobrados.
+    """
+
+    tipo = 'svd'
+
+    def __init__(self, user_ids, user_factors, item_factors, scores_padrao):
+        self.user_ids = user_ids
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.scores_padrao = scores_padrao
+        self.fatores_dobrados = {}
+
+    def arrays(self):
+        user_ids, user_factors = self.user_ids, self.user_factors
+        dobrados = dict(self.fatores_dobrados)
+        if dobrados:
+            # Vetores dobrados passam a fazer parte da tabela de fatores salva
+            novos = np.array(sorted(dobrados), dtype=np.asarray(user_ids).dtype)
+            user_ids = np.union1d(self.user_ids, novos)
+            user_factors = np.zeros((len(user_ids), self.item_factors.shape[1]), dtype=self.user_factors.dtype)
+            user_factors[np.searchsorted(user_ids, self.user_ids)] = self.user_factors
+            user_factors[np.searchsorted(user_ids, novos)] = [dobrados[u] for u in novos.tolist()]
+        return {'user_ids': user_ids, 'user_factors': user_factors,
+                'item_factors': self.item_factors, 'scores_padrao': self.scores_padrao}
+
+    @classmethod
+    def de_arrays(cls, arrays):
+        return cls(arrays['user_ids'], arrays['user_factors'], arrays['item_factors'], arrays['scores_padrao'])
+
+    def vetores_itens(self):
+        """Vetor de cada filme para o índice de filmes similares"""
+        return self.item_factors
+
+    def dobrar(self, posicoes, notas):
+        """Fatores de um usuário a partir das suas notas (posições do catálogo)"""
+        return np.asarray(notas, dtype=np.float64) @ self.item_factors[posicoes]
+
+    def fatores(self, user_id, indice):
+        """Fatores do usuário: dobrados, do treino ou por fold-in das notas do índice (None se não houver)"""
+        vetor = self.fatores_dobrados.get(user_id)
+        if vetor is not None:
+            return vetor
+        pos = np.searchsorted(self.user_ids, user_id)
+        if pos < len(self.user_ids) and self.user_ids[pos] == user_id:
+            return self.user_factors[pos]
+
+        linha = indice.posicao_usuario(user_id)
+        if linha < 0:
+            return None
+        inicio, fim = indice.indptr[linha], indice.indptr[linha + 1]
+        vetor = self.dobrar(indice.indices[inicio:fim], indice.notas[inicio:fim])
+        self.fatores_dobrados[user_id] = vetor
+        return vetor
+
+    def registrar(self, user_id, pos, nota, nota_anterior, indice):
+        """
+        Atualiza os fatores do usuário com a nova nota (fold-in incremental, O(k))
+
+        nota_anterior é a nota substituída (recente ou do índice): só a diferença
+        entra nos fatores, então rebaixar um 5 para 1 soma -4 * item_factors[pos].
+        Na primeira avaliação online de um usuário, os fatores são dobrados de
+        todas as notas dele no índice: os fatores do treino só contêm as notas
+        de treino, e a nota substituída pode ser uma do teste.
+        """
+        vetor = self.fatores_dobrados.get(user_id)
+        if vetor is None:
+            linha = indice.posicao_usuario(user_id)
+            if linha >= 0:
+                inicio, fim = indice.indptr[linha], indice.indptr[linha + 1]
+                vetor = self.dobrar(indice.indices[inicio:fim], indice.notas[inicio:fim])
+            else:
+                vetor = np.zeros(self.item_factors.shape[1])
+        self.fatores_dobrados[user_id] = vetor + (nota - (nota_anterior or 0.0)) * self.item_factors[pos]
+
+    def scores(self, user_id, indice):
+        vetor = self.fatores(user_id, indice)
+        if vetor is None:
+            return self.scores_padrao
+        return self.item_factors @ vetor
+
+    def scores_lote(self, user_ids, indice):
+        # Uma única multiplicação de matrizes para todo o lote
+        pos = posicoes_ordenadas(self.user_ids, user_ids)
+        scores = self.user_factors[np.maximum(pos, 0)] @ self.item_factors.T
+
+        # Usuários fora do treino ou com fatores dobrados
+        if self.fatores_dobrados or (pos < 0).any():
+            for linha, user_id in enumerate(np.asarray(user_ids).tolist()):
+                if pos[linha] < 0 or user_id in self.fatores_dobrados:
+                    scores[linha] = self.scores(user_id, indice)
+        return scores
+
+
+class ScorerALS(ScorerSVD):
+    """
+    Score = média global + viés do filme + fatores do usuário x fatores dos filmes
+
+    Os fatores do usuário carregam o viés dele na última coluna, contra uma
+    coluna de uns nos fatores dos filmes, e base_itens guarda média + viés de
+    cada filme. O fold-in é o próprio passo de usuários do ALS: mínimos
+    quadrados regularizados das notas do usuário contra os fatores fixos dos
+    filmes. Cada nova nota refaz esse solve (O(n·k² + k³)) a partir das notas
+    do usuário guardadas em notas_usuarios.
+    """
+
+    tipo = 'als'
+
+    def __init__(self, user_ids, user_factors, item_factors, scores_padrao, base_itens, regularizacao):
+        super().__init__(user_ids, user_factors, item_factors, scores_padrao)
+        self.base_itens = base_itens
+        self.regularizacao = float(regularizacao)
+        self.notas_usuarios = {}
+
+    def arrays(self):
+        return {**super().arrays(), 'base_itens': self.base_itens,
+                'regularizacao': np.array([self.regularizacao])}
+
+    @classmethod
+    def de_arrays(cls, arrays):
+        return cls(arrays['user_ids'], arrays['user_factors'], arrays['item_factors'], arrays['scores_padrao'],
+                   arrays['base_itens'], arrays['regularizacao'][0])
+
+    def vetores_itens(self):
+        # Sem a coluna de uns usada pelo viés do usuário
+        return self.item_factors[:, :-1]
+
+    def dobrar(self, posicoes, notas):
+        fixos = self.item_factors[posicoes]
+        alvo = np.asarray(notas, dtype=np.float64) - self.base_itens[posicoes]
+        sistema = fixos.T @ fixos + self.regularizacao * max(len(posicoes), 1) * np.eye(fixos.shape[1])
+        return np.linalg.solve(sistema, fixos.T @ alvo)
+
+    def registrar(self, user_id, pos, nota, nota_anterior, indice):
+        """
+        Refaz o fold-in do usuário com todas as notas dele, incluindo a nova
+
+        As notas vêm do índice (treino e teste) mais as recentes, então
+        nota_anterior não é usada: a nota substituída simplesmente sai do solve.
+        """
+        notas = self.notas_usuarios.get(user_id)
+        if notas is None:
+            notas = {}
+            linha = indice.posicao_usuario(user_id)
+            if linha >= 0:
+                inicio, fim = indice.indptr[linha], indice.indptr[linha + 1]
+                notas = dict(zip(indice.indices[inicio:fim].tolist(), indice.notas[inicio:fim].tolist()))
+        notas = {**notas, pos: nota}
+        self.notas_usuarios[user_id] = notas
+        self.fatores_dobrados[user_id] = self.dobrar(list(notas), list(notas.values()))
+
+    def scores(self, user_id, indice):
+        vetor = self.fatores(user_id, indice)
+        if vetor is None:
+            # Sem notas: média + viés de cada filme (já regularizado, ao contrário da média simples)
+            return self.base_itens
+        return self.base_itens + self.item_factors @ vetor
+
+    def scores_lote(self, user_ids, indice):
+        pos = posicoes_ordenadas(self.user_ids, user_ids)
+        scores = self.user_factors[np.maximum(pos, 0)] @ self.item_factors.T
+        scores += self.base_itens
+
+        if self.fatores_dobrados or (pos < 0).any():
+            for linha, user_id in enumerate(np.asarray(user_ids).tolist()):
+                if pos[linha] < 0 or user_id in self.fatores_dobrados:
+                    scores[linha] = self.scores(user_id, indice)
+        return scores
+
+
+class ScorerKNNItem:
+    """Score = soma das similaridades com os filmes avaliados, ponderada pelas notas"""
+
+    tipo = 'knn_item'
+
+    def __init__(self, similaridade, normalizador, scores_padrao):
+        self.similaridade = similaridade
+        self.normalizador = normalizador
+        self.scores_padrao = scores_padrao
+
+    def arrays(self):
+        return {**_arrays_matriz('similaridade', self.similaridade),
+                'normalizador': self.normalizador, 'scores_padrao': self.scores_padrao}
+
+    @classmethod
+    def de_arrays(cls, arrays):
+        return cls(_matriz_de_arrays('similaridade', arrays), arrays['normalizador'], arrays['scores_padrao'])
+
+    def scores(self, user_id, indice):
+        pos = indice.posicao_usuario(user_id)
+        if pos < 0:
+            return self.scores_padrao
+        inicio, fim = indice.indptr[pos], indice.indptr[pos + 1]
+
+        # Só as colunas dos filmes avaliados participam do produto
+        numerador = self.similaridade[:, indice.indices[inicio:fim]] @ indice.notas[inicio:fim]
+        numerador = _denso(numerador).ravel()
+        return np.divide(numerador, self.normalizador,
+                         out=self.scores_padrao.copy(), where=self.normalizador > 0)
+
+    def scores_lote(self, user_ids, indice):
+        # Notas do lote (esparsas) x similaridades: numerador de todos os usuários de uma vez
+        numerador = _denso(indice.matriz(user_ids) @ self.similaridade.T)
+        scores = np.divide(numerador, self.normalizador,
+                           out=np.tile(self.scores_padrao, (len(user_ids), 1)), where=self.normalizador > 0)
+        scores[posicoes_ordenadas(indice.user_ids, user_ids) < 0] = self.scores_padrao
+        return scores
+
+
+class ScorerKNNUsuario:
+    """Score = notas dos usuários similares, ponderadas pela similaridade"""
+
+    tipo = 'knn_user'
+
+    def __init__(self, user_ids, similaridade, matriz_avaliacoes_t, normalizador, scores_padrao):
+        self.user_ids = user_ids
+        self.similaridade = similaridade
+        self.matriz_avaliacoes_t = matriz_avaliacoes_t
+        self.normalizador = normalizador
+        self.scores_padrao = scores_padrao
+
+    def arrays(self):
+        return {'user_ids': self.user_ids, **_arrays_matriz('similaridade', self.similaridade),
+                **_arrays_matriz('matriz_avaliacoes_t', self.matriz_avaliacoes_t),
+                'normalizador': self.normalizador, 'scores_padrao': self.scores_padrao}
+
+    @classmethod
+    def de_arrays(cls, arrays):
+        return cls(arrays['user_ids'], _matriz_de_arrays('similaridade', arrays),
+                   _matriz_de_arrays('matriz_avaliacoes_t', arrays), arrays['normalizador'], arrays['scores_padrao'])
+
+    def scores(self, user_id, indice):
+        pos = np.searchsorted(self.user_ids, user_id)
+        if pos >= len(self.user_ids) or self.user_ids[pos] != user_id or self.normalizador[pos] == 0:
+            return self.scores_padrao
+        similares = _denso(self.similaridade[pos:pos + 1]).ravel()
+        return self.matriz_avaliacoes_t @ similares / self.normalizador[pos]
+
+    def scores_lote(self, user_ids, indice):
+        pos = posicoes_ordenadas(self.user_ids, user_ids)
+        validos = (pos >= 0) & (self.normalizador[np.maximum(pos, 0)] > 0)
+        scores = np.tile(self.scores_padrao, (len(user_ids), 1))
+        if validos.any():
+            pos = pos[validos]
+            numerador = _denso(self.matriz_avaliacoes_t @ self.similaridade[pos].T).T
+            scores[validos] = numerador / self.normalizador[pos][:, None]
+        return scores
+
+
+def _criar_popularity(modelo, dados, catalogo, scores_padrao):
+    # Soma e contagem das mesmas notas do índice, para atualizar as médias online: uma nota
+    # substituída no índice é substituída também na soma, sem contar um voto a mais
+    soma, contagem, scores = somas_popularidade(dados['ratings'], catalogo)
+    return ScorerPopularidade(scores, soma, contagem)
+
+
+def _criar_svd(modelo, dados, catalogo, scores_padrao):
+    item_factors = _linhas_para_catalogo(modelo['item_factors'], catalogo.posicoes(dados['item_ids']), len(catalogo))
+    return ScorerSVD(dados['user_ids'], modelo['user_factors'], item_factors, scores_padrao)
+
+
+def _criar_als(modelo, dados, catalogo, scores_padrao):
+    pos = catalogo.posicoes(dados['item_ids'])
+    # Coluna de uns contra o viés do usuário; filmes fora do treino ficam só com média + viés do usuário
+    item_factors = _linhas_para_catalogo(modelo['item_factors'], pos, len(catalogo))
+    item_factors = np.hstack([item_factors, np.ones((len(catalogo), 1))])
+    base_itens = np.full(len(catalogo), modelo['media_global'])
+    base_itens[pos[pos >= 0]] += modelo['bias_itens'][pos >= 0]
+    user_factors = np.hstack([modelo['user_factors'], modelo['bias_usuarios'][:, None]])
+    return ScorerALS(dados['user_ids'], user_factors, item_factors, scores_padrao, base_itens,
+                     modelo['regularizacao'])
+
+
+def _criar_knn_item(modelo, dados, catalogo, scores_padrao):
+    pos = catalogo.posicoes(dados['item_ids'])
+    similaridade = modelo['item_similarity']
+
+    if sparse.issparse(similaridade):
+        # Vizinhos top-k: só reindexa as entradas; CSC para fatiar as colunas dos filmes avaliados
+        coo = similaridade.tocoo()
+        validos = (pos[coo.row] >= 0) & (pos[coo.col] >= 0)
+        similaridade = sparse.csc_matrix(
+            (coo.data[validos], (pos[coo.row[validos]], pos[coo.col[validos]])),
+            shape=(len(catalogo), len(catalogo))
+        )
+    else:
+        validos = pos >= 0
+        densa = np.zeros((len(catalogo), len(catalogo)))
+        densa[np.ix_(pos[validos], pos[validos])] = similaridade[np.ix_(validos, validos)]
+        similaridade = densa
+
+    normalizador = _denso(abs(similaridade).sum(axis=1)).ravel()
+    return ScorerKNNItem(similaridade, normalizador, scores_padrao)
+
+
+def _criar_knn_user(modelo, dados, catalogo, scores_padrao):
+    user_ids = dados['user_ids']
+    matriz = _matriz_avaliacoes(dados['train_data'], user_ids, catalogo.item_ids)
+    similaridade = modelo['user_similarity']
+    normalizador = _denso(abs(similaridade).sum(axis=1)).ravel()
+    return ScorerKNNUsuario(user_ids, similaridade, matriz.T.tocsr(), normalizador, scores_padrao)
+
+
+# Modelos que a API sabe servir: nome -> construtor do scorer
+SCORERS = {
+    'popularity': _criar_popularity,
+    'svd': _criar_svd,
+    'knn_item': _criar_knn_item,
+    'knn_user': _criar_knn_user,
+    'als': _criar_als,
+}
+
+
+# Classe de scorer de cada tipo salvo no pacote de artefatos
+TIPOS_SCORER = {classe.tipo: classe
+                for classe in (ScorerPopularidade, ScorerSVD, ScorerALS, ScorerKNNItem, ScorerKNNUsuario)}
+
+
+def criar_scorer(nome_modelo, modelo, dados, catalogo):
+    """
+    Cria o scorer do modelo treinado, alinhado às posições do catálogo
+
+    Usuários sem fatores/similaridades no modelo recebem os scores de
+    popularidade. Essa base e o scorer de popularidade usam as mesmas notas
+    do índice (dados['ratings']): as avaliações online atualizam e substituem
+    exatamente essas notas. No treinamento dados['ratings'] tem todas as
+    avaliações; na avaliação de ranking, só as de treino.
+
+    Args:
+        nome_modelo (str): Nome do modelo ('popularity', 'svd', 'als', 'knn_item', 'knn_user')
+        modelo (dict): Modelo carregado de modelo_<nome>.pkl
+        dados (dict): Dados auxiliares carregados de dados_auxiliares.pkl
+        catalogo (Catalogo): Catálogo de filmes
+
+    Returns:
+        Scorer com o método scores(user_id, indice)
+    """
+    if nome_modelo not in SCORERS:
+        raise ValueError(f"Modelo '{nome_modelo}' não suportado. Opções: {', '.join(SCORERS)}")
+
+    _, _, scores_padrao = somas_popularidade(dados['ratings'], catalogo)
+    return SCORERS[nome_modelo](modelo, dados, catalogo, scores_padrao)
+
+
+class TopMaterializado:
+    """
+    Top N pré-calculado de cada usuário, gerado no treinamento
+
+    itens e scores são matrizes (usuários x N) com as posições do catálogo
+    (-1 quando o usuário tem menos de N candidatos) e os scores brutos.
+    """
+
+    def __init__(self, user_ids, itens, scores):
+        self.user_ids = user_ids
+        self.itens = itens
+        self.scores = scores
+
+    @classmethod
+    def calcular(cls, recomendador, n=50):
+        """Calcula o top N de todos os usuários do índice em uma passada em lote"""
+        user_ids = np.asarray(recomendador.indice.user_ids)
+        itens = np.full((len(user_ids), n), -1, dtype=np.int32)
+        scores = np.zeros((len(user_ids), n), dtype=np.float32)
+        for linha, (posicoes, valores) in enumerate(recomendador.top_lote(user_ids, n, materializado=False)):
+            itens[linha, :len(posicoes)] = posicoes
+            scores[linha, :len(posicoes)] = valores
+        return cls(user_ids, itens, scores)
+
+    @property
+    def largura(self):
+        return self.itens.shape[1]
+
+    def arrays(self):
+        return {'user_ids': self.user_ids, 'itens': self.itens, 'scores': self.scores}
+
+    @classmethod
+    def de_arrays(cls, arrays):
+        return cls(arrays['user_ids'], arrays['itens'], arrays['scores'])
+
+    def linhas(self, user_ids):
+        """Linha de cada usuário na tabela (-1 se ausente)"""
+        return posicoes_ordenadas(self.user_ids, user_ids)
+
+    def consultar(self, linha, n):
+        """Posições e scores das n primeiras recomendações da linha"""
+        itens = self.itens[linha, :n]
+        validos = itens >= 0
+        return itens[validos], self.scores[linha, :n][validos]
+
+
+def _normalizar_linhas(vetores):
+    """Linhas com norma L2 unitária (densas em float32 ou CSR) e a máscara das linhas não nulas"""
+    if sparse.issparse(vetores):
+        vetores = sparse.csr_matrix(vetores, dtype=np.float32)
+        normas = np.sqrt(np.asarray(vetores.multiply(vetores).sum(axis=1)).ravel())
+        inverso = np.divide(1.0, normas, out=np.zeros_like(normas), where=normas > 0)
+        return sparse.diags(inverso.astype(np.float32)) @ vetores, normas > 0
+    vetores = np.asarray(vetores, dtype=np.float32)
+    normas = np.linalg.norm(vetores, axis=1)
+    inverso = np.divide(1.0, normas, out=np.zeros_like(normas), where=normas > 0)
+    return vetores * inverso[:, None], normas > 0
+
+
+def _grupo_mais_proximo(vetores, centroides, tamanho_bloco=8192):
+    """Centroide de maior similaridade de cada vetor, em blocos de linhas"""
+    return np.concatenate([np.argmax(vetores[i:i + tamanho_bloco] @ centroides.T, axis=1)
+                           for i in range(0, len(vetores), tamanho_bloco)])
+
+
+def _kmeans_esferico(vetores, n_grupos, iteracoes=10, semente=42):
+    """Agrupa vetores normalizados por similaridade do cosseno; devolve centroides e o grupo de cada vetor"""
+    rng = np.random.default_rng(semente)
+    centroides = vetores[rng.choice(len(vetores), n_grupos, replace=False)]
+    for _ in range(iteracoes):
+        grupos = _grupo_mais_proximo(vetores, centroides)
+        # Soma dos membros de cada grupo como um produto esparso (grupos x vetores) @ vetores
+        pertence = sparse.csr_matrix((np.ones(len(grupos), dtype=np.float32), (grupos, np.arange(len(grupos)))),
+                                     shape=(n_grupos, len(grupos)))
+        somas = pertence @ vetores
+        normas = np.linalg.norm(somas, axis=1)
+        # Grupos que ficaram vazios mantêm o centroide anterior
+        centroides[normas > 0] = somas[normas > 0] / normas[normas > 0, None]
+    return centroides, _grupo_mais_proximo(vetores, centroides)
+
+
+class VizinhosItens:
+    """
+    Filmes mais similares de cada filme (cosseno entre os vetores dos filmes), gerado no treinamento
+
+    itens e scores são matrizes (n_itens x K) com as posições do catálogo (-1
+    quando o filme tem menos de K vizinhos) e as similaridades, então uma
+    consulta é a fatia de uma linha e a memória fica fixa em n_itens x K.
+    Catálogos de até LIMITE_VIZINHOS_EXATO filmes usam a busca exata; acima
+    disso, um índice IVF: os vetores são agrupados por k-means esférico e cada
+    filme só é comparado com os filmes dos n_sondas grupos de centroide mais
+    próximo dele.
+    """
+
+    def __init__(self, itens, scores, metodo=None):
+        self.itens = itens
+        self.scores = scores
+        self.metodo = metodo
+
+    @classmethod
+    def calcular(cls, vetores, n=VIZINHOS_POR_ITEM, metodo='auto', n_sondas=16, tamanho_bloco=1024, semente=42):
+        """
+        Calcula os n vizinhos de todos os filmes
+
+        Args:
+            vetores (np.ndarray | sparse): Um vetor por posição do catálogo (fatores ou notas recebidas)
+            n (int): Vizinhos por filme
+            metodo (str): 'exato', 'ivf' ou 'auto' (exato até LIMITE_VIZINHOS_EXATO filmes)
+            n_sondas (int): Grupos vasculhados por filme no IVF
+            tamanho_bloco (int): Filmes por bloco na matriz de similaridades
+            semente (int): Semente do k-means do IVF
+
+        Returns:
+            VizinhosItens: Tabela de vizinhos
+        """
+        vetores, validos = _normalizar_linhas(vetores)
+        n_itens = vetores.shape[0]
+        if metodo == 'auto':
+            metodo = 'exato' if n_itens <= LIMITE_VIZINHOS_EXATO else 'ivf'
+        vizinhos = cls(np.full((n_itens, n), -1, dtype=np.int32), np.zeros((n_itens, n), dtype=np.float32), metodo)
+
+        consultas = np.flatnonzero(validos)
+        if metodo == 'exato':
+            candidatos = np.arange(n_itens)
+            for inicio in range(0, len(consultas), tamanho_bloco):
+                vizinhos._preencher(vetores, validos, consultas[inicio:inicio + tamanho_bloco], candidatos)
+            return vizinhos
+
+        # IVF sobre vetores densos: notas esparsas são reduzidas antes (SVD truncado)
+        if sparse.issparse(vetores):
+            u, s, _ = svds(vetores, k=min(64, min(vetores.shape) - 1), random_state=semente)
+            vetores, _ = _normalizar_linhas(u * s)
+        centroides, grupos = _kmeans_esferico(vetores[consultas], max(int(np.sqrt(len(consultas))), 1),
+                                              semente=semente)
+        n_sondas = min(n_sondas, len(centroides))
+        ordem = np.argsort(grupos, kind='stable')
+        membros = np.split(consultas[ordem], np.searchsorted(grupos[ordem], np.arange(1, len(centroides))))
+
+        # Grupos sondados por cada filme; invertido, dá os filmes que sondam cada grupo
+        sondas = np.concatenate([
+            np.argpartition(-(vetores[consultas[i:i + 8192]] @ centroides.T), n_sondas - 1, axis=1)[:, :n_sondas]
+            for i in range(0, len(consultas), 8192)
+        ]).ravel()
+        ordem = np.argsort(sondas, kind='stable')
+        sondando = np.split(np.repeat(consultas, n_sondas)[ordem], np.searchsorted(sondas[ordem],
+                                                                                   np.arange(1, len(centroides))))
+        for candidatos, consultas_grupo in zip(membros, sondando):
+            for inicio in range(0, len(consultas_grupo), tamanho_bloco):
+                vizinhos._preencher(vetores, validos, consultas_grupo[inicio:inicio + tamanho_bloco], candidatos)
+        return vizinhos
+
+    def _preencher(self, vetores, validos, consultas, candidatos):
+        # Similaridades consultas x candidatos; o próprio filme e filmes sem vetor ficam de fora
+        similaridades = _denso(vetores[consultas] @ vetores[candidatos].T)
+        excluir = (candidatos[None, :] == consultas[:, None]) | ~validos[candidatos][None, :]
+
+        # Junta com os vizinhos já encontrados (IVF visita cada filme uma vez por grupo sondado)
+        atuais = self.itens[consultas]
+        similaridades = np.hstack([self.scores[consultas], similaridades])
+        excluir = np.hstack([atuais < 0, excluir])
+        posicoes = np.hstack([atuais, np.broadcast_to(candidatos, (len(consultas), len(candidatos)))])
+        similaridades[excluir] = -np.inf
+
+        # Top K por linha: argpartition e depois ordenação só dos K escolhidos
+        top = np.argpartition(-similaridades, self.largura - 1, axis=1)[:, :self.largura]
+        valores = np.take_along_axis(similaridades, top, axis=1)
+        ordem = np.argsort(-valores, axis=1, kind='stable')
+        top, valores = np.take_along_axis(top, ordem, axis=1), np.take_along_axis(valores, ordem, axis=1)
+        vazios = np.isneginf(valores)
+        self.itens[consultas] = np.where(vazios, -1, np.take_along_axis(posicoes, top, axis=1))
+        self.scores[consultas] = np.where(vazios, 0.0, valores)
+
+    def recall(self, vetores, n_amostra=1000, tamanho_bloco=1024, semente=42):
+        """
+        Fração dos vizinhos exatos presentes na tabela, medida em uma amostra de filmes
+
+        Empates contam: um vizinho da tabela com similaridade (nos vetores
+        originais) pelo menos igual à do K-ésimo vizinho exato é um acerto.
+        """
+        normalizados, validos = _normalizar_linhas(vetores)
+        rng = np.random.default_rng(semente)
+        consultas = np.flatnonzero(validos)
+        amostra = np.sort(rng.choice(consultas, min(n_amostra, len(consultas)), replace=False))
+
+        exatos = VizinhosItens(np.full_like(self.itens, -1), np.zeros_like(self.scores))
+        for inicio in range(0, len(amostra), tamanho_bloco):
+            exatos._preencher(normalizados, validos, amostra[inicio:inicio + tamanho_bloco], np.arange(len(validos)))
+        acertos = total = 0
+        for pos in amostra:
+            esperados = np.count_nonzero(exatos.itens[pos] >= 0)
+            encontrados = self.itens[pos][self.itens[pos] >= 0]
+            if esperados == 0 or len(encontrados) == 0:
+                total += esperados
+                continue
+            similaridades = _denso(normalizados[[pos]] @ normalizados[encontrados].T).ravel()
+            limiar = exatos.scores[pos, esperados - 1] - 1e-6
+            acertos += min(int(np.count_nonzero(similaridades >= limiar)), esperados)
+            total += esperados
+        return acertos / total if total else 1.0
+
+    @property
+    def largura(self):
+        return self.itens.shape[1]
+
+    def arrays(self):
+        return {'itens': self.itens, 'scores': self.scores}
+
+    @classmethod
+    def de_arrays(cls, arrays):
+        return cls(arrays['itens'], arrays['scores'])
+
+    def consultar(self, pos, n):
+        """Posições e similaridades dos n filmes mais similares ao da posição pos"""
+        itens = self.itens[pos, :n]
+        validos = itens >= 0
+        return itens[validos], self.scores[pos, :n][validos]
+
+
+class Recomendador:
+    """
+    Junta catálogo, índice de avaliações e scorer para atender requisições
+
+    Avaliações recebidas online ficam em recentes (user_id -> {posição: nota})
+    até a próxima compactação: elas já entram na exclusão dos filmes avaliados
+    e tiram o usuário do top N materializado, que ficou desatualizado para ele.
+    """
+
+    def __init__(self, catalogo, indice, scorer, nome_modelo, versao=None, materializado=None, vizinhos=None):
+        self.catalogo = catalogo
+        self.indice = indice
+        self.scorer = scorer
+        self.nome_modelo = nome_modelo
+        self.versao = versao
+        self.materializado = materializado
+        self.vizinhos = vizinhos
+        self.recentes = {}
+        self.n_recentes = 0
+
+    def respostas(self, posicoes, scores):
+        """
+        Monta as recomendações (título, gêneros, nota predita) de um top N
+
+        Args:
+            posicoes (np.ndarray): Posições dos filmes no catálogo, em ordem
+            scores (np.ndarray): Scores brutos dos filmes, na mesma ordem
+
+        Returns:
+            list: Dicionários de recomendação, como devolvidos por recomendar
+        """
+        # Rating predito é reportado na escala 1-5; a ordenação usa o score bruto
+        return [self.catalogo.recomendacao(pos, min(max(score, 1.0), 5.0)) for pos, score in zip(posicoes, scores)]
+
+    def registrar_avaliacao(self, user_id, item_id, nota):
+        """
+        Registra uma avaliação recebida online
+
+        A avaliação vai para recentes e, quando o scorer sabe se atualizar
+        (método registrar), também para o modelo.
+
+        Args:
+            user_id (int): ID do usuário
+            item_id (int): ID do filme
+            nota (float): Nota de 1 a 5
+
+        Returns:
+            int: Posição do filme no catálogo
+        """
+        pos = int(self.catalogo.posicoes([item_id])[0])
+        if pos < 0:
+            raise ValueError(f'item_id {item_id} não está no catálogo')
+        if not np.isfinite(nota):
+            raise ValueError(f'nota {nota} não é um número finito')
+
+        # Cópia do dicionário do usuário: leituras concorrentes nunca o veem pela metade
+        recentes = dict(self.recentes.get(user_id, {}))
+        anterior = recentes.get(pos)
+        recentes[pos] = float(nota)
+        self.recentes[user_id] = recentes
+        if anterior is None:
+            self.n_recentes += 1
+            # Filme já avaliado no índice (treino ou compactação): a nota é substituída, não é um voto novo
+            anterior = self.indice.nota(user_id, pos)
+
+        if hasattr(self.scorer, 'registrar'):
+            self.scorer.registrar(user_id, pos, float(nota), anterior, self.indice)
+        return pos
+
+    def avaliacoes_recentes(self):
+        """Triplas (user_id, item_id, nota) das avaliações recentes"""
+        for user_id, recentes in self.recentes.items():
+            for pos, nota in recentes.items():
+                yield user_id, int(self.catalogo.item_ids[pos]), nota
+
+    def mascara(self, user_id):
+        """Máscara dos filmes já avaliados pelo usuário, incluindo os recentes"""
+        mascara = self.indice.mascara(user_id)
+        recentes = self.recentes.get(user_id)
+        if recentes:
+            mascara[list(recentes)] = True
+        return mascara
+
+    def mascara_lote(self, user_ids):
+        """Versão em lote de mascara (usuários x n_itens)"""
+        mascara = self.indice.mascara_lote(user_ids)
+        if self.recentes:
+            for linha, user_id in enumerate(user_ids.tolist()):
+                recentes = self.recentes.get(user_id)
+                if recentes:
+                    mascara[linha, list(recentes)] = True
+        return mascara
+
+    def instantaneo(self):
+        """
+        Cópia das avaliações recentes e do estado do scorer neste momento
+
+        Permite compactar fora do lock de registro: avaliações registradas
+        depois não alteram a cópia (scorers atualizados online são copiados).
+        """
+        scorer = self.scorer
+        if hasattr(scorer, 'registrar'):
+            scorer = type(scorer).de_arrays({nome: np.array(array) for nome, array in scorer.arrays().items()})
+        copia = Recomendador(self.catalogo, self.indice, scorer, self.nome_modelo, self.versao,
+                             vizinhos=self.vizinhos)
+        # Os dicionários de cada usuário nunca são alterados no lugar (registrar_avaliacao os substitui)
+        copia.recentes = dict(self.recentes)
+        copia.n_recentes = self.n_recentes
+        return copia
+
+    def avaliacoes_desde(self, instantaneo):
+        """Triplas (user_id, item_id, nota) registradas depois do instantâneo"""
+        for user_id, recentes in self.recentes.items():
+            anteriores = instantaneo.recentes.get(user_id, {})
+            for pos, nota in recentes.items():
+                if anteriores.get(pos) != nota:
+                    yield user_id, int(self.catalogo.item_ids[pos]), nota
+
+    def compactado(self):
+        """
+        Novo Recomendador com as avaliações recentes incorporadas ao índice
+
+        O scorer (com as médias já atualizadas, no caso da popularidade) é
+        reaproveitado e o top N materializado é recalculado para todos.
+        """
+        indice = self.indice
+        base = pd.DataFrame({
+            'user_id': np.repeat(indice.user_ids, np.diff(indice.indptr)),
+            'item_id': self.catalogo.item_ids[indice.indices],
+            'rating': indice.notas,
+        })
+        novas = pd.DataFrame(list(self.avaliacoes_recentes()), columns=['user_id', 'item_id', 'rating'])
+        ratings = pd.concat([base, novas], ignore_index=True).drop_duplicates(['user_id', 'item_id'], keep='last')
+
+        novo = Recomendador(self.catalogo, IndiceAvaliacoes.de_avaliacoes(ratings, self.catalogo.item_ids),
+                            self.scorer, self.nome_modelo, vizinhos=self.vizinhos)
+        novo.materializado = TopMaterializado.calcular(novo)
+        return novo
+
+    def recomendar(self, user_id, n_recomendacoes=5, cronometro=None):
+        """
+        Gera as n melhores recomendações para o usuário
+
+        Com o top N materializado, usuários presentes na tabela (e sem
+        avaliações recentes) são atendidos por uma fatia dela; os demais
+        seguem para o cálculo ao vivo.
+
+        Args:
+            user_id (int): ID do usuário
+            n_recomendacoes (int): Número de recomendações a retornar
+            cronometro (Cronometro): Recebe o tempo de cada etapa (opcional)
+
+        Returns:
+            list: Lista de dicionários com recomendações
+        """
+        cronometro = cronometro or CRONOMETRO_NULO
+        if (self.materializado is not None and n_recomendacoes <= self.materializado.largura
+                and user_id not in self.recentes):
+            linha = self.materializado.linhas([user_id])[0]
+            if linha >= 0:
+                top = self.materializado.consultar(linha, n_recomendacoes)
+                cronometro.marcar('materializado')
+                respostas = self.respostas(*top)
+                cronometro.marcar('titulos')
+                return respostas
+
+        excluir = self.mascara(user_id)
+        cronometro.marcar('exclusao')
+        scores = self.scorer.scores(user_id, self.indice)
+        cronometro.marcar('scores')
+        top_pos = selecionar_top_n(scores, n_recomendacoes, excluir=excluir)
+        cronometro.marcar('top_n')
+        respostas = self.respostas(top_pos, scores[top_pos])
+        cronometro.marcar('titulos')
+        return respostas
+
+    def vetores_itens(self):
+        """
+        Vetor de cada filme (posições do catálogo) para o índice de filmes similares
+
+        Fatores dos filmes quando o scorer tem (SVD, ALS); senão a coluna de
+        notas de cada filme na matriz usuários x filmes, esparsa.
+        """
+        if hasattr(self.scorer, 'vetores_itens'):
+            return np.asarray(self.scorer.vetores_itens())
+        indice = self.indice
+        return sparse.csr_matrix((indice.notas, indice.indices, indice.indptr),
+                                 shape=(len(indice.user_ids), len(self.catalogo))).T.tocsr()
+
+    def similares(self, item_id, n=10, cronometro=None):
+        """
+        Filmes mais similares a um filme, pelo índice de vizinhos do pacote
+
+        Args:
+            item_id (int): ID do filme
+            n (int): Número de filmes similares
+            cronometro (Cronometro): Recebe o tempo de cada etapa (opcional)
+
+        Returns:
+            list: Lista de dicionários com os filmes similares (None se o filme não estiver no catálogo)
+        """
+        cronometro = cronometro or CRONOMETRO_NULO
+        pos = int(self.catalogo.posicoes([item_id])[0])
+        if pos < 0:
+            return None
+        posicoes, similaridades = self.vizinhos.consultar(pos, n)
+        cronometro.marcar('vizinhos')
+        respostas = [self.catalogo.similar(p, s) for p, s in zip(posicoes.tolist(), similaridades.tolist())]
+        cronometro.marcar('titulos')
+        return respostas
+
+    def aquecer(self, n_usuarios=64):
+        """Executa recomendações de teste para carregar as páginas dos arrays antes de servir"""
+        user_ids = self.indice.user_ids[:n_usuarios]
+        if len(user_ids):
+            self.recomendar(int(user_ids[0]), 10)
+            self.recomendar_lote(user_ids, 10)
+
+    def top_lote(self, user_ids, n_recomendacoes=5, tamanho_bloco=256, materializado=True, cronometro=None):
+        """
+        Posições e scores do top N de vários usuários
+
+        Os scores de cada bloco de usuários são calculados como uma matriz
+        (usuários x filmes), com máscara de exclusão e top N por linha.
+        Usuários presentes no top N materializado (sem avaliações recentes)
+        vêm direto da tabela.
+
+        Args:
+            user_ids (list): IDs dos usuários
+            n_recomendacoes (int): Número de recomendações por usuário
+            tamanho_bloco (int): Usuários por bloco (limita a memória da matriz de scores)
+            materializado (bool): Usar o top N materializado quando disponível
+            cronometro (Cronometro): Recebe o tempo de cada etapa, somado entre os blocos (opcional)
+
+        Returns:
+            list: Um par (posições, scores) por usuário, na ordem de user_ids
+        """
+        cronometro = cronometro or CRONOMETRO_NULO
+        user_ids = np.asarray(user_ids)
+        resultados = [None] * len(user_ids)
+
+        ao_vivo = np.arange(len(user_ids))
+        if materializado and self.materializado is not None and n_recomendacoes <= self.materializado.largura:
+            linhas = self.materializado.linhas(user_ids)
+            if self.recentes:
+                linhas[[u in self.recentes for u in user_ids.tolist()]] = -1
+            for i in np.flatnonzero(linhas >= 0):
+                resultados[i] = self.materializado.consultar(linhas[i], n_recomendacoes)
+            ao_vivo = np.flatnonzero(linhas < 0)
+            cronometro.marcar('materializado')
+
+        for inicio in range(0, len(ao_vivo), tamanho_bloco):
+            bloco = ao_vivo[inicio:inicio + tamanho_bloco]
+            excluir = self.mascara_lote(user_ids[bloco])
+            cronometro.marcar('exclusao')
+            scores = self.scorer.scores_lote(user_ids[bloco], self.indice)
+            cronometro.marcar('scores')
+            tops = selecionar_top_n_lote(scores, n_recomendacoes, excluir=excluir)
+            for linha, top_pos in enumerate(tops):
+                resultados[bloco[linha]] = (top_pos, scores[linha, top_pos])
+            cronometro.marcar('top_n')
+        return resultados
+
+    def recomendar_lote(self, user_ids, n_recomendacoes=5, tamanho_bloco=256, cronometro=None):
+        """
+        Gera recomendações para vários usuários de uma vez
+
+        Args:
+            user_ids (list): IDs dos usuários
+            n_recomendacoes (int): Número de recomendações por usuário
+            tamanho_bloco (int): Usuários por bloco (limita a memória da matriz de scores)
+            cronometro (Cronometro): Recebe o tempo de cada etapa (opcional)
+
+        Returns:
+            list: Uma lista de recomendações por usuário, na ordem de user_ids
+        """
+        cronometro = cronometro or CRONOMETRO_NULO
+        tops = self.top_lote(user_ids, n_recomendacoes, tamanho_bloco, cronometro=cronometro)
+        respostas = [self.respostas(posicoes, scores) for posicoes, scores in tops]
+        cronometro.marcar('titulos')
+        return respostas
+
+
+def salvar_artefatos(recomendador, diretorio_modelo, manter=3, ativar=True):
+    """
+    Salva o Recomendador como pacote versionado de arrays .npy + manifest.json
+
+    O pacote é escrito em um diretório temporário e renomeado ao final; depois
+    o arquivo ATUAL passa a apontar para a nova versão (troca atômica).
+
+    Args:
+        recomendador (Recomendador): Recomendador montado no treinamento
+        diretorio_modelo (Path): Diretório do modelo (ex.: models/artefatos/popularity)
+        manter (int): Número de versões mais recentes mantidas em disco
+        ativar (bool): Apontar ATUAL para a nova versão (senão, use ativar_versao depois)
+
+    Returns:
+        str: Versão criada
+    """
+    versao = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    destino = diretorio_modelo / versao
+    temporario = diretorio_modelo / f'.{versao}.tmp'
+    temporario.mkdir(parents=True)
+
+    grupos = {
+        'catalogo': recomendador.catalogo.arrays(),
+        'indice': recomendador.indice.arrays(),
+        'scorer': recomendador.scorer.arrays(),
+    }
+    if recomendador.materializado is not None:
+        grupos['top'] = recomendador.materializado.arrays()
+    if recomendador.vizinhos is not None:
+        grupos['vizinhos'] = recomendador.vizinhos.arrays()
+    arquivos = {}
+    for grupo, arrays in grupos.items():
+        for nome, array in arrays.items():
+            arquivo = f'{grupo}_{nome}.npy'
+            np.save(temporario / arquivo, np.ascontiguousarray(array))
+            arquivos[arquivo] = {'shape': list(np.shape(array)), 'dtype': str(np.asarray(array).dtype)}
+
+    manifest = {
+        'formato': FORMATO_ARTEFATOS,
+        'versao': versao,
+        'modelo': recomendador.nome_modelo,
+        'tipo_scorer': recomendador.scorer.tipo,
+        'top_n_materializado': recomendador.materializado.largura if recomendador.materializado else None,
+        'vizinhos_por_item': recomendador.vizinhos.largura if recomendador.vizinhos else None,
+        'criado_em': datetime.now().isoformat(timespec='seconds'),
+        'arquivos': arquivos,
+    }
+    with open(temporario / 'manifest.json', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+    os.rename(temporario, destino)
+    if ativar:
+        ativar_versao(diretorio_modelo, versao)
+
+    # Remove versões antigas (processos que ainda as mapeiam continuam válidos)
+    versoes = sorted(p for p in diretorio_modelo.iterdir() if p.is_dir() and not p.name.startswith('.'))
+    for antiga in versoes[:-manter]:
+        shutil.rmtree(antiga, ignore_errors=True)
+    return versao
+
+
+def ativar_versao(diretorio_modelo, versao):
+    """Aponta ATUAL para a versão (troca atômica do arquivo)"""
+    ponteiro = diretorio_modelo / '.ATUAL.tmp'
+    ponteiro.write_text(versao)
+    os.replace(ponteiro, diretorio_modelo / 'ATUAL')
+
+
+def salvar_melhor_modelo(diretorio_artefatos, nome_modelo):
+    """Grava em <artefatos>/MELHOR o modelo escolhido no treinamento (padrão da API)"""
+    diretorio_artefatos.mkdir(parents=True, exist_ok=True)
+    ponteiro = diretorio_artefatos / '.MELHOR.tmp'
+    ponteiro.write_text(nome_modelo)
+    os.replace(ponteiro, diretorio_artefatos / 'MELHOR')
+
+
+def modelo_padrao(model_path, padrao='popularity'):
+    """
+    Modelo servido quando MODELO_API não é informado
+
+    Usa o modelo gravado em models/artefatos/MELHOR pelo treinamento; sem ele
+    (ou se ele não tiver sido salvo), o primeiro modelo com pacote de artefatos.
+
+    Args:
+        model_path (Path): Diretório dos modelos salvos
+        padrao (str): Modelo usado se não houver nenhum pacote de artefatos
+
+    Returns:
+        str: Nome do modelo
+    """
+    diretorio_artefatos = model_path / 'artefatos'
+    melhor = diretorio_artefatos / 'MELHOR'
+    if melhor.exists():
+        nome_modelo = melhor.read_text().strip()
+        if (versao_atual(diretorio_artefatos / nome_modelo) is not None
+                or (model_path / f'modelo_{nome_modelo}.pkl').exists()):
+            return nome_modelo
+    salvos = sorted(ponteiro.parent.name for ponteiro in diretorio_artefatos.glob('*/ATUAL'))
+    return salvos[0] if salvos else padrao
+
+
+def versao_atual(diretorio_modelo):
+    """Versão apontada por ATUAL (None se não houver pacote salvo)"""
+    ponteiro = diretorio_modelo / 'ATUAL'
+    return ponteiro.read_text().strip() if ponteiro.exists() else None
+
+
+def carregar_artefatos(diretorio_modelo, versao=None, mmap=True, materializado=False):
+    """
+    Carrega um pacote de artefatos salvo por salvar_artefatos
+
+    Com mmap=True os arrays são abertos com np.load(mmap_mode='r'): a carga é
+    quase instantânea e processos diferentes compartilham as mesmas páginas.
+
+    Args:
+        diretorio_modelo (Path): Diretório do modelo (ex.: models/artefatos/popularity)
+        versao (str): Versão a carregar (padrão: a apontada por ATUAL)
+        mmap (bool): Mapear os arrays em memória em vez de lê-los
+        materializado (bool): Atender pelo top N materializado quando o pacote tiver
+
+    Returns:
+        Recomendador: Pronto para gerar recomendações
+    """
+    versao = versao or versao_atual(diretorio_modelo)
+    if versao is None:
+        raise FileNotFoundError(f'Nenhum pacote de artefatos em {diretorio_modelo}')
+    origem = diretorio_modelo / versao
+
+    with open(origem / 'manifest.json', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest['formato'] != FORMATO_ARTEFATOS:
+        raise ValueError(f"Formato de artefatos {manifest['formato']} não suportado")
+
+    grupos = {'catalogo': {}, 'indice': {}, 'scorer': {}, 'top': {}, 'vizinhos': {}}
+    for arquivo in manifest['arquivos']:
+        grupo, nome = arquivo[:-len('.npy')].split('_', 1)
+        grupos[grupo][nome] = np.load(origem / arquivo, mmap_mode='r' if mmap else None)
+
+    catalogo = Catalogo.de_arrays(grupos['catalogo'])
+    indice = IndiceAvaliacoes.de_arrays(grupos['indice'], len(catalogo))
+    scorer = TIPOS_SCORER[manifest['tipo_scorer']].de_arrays(grupos['scorer'])
+    top = TopMaterializado.de_arrays(grupos['top']) if materializado and grupos['top'] else None
+    vizinhos = VizinhosItens.de_arrays(grupos['vizinhos']) if grupos['vizinhos'] else None
+    return Recomendador(catalogo, indice, scorer, manifest['modelo'], versao=versao, materializado=top,
+                        vizinhos=vizinhos)
+
+
+def montar_recomendador(nome_modelo, modelo, dados, catalogo):
+    """
+    Monta o Recomendador a partir do modelo treinado e dos dados em memória
+
+    Args:
+        nome_modelo (str): Nome do modelo
+        modelo (dict): Modelo treinado
+        dados (dict): 'ratings', 'train_data', 'user_ids' e 'item_ids' do treinamento
+        catalogo (Catalogo): Catálogo de filmes
+
+    Returns:
+        Recomendador: Pronto para gerar recomendações ou ser salvo como artefato
+    """
+    indice = IndiceAvaliacoes.de_avaliacoes(dados['ratings'], catalogo.item_ids)
+    scorer = criar_scorer(nome_modelo, modelo, dados, catalogo)
+    return Recomendador(catalogo, indice, scorer, nome_modelo)
+
+
+def carregar_recomendador(model_path, data_path, nome_modelo='popularity', materializado=False):
+    """
+    Carrega o Recomendador do modelo
+
+    Usa o pacote de artefatos (models/artefatos/<modelo>) quando existe;
+    senão monta a partir de modelo_<nome>.pkl e dados_auxiliares.pkl.
+
+    Args:
+        model_path (Path): Diretório dos modelos salvos
+        data_path (Path): Diretório do dataset (u.item, u.genre)
+        nome_modelo (str): Modelo a servir
+        materializado (bool): Atender pelo top N materializado (só no pacote de artefatos)
+
+    Returns:
+        Recomendador: Pronto para gerar recomendações
+    """
+    diretorio_artefatos = model_path / 'artefatos' / nome_modelo
+    if versao_atual(diretorio_artefatos) is not None:
+        return carregar_artefatos(diretorio_artefatos, materializado=materializado)
+
+    modelo = joblib.load(model_path / f'modelo_{nome_modelo}.pkl')
+    dados = joblib.load(model_path / 'dados_auxiliares.pkl')
+    return montar_recomendador(nome_modelo, modelo, dados, Catalogo.de_arquivos(data_path))
+
+
+class RecarregadorModelo:
+    """
+    Mantém o Recomendador ativo e troca de versão sem reiniciar a API
+
+    Uma thread em segundo plano verifica o arquivo ATUAL do pacote de artefatos
+    (a cada intervalo segundos ou quando solicitar_recarga é chamado). A nova
+    versão é carregada e aquecida fora do caminho das requisições e só então
+    substitui a atual com uma única atribuição; requisições em andamento
+    terminam com a versão antiga, que continua referenciada por elas.
+
+    Avaliações online (registrar_avaliacao) vão para o Recomendador ativo e,
+    a cada compactar_a_cada segundos, são gravadas como uma nova versão do
+    pacote. Carga, aquecimento e compactação acontecem fora do lock de
+    registro; o lock só cobre a troca de versão e a reaplicação das avaliações
+    recebidas nesse meio-tempo, então nenhuma avaliação se perde e /avaliar
+    não fica bloqueado. Se um retreino mudar ATUAL durante a compactação, ela
+    é descartada e a versão retreinada é carregada na verificação seguinte.
+    """
+
+    def __init__(self, model_path, data_path, nome_modelo, intervalo=5.0, materializado=False,
+                 compactar_a_cada=300.0):
+        self.model_path = model_path
+        self.data_path = data_path
+        self.nome_modelo = nome_modelo
+        self.intervalo = intervalo
+        self.materializado = materializado
+        self.compactar_a_cada = compactar_a_cada
+        self.diretorio = model_path / 'artefatos' / nome_modelo
+        self.carregado_em = None
+        self._ultima_compactacao = time.monotonic()
+        self._atual = None
+        self._lock = threading.Lock()
+        self._evento = threading.Event()
+        self._thread = None
+
+        self._trocar(carregar_recomendador(model_path, data_path, nome_modelo, materializado))
+
+    @property
+    def atual(self):
+        """Recomendador ativo (guarde a referência durante toda a requisição)"""
+        return self._atual
+
+    def _trocar(self, recomendador):
+        self._atual = recomendador
+        self.carregado_em = datetime.now().isoformat(timespec='seconds')
+
+    def verificar(self):
+        """
+        Carrega a versão apontada por ATUAL se for diferente da ativa
+
+        Returns:
+            bool: True se houve troca de versão
+        """
+        versao = versao_atual(self.diretorio)
+        if versao is None or versao == self._atual.versao:
+            return False
+
+        print(f"🔄 Carregando versão {versao} do modelo '{self.nome_modelo}'...")
+        novo = carregar_artefatos(self.diretorio, versao, materializado=self.materializado)
+        novo.aquecer()
+
+        with self._lock:
+            if versao_atual(self.diretorio) != versao:
+                # ATUAL mudou de novo durante a carga: a próxima verificação carrega a versão nova
+                return False
+            # Avaliações recentes ainda não compactadas continuam valendo na nova versão
+            for avaliacao in self._atual.avaliacoes_recentes():
+                novo.registrar_avaliacao(*avaliacao)
+            self._trocar(novo)
+        print(f"✅ Versão {versao} ativa")
+        return True
+
+    def registrar_avaliacao(self, user_id, item_id, nota):
+        """
+        Registra uma avaliação online no Recomendador ativo
+
+        Returns:
+            int: Avaliações recentes aguardando compactação
+        """
+        with self._lock:
+            self._atual.registrar_avaliacao(user_id, item_id, nota)
+            return self._atual.n_recentes
+
+    def compactar(self):
+        """
+        Grava as avaliações recentes como nova versão do pacote e passa a servi-la
+
+        Returns:
+            bool: True se a versão compactada passou a ser servida
+        """
+        with self._lock:
+            self._ultima_compactacao = time.monotonic()
+            atual = self._atual
+            if not atual.recentes:
+                return False
+            if versao_atual(self.diretorio) != atual.versao:
+                # Retreino externo ainda não carregado: verificar o carrega e reaplica as avaliações
+                return False
+            instantaneo = atual.instantaneo()
+
+        print(f"🗜️  Compactando {instantaneo.n_recentes} avaliações recentes...")
+        versao = salvar_artefatos(instantaneo.compactado(), self.diretorio, ativar=False)
+        novo = carregar_artefatos(self.diretorio, versao, materializado=self.materializado)
+        novo.aquecer()
+
+        with self._lock:
+            if self._atual is not atual or versao_atual(self.diretorio) != atual.versao:
+                # ATUAL mudou durante a compactação (retreino): a versão compactada é descartada
+                shutil.rmtree(self.diretorio / versao, ignore_errors=True)
+                print("⚠️  Compactação descartada: nova versão do modelo publicada durante ela")
+                return False
+            ativar_versao(self.diretorio, versao)
+            # Avaliações recebidas durante a compactação continuam valendo na nova versão
+            for avaliacao in atual.avaliacoes_desde(instantaneo):
+                novo.registrar_avaliacao(*avaliacao)
+            self._trocar(novo)
+        print(f"✅ Versão {versao} ativa")
+        return True
+
+    def solicitar_recarga(self):
+        """Acorda a thread de verificação (ex.: ao receber SIGHUP)"""
+        self._evento.set()
+
+    def _executar(self):
+        while True:
+            self._evento.wait(self.intervalo or None)
+            self._evento.clear()
+            try:
+                self.verificar()
+            except Exception as e:
+                # Mantém a versão atual servindo se a nova não puder ser carregada
+                print(f"⚠️  Falha ao recarregar o modelo: {e}")
+
+            if self.compactar_a_cada and time.monotonic() - self._ultima_compactacao >= self.compactar_a_cada:
+                try:
+                    self.compactar()
+                except Exception as e:
+                    # As avaliações continuam em memória para a próxima tentativa
+                    print(f"⚠️  Falha ao compactar as avaliações recentes: {e}")
+
+    def iniciar(self):
+        """Inicia a thread de verificação em segundo plano"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._executar, name='recarregador-modelo', daemon=True)
+            self._thread.start()
+        return self
+
+
+class CacheRespostas:
+    """
+    Cache LRU com TTL de recomendações já serializadas em JSON
+
+    A chave é (versão do modelo, user_id), então uma nova versão invalida o
+    cache automaticamente. Cada entrada guarda um fragmento JSON por filme e o
+    N com que foi calculada: pedidos com N menor são atendidos fatiando a lista.
+
+    Invalidações incrementam uma geração (global e por grupo de usuários): quem
+    calcula uma resposta lê a geração antes (geracao) e a passa para guardar,
+    que descarta a resposta se houve invalidação no meio do cálculo; assim uma
+    resposta calculada antes de uma avaliação nunca entra no cache depois dela.
+    """
+
+    # Gerações por usuário em um array fixo (user_id % tamanho): colisões só descartam um guardar a mais
+    N_GERACOES = 4096
+
+    def __init__(self, max_itens=10000, ttl=300.0):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self.acertos = 0
+        self.falhas = 0
+        self.remocoes = 0
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self._geracao_global = 0
+        self._geracoes = [0] * self.N_GERACOES
+
+    def geracao(self, user_id):
+        """Geração atual das entradas do usuário (leia antes de calcular a resposta)"""
+        return self._geracao_global, self._geracoes[user_id % self.N_GERACOES]
+
+    def obter(self, versao, user_id, n_recomendacoes):
+        """Fragmentos das n primeiras recomendações (None se não estiver no cache)"""
+        chave = (versao, user_id)
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None:
+                expira_em, n_calculado, fragmentos = entrada
+                if expira_em < time.monotonic():
+                    del self._entradas[chave]
+                    self.remocoes += 1
+                elif n_recomendacoes <= n_calculado:
+                    self._entradas.move_to_end(chave)
+                    self.acertos += 1
+                    return fragmentos[:n_recomendacoes]
+            self.falhas += 1
+            return None
+
+    def guardar(self, versao, user_id, n_calculado, fragmentos, geracao=None):
+        """
+        Guarda as recomendações calculadas com n_calculado, removendo as menos usadas
+
+        Com geracao (lida antes do cálculo), a resposta é descartada se o
+        usuário foi invalidado enquanto ela era calculada.
+        """
+        if self.max_itens <= 0:
+            return
+        with self._lock:
+            if geracao is not None and geracao != self.geracao(user_id):
+                return
+            self._entradas[(versao, user_id)] = (time.monotonic() + self.ttl, n_calculado, fragmentos)
+            self._entradas.move_to_end((versao, user_id))
+            while len(self._entradas) > self.max_itens:
+                self._entradas.popitem(last=False)
+                self.remocoes += 1
+
+    def invalidar(self, versao, user_id):
+        """Remove as recomendações do usuário (ex.: após uma nova avaliação)"""
+        with self._lock:
+            self._geracoes[user_id % self.N_GERACOES] += 1
+            if self._entradas.pop((versao, user_id), None) is not None:
+                self.remocoes += 1
+
+    def invalidar_todos(self):
+        """Remove as recomendações de todos os usuários (ex.: avaliação que muda os scores de todos)"""
+        with self._lock:
+            self._geracao_global += 1
+            self.remocoes += len(self._entradas)
+            self._entradas.clear()
+
+    def limpar(self):
+        """Remove todas as entradas e zera os contadores"""
+        with self._lock:
+            self._entradas.clear()
+            self.acertos = self.falhas = self.remocoes = 0
+
+    def estatisticas(self):
+        """Contadores de acertos, falhas e remoções"""
+        return {
+            'itens': len(self._entradas),
+            'max_itens': self.max_itens,
+            'ttl_segundos': self.ttl,
+            'acertos': self.acertos,
+            'falhas': self.falhas,
+            'remocoes': self.remocoes,
+        }
+
+
+class Cronometro:
+    """
+    Tempo de cada etapa de uma requisição
+
+    marcar(etapa) atribui à etapa o tempo decorrido desde a marcação anterior
+    (ou desde a criação); etapas repetidas, como nos blocos do lote, são somadas.
+    """
+
+    def __init__(self):
+        self.inicio = self._ultimo = time.perf_counter()
+        self.etapas = {}
+
+    def marcar(self, etapa):
+        agora = time.perf_counter()
+        self.etapas[etapa] = self.etapas.get(etapa, 0.0) + (agora - self._ultimo)
+        self._ultimo = agora
+
+    def reiniciar(self):
+        """Descarta o tempo desde a última marcação (ex.: trecho que não pertence a nenhuma etapa)"""
+        self._ultimo = time.perf_counter()
+
+    def total(self):
+        return time.perf_counter() - self.inicio
+
+
+class _CronometroNulo:
+    """Cronômetro que não mede nada, usado quando nenhum é passado"""
+
+    def marcar(self, etapa):
+        pass
+
+    def reiniciar(self):
+        pass
+
+
+CRONOMETRO_NULO = _CronometroNulo()
+
+
+class Histograma:
+    """Histograma de buckets fixos no formato do Prometheus (contagens por bucket, soma e total)"""
+
+    def __init__(self, limites=LIMITES_LATENCIA):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        # bisect_left: valor igual ao limite cai no bucket do limite (le = "menor ou igual")
+        self.contagens[bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+        self.total += 1
+
+    def acumulados(self):
+        """Pares (limite, contagem acumulada), terminando em +Inf"""
+        acumulado = 0
+        for limite, contagem in zip(self.limites + (float('inf'),), self.contagens):
+            acumulado += contagem
+            yield limite, acumulado
+
+
+def _escapar_rotulo(valor):
+    # Formato texto do Prometheus: barra invertida, aspas e quebra de linha são escapadas
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _rotulos(**rotulos):
+    return ','.join(f'{nome}="{_escapar_rotulo(valor)}"' for nome, valor in rotulos.items())
+
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class MetricasRequisicoes:
+    """
+    Histogramas de latência por endpoint e etapa, e contadores de requisições e erros
+
+    Cada requisição é registrada de uma vez (um lock por requisição), a partir
+    do Cronometro preenchido durante o atendimento. texto_prometheus exporta
+    tudo no formato texto do Prometheus.
+    """
+
+    def __init__(self, limites=LIMITES_LATENCIA):
+        self.limites = limites
+        self.latencias = {}
+        self.requisicoes = {}
+        self.erros = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, endpoint, status, cronometro):
+        """Registra a latência total, a de cada etapa e o status da requisição"""
+        total = cronometro.total()
+        with self._lock:
+            for etapa, segundos in (*cronometro.etapas.items(), ('total', total)):
+                histograma = self.latencias.get((endpoint, etapa))
+                if histograma is None:
+                    histograma = self.latencias[(endpoint, etapa)] = Histograma(self.limites)
+                histograma.observar(segundos)
+            chave = (endpoint, str(status))
+            self.requisicoes[chave] = self.requisicoes.get(chave, 0) + 1
+
+    def contar_erro(self, endpoint, erro):
+        """Conta uma exceção tratada pelo endpoint, pelo nome do tipo"""
+        chave = (endpoint, type(erro).__name__)
+        with self._lock:
+            self.erros[chave] = self.erros.get(chave, 0) + 1
+
+    def texto_prometheus(self, extras=()):
+        """
+        Métricas no formato texto do Prometheus
+
+        Args:
+            extras (list): Tuplas (nome, tipo, ajuda, [(rótulos, valor), ...]) com métricas adicionais
+
+        Returns:
+            str: Corpo da resposta de /metrics
+        """
+        with self._lock:
+            latencias = {chave: (list(h.acumulados()), h.soma, h.total) for chave, h in self.latencias.items()}
+            requisicoes = dict(self.requisicoes)
+            erros = dict(self.erros)
+
+        linhas = ['# HELP recomendacao_latencia_segundos Latência das requisições por endpoint e etapa',
+                  '# TYPE recomendacao_latencia_segundos histogram']
+        for (endpoint, etapa), (acumulados, soma, total) in sorted(latencias.items()):
+            for limite, contagem in acumulados:
+                rotulos = _rotulos(endpoint=endpoint, etapa=etapa, le=_numero(limite))
+                linhas.append(f'recomendacao_latencia_segundos_bucket{{{rotulos}}} {contagem}')
+            rotulos = _rotulos(endpoint=endpoint, etapa=etapa)
+            linhas.append(f'recomendacao_latencia_segundos_sum{{{rotulos}}} {_numero(soma)}')
+            linhas.append(f'recomendacao_latencia_segundos_count{{{rotulos}}} {total}')
+
+        metricas = [
+            ('recomendacao_requisicoes_total', 'counter', 'Requisições atendidas por endpoint e status',
+             [({'endpoint': e, 'status': s}, v) for (e, s), v in sorted(requisicoes.items())]),
+            ('recomendacao_erros_total', 'counter', 'Exceções tratadas por endpoint e tipo',
+             [({'endpoint': e, 'tipo': t}, v) for (e, t), v in sorted(erros.items())]),
+            *extras,
+        ]
+        for nome, tipo, ajuda, valores in metricas:
+            linhas.append(f'# HELP {nome} {ajuda}')
+            linhas.append(f'# TYPE {nome} {tipo}')
+            for rotulos, valor in valores:
+                rotulos = f'{{{_rotulos(**rotulos)}}}' if rotulos else ''
+                linhas.append(f'{nome}{rotulos} {_numero(valor)}')
+        return '\n'.join(linhas) + '\n'
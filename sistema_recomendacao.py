@@ -6,53 +6,619 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 import joblib
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from scipy import sparse
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error, mean_absolute_error
 from sklearn.decomposition import TruncatedSVD
 from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+from dados_movielens import carregar_avaliacoes, carregar_filmes, em_cache
+from servico_recomendacao import (RECALL_MINIMO_IVF, Catalogo, TopMaterializado, VizinhosItens, carregar_artefatos,
+                                  montar_recomendador, salvar_artefatos, salvar_melhor_modelo)
 import warnings
 warnings.filterwarnings('ignore')
 
 DATA_PATH = Path('ml-100k')
 MODEL_PATH = Path('models')
 MODEL_PATH.mkdir(exist_ok=True)
+ARTEFATOS_PATH = MODEL_PATH / 'artefatos'
+
+# Recomendações pré-calculadas por usuário (igual ao máximo aceito pela API)
+TOP_N_MATERIALIZADO = 50
+
+# Hiperparâmetros padrão da fatoração ALS (threads=None usa todas as CPUs)
+CONFIG_ALS = {'rank': 50, 'regularizacao': 0.1, 'epocas': 10, 'threads': None}
+
+def compartilhar_arrays(arrays):
+    """
+    Copia arrays numpy para blocos de memória compartilhada
+    
+    Retorna os blocos (o chamador deve fechar e liberar com unlink ao final)
+    e uma descrição {nome: (bloco, shape, dtype)} que os workers usam para
+    reabrir os mesmos dados sem cópia via anexar_arrays.
+    """
+    blocos, descricao = [], {}
+    for nome, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        bloco = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=bloco.buf)[...] = array
+        blocos.append(bloco)
+        descricao[nome] = (bloco.name, array.shape, array.dtype.str)
+    return blocos, descricao
+
+
+def anexar_arrays(descricao):
+    """Reabre (sem copiar) os arrays descritos por compartilhar_arrays"""
+    blocos, arrays = [], {}
+    for nome, (nome_bloco, shape, dtype) in descricao.items():
+        bloco = shared_memory.SharedMemory(name=nome_bloco)
+        blocos.append(bloco)
+        arrays[nome] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=bloco.buf)
+    return blocos, arrays
+
+
+def liberar_blocos(blocos):
+    for bloco in blocos:
+        bloco.close()
+        bloco.unlink()
+
+
+def similaridade_top_k(matriz, k, tamanho_bloco=1000):
+    """
+    Similaridade do cosseno entre as linhas da matriz, mantendo só os k vizinhos mais similares
+    
+    A similaridade é calculada em blocos de linhas, então a matriz N x N completa
+    nunca existe em memória: o resultado é uma matriz esparsa CSR com no máximo
+    k valores por linha (a própria linha não entra como vizinha).
+    """
+    normalizada = normalize(sparse.csr_matrix(matriz), norm='l2', axis=1)
+    n = normalizada.shape[0]
+    k = min(k, n - 1)
+    vizinhos = np.empty((n, k), dtype=np.int32)
+    valores = np.empty((n, k), dtype=np.float64)
+    
+    for inicio in range(0, n, tamanho_bloco):
+        fim = min(inicio + tamanho_bloco, n)
+        bloco = (normalizada[inicio:fim] @ normalizada.T).toarray()
+        bloco[np.arange(fim - inicio), np.arange(inicio, fim)] = -np.inf
+        
+        top = np.argpartition(bloco, n - k, axis=1)[:, n - k:]
+        vizinhos[inicio:fim] = top
+        valores[inicio:fim] = np.take_along_axis(bloco, top, axis=1)
+    
+    similaridade = sparse.csr_matrix((valores.ravel(), vizinhos.ravel(), np.arange(0, n * k + 1, k)), shape=(n, n))
+    similaridade.eliminate_zeros()
+    return similaridade
+
+
+def _resolver_als(matriz, alvo, fixos, regularizacao, n_threads, tamanho_bloco=256, max_elementos=1 << 23):
+    """
+    Um passo do ALS: mínimos quadrados regularizados de cada linha da matriz CSR
+    
+    Para a linha u, com as colunas observadas C_u e os fatores fixos F, resolve
+    (F[C_u]ᵀ F[C_u] + regularizacao * |C_u| * I) x = F[C_u]ᵀ alvo_u. As linhas são
+    ordenadas pelo número de notas e agrupadas em blocos; em cada bloco os fatores
+    observados viram um array (linhas x m x d) preenchido com zeros até a maior
+    linha, e sistemas, termos e solve são operações em lote do numpy, sem laço
+    Python por linha. Os blocos são distribuídos entre threads (o numpy libera o
+    GIL nos produtos e no solve); max_elementos limita a memória de cada bloco.
+    """
+    n, d = matriz.shape[0], fixos.shape[1]
+    indptr, contagens = matriz.indptr, np.diff(matriz.indptr)
+    # Posições de preenchimento apontam para uma linha de zeros extra (fatores e alvo)
+    indices = np.append(matriz.indices, fixos.shape[0])
+    fixos = np.vstack([fixos, np.zeros((1, d))])
+    alvo = np.append(alvo, 0.0)
+    resultado = np.zeros((n, d))
+    diagonal = np.arange(d)
+    
+    # Linhas de tamanho parecido no mesmo bloco: pouco preenchimento
+    ordem = np.argsort(contagens, kind='stable')
+    blocos = []
+    inicio = 0
+    while inicio < n:
+        fim = min(inicio + tamanho_bloco, n)
+        # A última linha do bloco é a maior e define o preenchimento
+        while fim - inicio > 1 and (fim - inicio) * contagens[ordem[fim - 1]] * d > max_elementos:
+            fim = inicio + (fim - inicio) // 2
+        blocos.append(ordem[inicio:fim])
+        inicio = fim
+    
+    def resolver_bloco(linhas):
+        m = max(int(contagens[linhas[-1]]), 1)
+        entradas = np.where(np.arange(m) < contagens[linhas][:, None], indptr[linhas][:, None] + np.arange(m), -1)
+        observados = fixos[indices[entradas]]
+        transpostos = observados.transpose(0, 2, 1)
+        sistemas = transpostos @ observados
+        sistemas[:, diagonal, diagonal] += regularizacao * np.maximum(contagens[linhas], 1)[:, None]
+        termos = transpostos @ alvo[entradas][..., None]
+        resultado[linhas] = np.linalg.solve(sistemas, termos)[..., 0]
+    
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        list(pool.map(resolver_bloco, blocos))
+    return resultado
+
+
+def fatoracao_als(matriz, rank=CONFIG_ALS['rank'], regularizacao=CONFIG_ALS['regularizacao'],
+                  epocas=CONFIG_ALS['epocas'], n_threads=CONFIG_ALS['threads'], semente=42):
+    """
+    Fatoração de matrizes com vieses, treinada só nas notas observadas (ALS)
+    
+    Predição: média global + viés do usuário + viés do item + p_u · q_i. Cada época
+    fixa os itens e resolve todos os usuários, depois o contrário; o viés entra como
+    uma coluna extra dos fatores (p_u, b_u) contra (q_i, 1). A regularização é
+    ponderada pelo número de notas de cada linha (ALS-WR).
+    
+    Args:
+        matriz (csr_matrix): Notas observadas (usuários x itens)
+        rank (int): Número de fatores latentes
+        regularizacao (float): Peso da regularização L2
+        epocas (int): Número de épocas (um passo de usuários e um de itens cada)
+        n_threads (int): Threads dos passos (padrão: número de CPUs)
+        semente (int): Semente da inicialização dos fatores dos itens
+    
+    Returns:
+        dict: media_global, user_factors, bias_usuarios, item_factors e bias_itens
+    """
+    matriz = sparse.csr_matrix(matriz, dtype=np.float64)
+    transposta = matriz.T.tocsr()
+    n_threads = n_threads or os.cpu_count() or 1
+    media_global = float(matriz.data.mean())
+    
+    # Fatores aumentados: usuários (p_u, b_u) e itens (q_i, b_i)
+    rng = np.random.default_rng(semente)
+    usuarios = np.zeros((matriz.shape[0], rank + 1))
+    itens = np.hstack([rng.normal(0, 0.1, (matriz.shape[1], rank)), np.zeros((matriz.shape[1], 1))])
+    uns_usuarios = np.ones((matriz.shape[0], 1))
+    uns_itens = np.ones((matriz.shape[1], 1))
+    
+    for _ in range(epocas):
+        # Usuários: alvo = nota - média - viés do item, contra (q_i, 1)
+        alvo = matriz.data - media_global - itens[matriz.indices, -1]
+        usuarios = _resolver_als(matriz, alvo, np.hstack([itens[:, :-1], uns_itens]), regularizacao, n_threads)
+        # Itens: alvo = nota - média - viés do usuário, contra (p_u, 1)
+        alvo = transposta.data - media_global - usuarios[transposta.indices, -1]
+        itens = _resolver_als(transposta, alvo, np.hstack([usuarios[:, :-1], uns_usuarios]), regularizacao,
+                              n_threads)
+    
+    return {
+        'media_global': media_global,
+        'user_factors': usuarios[:, :-1],
+        'bias_usuarios': usuarios[:, -1],
+        'item_factors': itens[:, :-1],
+        'bias_itens': itens[:, -1],
+    }
+
+
+def metricas_ranking(recomendador, user_ids, relevantes, k=10, tamanho_bloco=256):
+    """
+    Somas de precision@k, recall@k, AP@k e NDCG@k do top K de cada usuário
+    
+    Os scores do catálogo inteiro são calculados em blocos de usuários pelo
+    próprio Recomendador (top_lote), com os filmes do índice (treino) excluídos;
+    a relevância do bloco vira uma matriz booleana densa e todas as métricas
+    saem de operações por linha sobre a matriz de acertos (usuários x K).
+    
+    Args:
+        recomendador (Recomendador): Recomendador com o índice só de treino
+        user_ids (np.ndarray): Usuários avaliados
+        relevantes (csr_matrix): Filmes relevantes no teste (linha de cada usuário x posições do catálogo)
+        k (int): Tamanho da lista avaliada
+        tamanho_bloco (int): Usuários por bloco
+    
+    Returns:
+        dict: Soma de cada métrica sobre os usuários (dividir pelo número de usuários)
+    """
+    somas = dict.fromkeys(('precisao', 'recall', 'map', 'ndcg'), 0.0)
+    desconto = 1 / np.log2(np.arange(2, k + 2))
+    dcg_ideal = np.cumsum(desconto)
+    
+    for inicio in range(0, len(user_ids), tamanho_bloco):
+        bloco = user_ids[inicio:inicio + tamanho_bloco]
+        top = np.full((len(bloco), k), -1, dtype=np.int64)
+        for linha, (posicoes, _) in enumerate(recomendador.top_lote(bloco, k, tamanho_bloco, materializado=False)):
+            top[linha, :len(posicoes)] = posicoes
+        
+        relevancia = relevantes[inicio:inicio + tamanho_bloco].toarray()
+        acertos = np.take_along_axis(relevancia, np.maximum(top, 0), axis=1) & (top >= 0)
+        n_relevantes = relevancia.sum(axis=1)
+        n_acertos = acertos.sum(axis=1)
+        precisao_ate = np.cumsum(acertos, axis=1) / np.arange(1, k + 1)
+        
+        somas['precisao'] += (n_acertos / k).sum()
+        somas['recall'] += (n_acertos / n_relevantes).sum()
+        somas['map'] += ((precisao_ate * acertos).sum(axis=1) / np.minimum(n_relevantes, k)).sum()
+        somas['ndcg'] += ((acertos * desconto).sum(axis=1) / dcg_ideal[np.minimum(n_relevantes, k) - 1]).sum()
+    return somas
+
+
+def _zerar_pico_rss():
+    """Zera o pico de RSS do processo (Linux); sem suporte, o pico medido é o do processo inteiro"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _pico_rss_mb():
+    """Pico de memória residente do processo em MB (None se a plataforma não informar)"""
+    try:
+        with open('/proc/self/status') as f:
+            for linha in f:
+                if linha.startswith('VmHWM:'):
+                    return int(linha.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+
+class PerfilTreino:
+    """
+    Tempo de parede, tempo de CPU e pico de memória de cada etapa do treinamento
+    
+    Cada etapa custa algumas chamadas de sistema, então o perfil pode ficar
+    ligado em todo retreino. Com usar_tracemalloc também mede o pico de
+    memória alocada pelo Python na etapa (bem mais caro). Etapas não devem
+    ser aninhadas: o pico de RSS é zerado no início de cada uma.
+    """
+    
+    def __init__(self, ativo=False, usar_tracemalloc=False, processo='principal'):
+        self.ativo = ativo
+        self.usar_tracemalloc = ativo and usar_tracemalloc
+        self.processo = processo
+        self.etapas = []
+        self.inicio = time.perf_counter()
+        if self.usar_tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+    
+    @contextlib.contextmanager
+    def etapa(self, nome):
+        if not self.ativo:
+            yield
+            return
+        
+        _zerar_pico_rss()
+        if self.usar_tracemalloc:
+            tracemalloc.reset_peak()
+            memoria_antes = tracemalloc.get_traced_memory()[0]
+        inicio, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            tempo, tempo_cpu = time.perf_counter() - inicio, time.process_time() - cpu
+            pico_rss = _pico_rss_mb()
+            registro = {
+                'etapa': nome,
+                'processo': self.processo,
+                'tempo_s': round(tempo, 4),
+                'cpu_s': round(tempo_cpu, 4),
+                'pico_rss_mb': round(pico_rss, 1) if pico_rss is not None else None,
+            }
+            if self.usar_tracemalloc:
+                registro['pico_python_mb'] = round((tracemalloc.get_traced_memory()[1] - memoria_antes) / 2**20, 2)
+            self.etapas.append(registro)
+    
+    def imprimir(self):
+        print("=" * 70)
+        print("⏱️  PERFIL DO TREINAMENTO")
+        print("=" * 70)
+        for registro in self.etapas:
+            pico = f"{registro['pico_rss_mb']:8.1f} MB" if registro['pico_rss_mb'] is not None else "       -   "
+            python = f" | Python: {registro['pico_python_mb']:7.2f} MB" if 'pico_python_mb' in registro else ""
+            print(f"{registro['etapa']:36} | {registro['tempo_s']:7.3f}s | CPU: {registro['cpu_s']:7.3f}s | "
+                  f"RSS: {pico}{python}")
+        print("=" * 70)
+    
+    def salvar(self, caminho, **contexto):
+        """Grava o relatório JSON e acrescenta uma linha ao histórico (<caminho>.jsonl)"""
+        relatorio = {
+            'criado_em': datetime.now().isoformat(timespec='seconds'),
+            **contexto,
+            'tracemalloc': self.usar_tracemalloc,
+            # Tempo de parede desde a criação do perfil: com --processos o ajuste e a avaliação dos
+            # modelos são etapas dos workers, e a soma das etapas do processo principal os deixaria de fora
+            'tempo_total_s': round(time.perf_counter() - self.inicio, 4),
+            'etapas': self.etapas,
+        }
+        with open(caminho, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, indent=2, ensure_ascii=False)
+        with open(caminho.with_suffix('.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(relatorio, ensure_ascii=False) + '\n')
+        return caminho
+
+
+# Estado de cada processo do pool de treinamento (preenchido por _inicializar_worker)
+_worker = {}
+
+
+def _config_als_worker(config_als, n_processos):
+    """Configuração do ALS em um processo do pool: as threads dividem as CPUs (nunca processos x CPUs threads)"""
+    threads = max(1, (os.cpu_count() or 1) // n_processos)
+    return {**config_als, 'threads': min(config_als['threads'] or threads, threads)}
+
+
+def _inicializar_worker(descricao, k_vizinhos, config_perfil=(False, False), config_als=None):
+    blocos, arrays = anexar_arrays(descricao)
+    _worker['blocos'] = blocos
+    _worker['sistema'] = SistemaRecomendacao.de_arrays(arrays, k_vizinhos, config_als)
+    _worker['sistema'].perfil = PerfilTreino(*config_perfil, processo=f'worker-{os.getpid()}')
+
+
+def _treinar_no_worker(nome_modelo):
+    """Treina e avalia um modelo no worker; devolve o modelo, as métricas, o tempo, o log e o perfil"""
+    sistema = _worker['sistema']
+    sistema.perfil.etapas = []
+    saida = io.StringIO()
+    inicio = time.perf_counter()
+    with contextlib.redirect_stdout(saida):
+        getattr(sistema, SistemaRecomendacao.MODELOS[nome_modelo])()
+    tempo = time.perf_counter() - inicio
+    return (nome_modelo, sistema.modelos[nome_modelo], sistema.resultados[nome_modelo], tempo, saida.getvalue(),
+            sistema.perfil.etapas)
+
+
+def _inicializar_worker_cv(descricao, k_vizinhos, config_als=None):
+    blocos, arrays = anexar_arrays(descricao)
+    _worker['blocos'] = blocos
+    _worker['avaliacoes'] = pd.DataFrame({c: arrays[c] for c in ('user_id', 'item_id', 'rating')})
+    _worker['fold'] = arrays['fold']
+    _worker['k_vizinhos'] = k_vizinhos
+    _worker['config_als'] = config_als
+
+
+def _avaliar_fold(fold):
+    """Treina e avalia todos os modelos em um fold (teste = avaliações do fold, treino = o resto)"""
+    avaliacoes, folds = _worker['avaliacoes'], _worker['fold']
+    sistema = SistemaRecomendacao(k_vizinhos=_worker['k_vizinhos'], config_als=_worker['config_als'])
+    inicio = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        sistema.preparar_dados(avaliacoes[folds != fold], avaliacoes[folds == fold])
+        sistema.treinar_modelos()
+    return fold, sistema.resultados, time.perf_counter() - inicio
+
+
+def _inicializar_worker_ranking(diretorios, descricao, k):
+    blocos, arrays = anexar_arrays(descricao)
+    _worker['blocos'] = blocos
+    # Pacotes de artefatos mapeados em memória: os workers compartilham as páginas dos scorers
+    _worker['recomendadores'] = {nome: carregar_artefatos(Path(d)) for nome, d in diretorios.items()}
+    _worker['usuarios'] = arrays['usuarios']
+    _worker['relevantes'] = sparse.csr_matrix(
+        (np.ones(len(arrays['indices']), dtype=bool), arrays['indices'], arrays['indptr']),
+        shape=tuple(arrays['shape'])
+    )
+    _worker['k'] = k
+
+
+def _avaliar_ranking_fatia(nome_modelo, inicio, fim):
+    """Métricas de ranking de um modelo para a fatia [inicio, fim) dos usuários de teste"""
+    somas = metricas_ranking(_worker['recomendadores'][nome_modelo], _worker['usuarios'][inicio:fim],
+                             _worker['relevantes'][inicio:fim], _worker['k'])
+    return nome_modelo, somas
+
 
 class SistemaRecomendacao:
     
-    def __init__(self):
+    # Nome do modelo -> método que treina e avalia
+    MODELOS = {
+        'random': 'recomendacao_aleatoria',
+        'popularity': 'recomendacao_popularidade',
+        'knn_user': 'recomendacao_knn_user',
+        'knn_item': 'recomendacao_knn_item',
+        'svd': 'recomendacao_svd',
+        'als': 'recomendacao_als',
+    }
+    
+    def __init__(self, k_vizinhos=None, data_path=DATA_PATH, perfil=None, config_als=None,
+                 metodo_similares='auto'):
+        self.data_path = data_path
+        self.metodo_similares = metodo_similares
+        self.perfil = perfil or PerfilTreino()
         self.ratings = None
         self.movies = None
         self.train_data = None
         self.test_data = None
         self.user_item_matrix = None
+        self.user_ids = None
+        self.item_ids = None
+        self.k_vizinhos = k_vizinhos
+        self.config_als = {**CONFIG_ALS, **(config_als or {})}
         self.modelos = {}
         self.resultados = {}
+        self.tempos = {}
         
     def carregar_dados(self):
         print("📂 Carregando dados...")
         
-        self.ratings = pd.read_csv(DATA_PATH / 'u.data', sep='\t', 
-                                   names=['user_id', 'item_id', 'rating', 'timestamp'])
+        # Qualquer formato MovieLens (u.data, ratings.dat, ratings.csv), com tipos compactos
+        self.ratings = carregar_avaliacoes(self.data_path).dataframe()
         
-        self.movies = pd.read_csv(DATA_PATH / 'u.item', sep='|', encoding='latin-1',
-                                  names=['item_id', 'title', 'release_date', 'video_release_date', 'imdb_url'] + 
-                                  [f'genre_{i}' for i in range(19)], usecols=['item_id', 'title'])
+        movies, _ = carregar_filmes(self.data_path)
+        self.movies = movies[['item_id', 'title']]
         
         print(f"✅ {len(self.ratings):,} avaliações carregadas")
         print(f"✅ {len(self.movies):,} filmes carregados\n")
         
-    def preparar_dados(self):
+    def preparar_dados(self, train_data=None, test_data=None):
         print("🔧 Preparando dados para treinamento...")
         
-        # Dividir em treino e teste
-        self.train_data, self.test_data = train_test_split(self.ratings, test_size=0.2, random_state=42)
-        
-        # Criar matriz usuário-item
-        self.user_item_matrix = self.train_data.pivot_table(
-            index='user_id', columns='item_id', values='rating'
-        ).fillna(0)
+        # Dividir em treino e teste (ou usar a divisão recebida, ex.: um fold da validação cruzada)
+        if train_data is None:
+            self.train_data, self.test_data = train_test_split(self.ratings, test_size=0.2, random_state=42)
+        else:
+            self.train_data, self.test_data = train_data, test_data
+        
+        # Criar matriz usuário-item esparsa (CSR): linha = posição em user_ids, coluna = posição em item_ids
+        self.user_ids = np.sort(self.train_data['user_id'].unique())
+        self.item_ids = np.sort(self.train_data['item_id'].unique())
+        linhas = np.searchsorted(self.user_ids, self.train_data['user_id'].values)
+        colunas = np.searchsorted(self.item_ids, self.train_data['item_id'].values)
+        self.user_item_matrix = sparse.csr_matrix(
+            (self.train_data['rating'].values.astype(np.float64), (linhas, colunas)),
+            shape=(len(self.user_ids), len(self.item_ids))
+        )
+        
+        print(f"✅ Treino: {len(self.train_data):,} | Teste: {len(self.test_data):,}")
+        print(f"✅ Matriz esparsa: {self.user_item_matrix.shape[0]:,} x {self.user_item_matrix.shape[1]:,} "
+              f"({self.user_item_matrix.nnz:,} valores)\n")
+        
+    def folds_oficiais(self, n_folds=5):
+        """
+        Fold (1 a n_folds) de cada avaliação, segundo os arquivos u1.test ... u5.test do dataset
+        
+        Os arquivos de teste só são usados para marcar as linhas de self.ratings
+        (chave usuário/item), então as avaliações são lidas e tipadas uma única vez.
+        O resultado fica no cache colunar do dataset.
+        """
+        fontes = [self.data_path / 'u.data'] + [self.data_path / f'u{k}.test' for k in range(1, n_folds + 1)]
+        if not all(fonte.exists() for fonte in fontes):
+            raise FileNotFoundError(f'Folds oficiais (u1.test ... u{n_folds}.test) não encontrados em {self.data_path}; '
+                                    'eles só existem no MovieLens 100k')
+        
+        def calcular():
+            base = self.ratings['item_id'].max() + 1
+            chaves = self.ratings['user_id'].values.astype(np.int64) * base + self.ratings['item_id'].values
+            ordem = np.argsort(chaves)
+            
+            fold = np.zeros(len(chaves), dtype=np.int8)
+            for k in range(1, n_folds + 1):
+                teste = pd.read_csv(self.data_path / f'u{k}.test', sep='\t', usecols=[0, 1],
+                                    names=['user_id', 'item_id'])
+                chaves_teste = teste['user_id'].values.astype(np.int64) * base + teste['item_id'].values
+                fold[ordem[np.searchsorted(chaves, chaves_teste, sorter=ordem)]] = k
+            return {'fold': fold}, {}
+        
+        arrays, _ = em_cache(self.data_path, f'folds_{n_folds}', fontes, calcular)
+        return arrays['fold']
+    
+    def validacao_cruzada(self, n_folds=5, n_processos=None):
+        """
+        Avalia todos os modelos nos folds oficiais u1..u5, um fold por processo
+        
+        As avaliações e o fold de cada linha vão uma única vez para memória
+        compartilhada; cada worker monta o próprio treino/teste a partir delas.
+        n_processos (padrão: um por fold) é limitado ao número de folds.
+        Retorna um DataFrame com média e desvio padrão de RMSE e MAE por modelo.
+        """
+        print("=" * 70)
+        print(f"🔁 VALIDAÇÃO CRUZADA ({n_folds} folds oficiais)")
+        print("=" * 70)
         
-        print(f"✅ Treino: {len(self.train_data):,} | Teste: {len(self.test_data):,}\n")
+        if self.ratings is None:
+            self.carregar_dados()
+        fold = self.folds_oficiais(n_folds)
+        arrays = {c: self.ratings[c].values for c in ('user_id', 'item_id', 'rating')}
+        arrays['fold'] = fold
+        
+        n_processos = min(n_processos or n_folds, n_folds)
+        print(f"⚡ Avaliando {len(self.MODELOS)} modelos em {n_folds} folds ({n_processos} processos)...\n")
+        resultados = []
+        inicio = time.perf_counter()
+        blocos, descricao = compartilhar_arrays(arrays)
+        try:
+            with ProcessPoolExecutor(max_workers=n_processos, initializer=_inicializar_worker_cv,
+                                     initargs=(descricao, self.k_vizinhos,
+                                               _config_als_worker(self.config_als, n_processos))) as pool:
+                futuros = [pool.submit(_avaliar_fold, k) for k in range(1, n_folds + 1)]
+                for futuro in as_completed(futuros):
+                    k, resultados_fold, tempo = futuro.result()
+                    print(f"   ✅ Fold u{k}: {tempo:.2f}s")
+                    for modelo, metricas in resultados_fold.items():
+                        resultados.append({'modelo': modelo, 'fold': k, **metricas})
+        finally:
+            liberar_blocos(blocos)
+        print(f"⏱️  Validação cruzada: {time.perf_counter() - inicio:.2f}s\n")
+        
+        resumo = (pd.DataFrame(resultados).groupby('modelo')[['RMSE', 'MAE']]
+                  .agg(['mean', 'std']).sort_values(('RMSE', 'mean')))
+        print("Ranking por RMSE médio (menor é melhor):")
+        print("-" * 70)
+        for idx, (modelo, row) in enumerate(resumo.iterrows(), 1):
+            print(f"{idx}. {modelo:20} | RMSE: {row[('RMSE', 'mean')]:.4f} ± {row[('RMSE', 'std')]:.4f} "
+                  f"| MAE: {row[('MAE', 'mean')]:.4f} ± {row[('MAE', 'std')]:.4f}")
+        print("=" * 70)
+        print()
+        return resumo
+    
+    def arrays_treino(self):
+        """Arrays numpy com tudo que os métodos de treino usam (matriz CSR, mapeamentos, treino e teste)"""
+        arrays = {
+            'matriz_data': self.user_item_matrix.data,
+            'matriz_indices': self.user_item_matrix.indices,
+            'matriz_indptr': self.user_item_matrix.indptr,
+            'matriz_shape': np.asarray(self.user_item_matrix.shape),
+            'user_ids': self.user_ids,
+            'item_ids': self.item_ids,
+        }
+        for nome, df in (('train', self.train_data), ('test', self.test_data)):
+            for coluna in ('user_id', 'item_id', 'rating'):
+                arrays[f'{nome}_{coluna}'] = df[coluna].values
+        return arrays
+    
+    @classmethod
+    def de_arrays(cls, arrays, k_vizinhos=None, config_als=None):
+        """Recria o sistema já preparado a partir de arrays_treino (usado nos workers)"""
+        sistema = cls(k_vizinhos=k_vizinhos, config_als=config_als)
+        sistema.user_item_matrix = sparse.csr_matrix(
+            (arrays['matriz_data'], arrays['matriz_indices'], arrays['matriz_indptr']),
+            shape=tuple(arrays['matriz_shape'])
+        )
+        sistema.user_ids = arrays['user_ids']
+        sistema.item_ids = arrays['item_ids']
+        sistema.train_data = pd.DataFrame({c: arrays[f'train_{c}'] for c in ('user_id', 'item_id', 'rating')})
+        sistema.test_data = pd.DataFrame({c: arrays[f'test_{c}'] for c in ('user_id', 'item_id', 'rating')})
+        return sistema
+    
+    def treinar_modelos(self, n_processos=1):
+        """
+        Treina e avalia todos os modelos, em sequência ou em paralelo
+        
+        Com n_processos > 1 cada modelo roda em um processo do pool. A matriz
+        e os dados de treino/teste vão para memória compartilhada uma única vez
+        em vez de serem serializados para cada worker.
+        """
+        if n_processos <= 1:
+            for nome_modelo, metodo in self.MODELOS.items():
+                inicio = time.perf_counter()
+                getattr(self, metodo)()
+                self.tempos[nome_modelo] = time.perf_counter() - inicio
+            return
+        
+        print(f"⚡ Treinando {len(self.MODELOS)} modelos em {n_processos} processos...\n")
+        blocos, descricao = compartilhar_arrays(self.arrays_treino())
+        try:
+            config_perfil = (self.perfil.ativo, self.perfil.usar_tracemalloc)
+            with ProcessPoolExecutor(max_workers=n_processos, initializer=_inicializar_worker,
+                                     initargs=(descricao, self.k_vizinhos, config_perfil,
+                                               _config_als_worker(self.config_als, n_processos))) as pool:
+                futuros = [pool.submit(_treinar_no_worker, nome) for nome in self.MODELOS]
+                for futuro in as_completed(futuros):
+                    nome_modelo, modelo, resultado, tempo, saida, etapas = futuro.result()
+                    self.modelos[nome_modelo] = modelo
+                    self.resultados[nome_modelo] = resultado
+                    self.tempos[nome_modelo] = tempo
+                    self.perfil.etapas.extend(etapas)
+                    print(saida, end='')
+        finally:
+            liberar_blocos(blocos)
         
     def calcular_metricas(self, predictions, true_ratings):
         rmse = np.sqrt(mean_squared_error(true_ratings, predictions))
@@ -62,8 +628,9 @@ class SistemaRecomendacao:
     def recomendacao_aleatoria(self):
         print("🎲 Modelo 1: Recomendação Aleatória")
         
-        predictions = np.random.uniform(1, 5, len(self.test_data))
-        rmse, mae = self.calcular_metricas(predictions, self.test_data['rating'].values)
+        with self.perfil.etapa('random.avaliacao'):
+            predictions = np.random.uniform(1, 5, len(self.test_data))
+            rmse, mae = self.calcular_metricas(predictions, self.test_data['rating'].values)
         
         self.modelos['random'] = {'type': 'random'}
         self.resultados['random'] = {'RMSE': rmse, 'MAE': mae}
@@ -73,78 +640,88 @@ class SistemaRecomendacao:
         print("⭐ Modelo 2: Recomendação por Popularidade")
         
         # Calcular rating médio por filme
-        item_means = self.train_data.groupby('item_id')['rating'].mean()
-        global_mean = self.train_data['rating'].mean()
+        with self.perfil.etapa('popularity.ajuste'):
+            item_means = self.train_data.groupby('item_id')['rating'].mean()
+            global_mean = self.train_data['rating'].mean()
         
         # Predizer usando média do item
-        predictions = self.test_data['item_id'].map(item_means).fillna(global_mean).values
-        rmse, mae = self.calcular_metricas(predictions, self.test_data['rating'].values)
+        with self.perfil.etapa('popularity.avaliacao'):
+            predictions = self.test_data['item_id'].map(item_means).fillna(global_mean).values
+            rmse, mae = self.calcular_metricas(predictions, self.test_data['rating'].values)
         
         self.modelos['popularity'] = {'item_means': item_means, 'global_mean': global_mean}
         self.resultados['popularity'] = {'RMSE': rmse, 'MAE': mae}
         print(f"   RMSE: {rmse:.4f} | MAE: {mae:.4f}\n")
         
+    def indices_teste(self):
+        """Linha/coluna da matriz de cada par (usuário, item) do teste; -1 se ausente no treino"""
+        user_idx = pd.Index(self.user_ids).get_indexer(self.test_data['user_id'].values)
+        item_idx = pd.Index(self.item_ids).get_indexer(self.test_data['item_id'].values)
+        return user_idx, item_idx
+    
+    def predizer_knn(self, similaridade, idx_similaridade, matriz, idx_matriz, tamanho_bloco=2000):
+        """
+        Predições KNN em lote: soma das notas ponderada pela similaridade / soma |similaridade|
+        
+        Para cada par k usa a linha idx_similaridade[k] da similaridade e a linha
+        idx_matriz[k] da matriz de notas, processando os pares em blocos.
+        """
+        normalizador = np.asarray(abs(similaridade).sum(axis=1)).ravel()[idx_similaridade]
+        numerador = np.empty(len(idx_similaridade))
+        
+        for inicio in range(0, len(idx_similaridade), tamanho_bloco):
+            fim = inicio + tamanho_bloco
+            produto = matriz[idx_matriz[inicio:fim]].multiply(similaridade[idx_similaridade[inicio:fim]])
+            numerador[inicio:fim] = np.asarray(produto.sum(axis=1)).ravel()
+        
+        media_global = self.train_data['rating'].mean()
+        predictions = np.full(len(numerador), media_global)
+        np.divide(numerador, normalizador, out=predictions, where=normalizador > 0)
+        return np.clip(predictions, 1, 5)
+    
     def recomendacao_knn_user(self):
         print("👥 Modelo 3: KNN User-Based")
         
-        # Similaridade entre usuários
-        user_similarity = cosine_similarity(self.user_item_matrix)
-        
-        predictions = []
-        for _, row in self.test_data.iterrows():
-            user_id = row['user_id']
-            item_id = row['item_id']
-            
-            if user_id in self.user_item_matrix.index and item_id in self.user_item_matrix.columns:
-                user_idx = self.user_item_matrix.index.get_loc(user_id)
-                similar_users = user_similarity[user_idx]
-                
-                # Ratings dos usuários similares para este item
-                item_ratings = self.user_item_matrix[item_id].values
-                weighted_sum = np.dot(similar_users, item_ratings)
-                sim_sum = np.sum(np.abs(similar_users))
-                
-                pred = weighted_sum / sim_sum if sim_sum > 0 else self.train_data['rating'].mean()
-                pred = np.clip(pred, 1, 5)
+        # Similaridade entre usuários (completa ou só os k vizinhos mais próximos)
+        with self.perfil.etapa('knn_user.ajuste'):
+            if self.k_vizinhos:
+                user_similarity = similaridade_top_k(self.user_item_matrix, self.k_vizinhos)
             else:
-                pred = self.train_data['rating'].mean()
+                user_similarity = cosine_similarity(self.user_item_matrix)
+        
+        # Pares conhecidos: notas dos usuários similares para o item (linha da matriz transposta)
+        with self.perfil.etapa('knn_user.avaliacao'):
+            user_idx, item_idx = self.indices_teste()
+            conhecidos = (user_idx >= 0) & (item_idx >= 0)
+            predictions = np.full(len(self.test_data), self.train_data['rating'].mean())
+            predictions[conhecidos] = self.predizer_knn(user_similarity, user_idx[conhecidos],
+                                                        self.user_item_matrix.T.tocsr(), item_idx[conhecidos])
             
-            predictions.append(pred)
-        
-        rmse, mae = self.calcular_metricas(predictions, self.test_data['rating'].values)
-        self.modelos['knn_user'] = {'user_similarity': user_similarity}
+            rmse, mae = self.calcular_metricas(predictions, self.test_data['rating'].values)
+        self.modelos['knn_user'] = {'user_similarity': user_similarity, 'k': self.k_vizinhos}
         self.resultados['knn_user'] = {'RMSE': rmse, 'MAE': mae}
         print(f"   RMSE: {rmse:.4f} | MAE: {mae:.4f}\n")
         
     def recomendacao_knn_item(self):
         print("🎬 Modelo 4: KNN Item-Based")
         
-        # Similaridade entre itens
-        item_similarity = cosine_similarity(self.user_item_matrix.T)
-        
-        predictions = []
-        for _, row in self.test_data.iterrows():
-            user_id = row['user_id']
-            item_id = row['item_id']
-            
-            if user_id in self.user_item_matrix.index and item_id in self.user_item_matrix.columns:
-                item_idx = self.user_item_matrix.columns.get_loc(item_id)
-                similar_items = item_similarity[item_idx]
-                
-                # Ratings do usuário para itens similares
-                user_ratings = self.user_item_matrix.loc[user_id].values
-                weighted_sum = np.dot(similar_items, user_ratings)
-                sim_sum = np.sum(np.abs(similar_items))
-                
-                pred = weighted_sum / sim_sum if sim_sum > 0 else self.train_data['rating'].mean()
-                pred = np.clip(pred, 1, 5)
+        # Similaridade entre itens (completa ou só os k vizinhos mais próximos)
+        with self.perfil.etapa('knn_item.ajuste'):
+            if self.k_vizinhos:
+                item_similarity = similaridade_top_k(self.user_item_matrix.T, self.k_vizinhos)
             else:
-                pred = self.train_data['rating'].mean()
+                item_similarity = cosine_similarity(self.user_item_matrix.T)
+        
+        # Pares conhecidos: notas do usuário para os itens similares
+        with self.perfil.etapa('knn_item.avaliacao'):
+            user_idx, item_idx = self.indices_teste()
+            conhecidos = (user_idx >= 0) & (item_idx >= 0)
+            predictions = np.full(len(self.test_data), self.train_data['rating'].mean())
+            predictions[conhecidos] = self.predizer_knn(item_similarity, item_idx[conhecidos],
+                                                        self.user_item_matrix, user_idx[conhecidos])
             
-            predictions.append(pred)
-        
-        rmse, mae = self.calcular_metricas(predictions, self.test_data['rating'].values)
-        self.modelos['knn_item'] = {'item_similarity': item_similarity}
+            rmse, mae = self.calcular_metricas(predictions, self.test_data['rating'].values)
+        self.modelos['knn_item'] = {'item_similarity': item_similarity, 'k': self.k_vizinhos}
         self.resultados['knn_item'] = {'RMSE': rmse, 'MAE': mae}
         print(f"   RMSE: {rmse:.4f} | MAE: {mae:.4f}\n")
         
@@ -152,82 +729,293 @@ class SistemaRecomendacao:
         print("🧮 Modelo 5: SVD")
         
         # Aplicar SVD
-        svd = TruncatedSVD(n_components=50, random_state=42)
-        user_factors = svd.fit_transform(self.user_item_matrix)
-        item_factors = svd.components_.T
-        
-        predictions = []
-        for _, row in self.test_data.iterrows():
-            user_id = row['user_id']
-            item_id = row['item_id']
+        with self.perfil.etapa('svd.ajuste'):
+            svd = TruncatedSVD(n_components=50, random_state=42)
+            user_factors = svd.fit_transform(self.user_item_matrix)
+            item_factors = svd.components_.T
+        
+        # Produto escalar linha a linha dos fatores de todos os pares conhecidos
+        with self.perfil.etapa('svd.avaliacao'):
+            user_idx, item_idx = self.indices_teste()
+            conhecidos = (user_idx >= 0) & (item_idx >= 0)
+            predictions = np.full(len(self.test_data), self.train_data['rating'].mean())
+            predictions[conhecidos] = np.clip(np.einsum('ij,ij->i', user_factors[user_idx[conhecidos]],
+                                                        item_factors[item_idx[conhecidos]]), 1, 5)
             
-            if user_id in self.user_item_matrix.index and item_id in self.user_item_matrix.columns:
-                user_idx = self.user_item_matrix.index.get_loc(user_id)
-                item_idx = self.user_item_matrix.columns.get_loc(item_id)
-                
-                pred = np.dot(user_factors[user_idx], item_factors[item_idx])
-                pred = np.clip(pred, 1, 5)
-            else:
-                pred = self.train_data['rating'].mean()
-            
-            predictions.append(pred)
-        
-        rmse, mae = self.calcular_metricas(predictions, self.test_data['rating'].values)
+            rmse, mae = self.calcular_metricas(predictions, self.test_data['rating'].values)
         self.modelos['svd'] = {'svd': svd, 'user_factors': user_factors, 'item_factors': item_factors}
         self.resultados['svd'] = {'RMSE': rmse, 'MAE': mae}
         print(f"   RMSE: {rmse:.4f} | MAE: {mae:.4f}\n")
         
-    def comparar_modelos(self):
+    def recomendacao_als(self):
+        config = self.config_als
+        print(f"🧩 Modelo 6: ALS com vieses (rank {config['rank']}, regularização {config['regularizacao']}, "
+              f"{config['epocas']} épocas)")
+        
+        # Fatoração só nas notas observadas da matriz esparsa (sem tratar ausentes como zero)
+        with self.perfil.etapa('als.ajuste'):
+            fatores = fatoracao_als(self.user_item_matrix, config['rank'], config['regularizacao'],
+                                    config['epocas'], config['threads'])
+        
+        # Pares conhecidos usam os fatores; usuário ou item fora do treino ficam só com os vieses
+        with self.perfil.etapa('als.avaliacao'):
+            user_idx, item_idx = self.indices_teste()
+            conhecidos = (user_idx >= 0) & (item_idx >= 0)
+            predictions = np.full(len(self.test_data), fatores['media_global'])
+            predictions[user_idx >= 0] += fatores['bias_usuarios'][user_idx[user_idx >= 0]]
+            predictions[item_idx >= 0] += fatores['bias_itens'][item_idx[item_idx >= 0]]
+            predictions[conhecidos] += np.einsum('ij,ij->i', fatores['user_factors'][user_idx[conhecidos]],
+                                                 fatores['item_factors'][item_idx[conhecidos]])
+            predictions = np.clip(predictions, 1, 5)
+            
+            rmse, mae = self.calcular_metricas(predictions, self.test_data['rating'].values)
+        self.modelos['als'] = {**fatores, 'rank': config['rank'], 'regularizacao': config['regularizacao'],
+                               'epocas': config['epocas']}
+        self.resultados['als'] = {'RMSE': rmse, 'MAE': mae}
+        print(f"   RMSE: {rmse:.4f} | MAE: {mae:.4f}\n")
+        
+    def avaliar_ranking(self, k=10, n_processos=1, nota_relevante=4):
+        """
+        Avalia o top K de cada modelo no catálogo inteiro: precision@k, recall@k, MAP@k e NDCG@k
+        
+        Relevantes são os filmes do teste com nota >= nota_relevante; os filmes
+        de treino do usuário ficam fora da lista, como na API. Com n_processos > 1
+        os usuários são divididos em fatias entre os processos do pool, e cada
+        modelo vai para os workers como pacote de artefatos mapeado em memória.
+        As métricas entram em self.resultados (ex.: 'NDCG@10').
+        """
+        print("=" * 70)
+        print(f"📏 AVALIAÇÃO DE RANKING (top {k}, relevante: nota >= {nota_relevante})")
+        print("=" * 70)
+        
+        # Filmes relevantes de cada usuário de teste (linhas) nas posições do catálogo
+        catalogo = Catalogo.de_arquivos(self.data_path)
+        teste = self.test_data[self.test_data['rating'] >= nota_relevante]
+        posicoes = catalogo.posicoes(teste['item_id'].values)
+        usuarios, linhas = np.unique(teste['user_id'].values[posicoes >= 0], return_inverse=True)
+        relevantes = sparse.csr_matrix(
+            (np.ones(len(linhas), dtype=bool), (linhas, posicoes[posicoes >= 0])),
+            shape=(len(usuarios), len(catalogo))
+        )
+        
+        # Índice só com o treino: é ele que define os filmes excluídos do top K
+        dados = {'ratings': self.train_data, 'train_data': self.train_data,
+                 'user_ids': self.user_ids, 'item_ids': self.item_ids}
+        recomendadores = {nome: montar_recomendador(nome, modelo, dados, catalogo)
+                          for nome, modelo in self.modelos.items() if nome != 'random'}
+        print(f"⚡ {len(recomendadores)} modelos x {len(usuarios):,} usuários x {len(catalogo):,} filmes "
+              f"({n_processos} processos)...")
+        
+        inicio = time.perf_counter()
+        somas = {nome: dict.fromkeys(('precisao', 'recall', 'map', 'ndcg'), 0.0) for nome in recomendadores}
+        if n_processos <= 1:
+            for nome, recomendador in recomendadores.items():
+                somas[nome] = metricas_ranking(recomendador, usuarios, relevantes, k)
+        else:
+            arrays = {'usuarios': usuarios, 'indptr': relevantes.indptr, 'indices': relevantes.indices,
+                      'shape': np.asarray(relevantes.shape)}
+            fatias = np.array_split(np.arange(len(usuarios)), n_processos)
+            blocos, descricao = compartilhar_arrays(arrays)
+            try:
+                with tempfile.TemporaryDirectory() as temporario:
+                    diretorios = {}
+                    for nome, recomendador in recomendadores.items():
+                        diretorios[nome] = str(Path(temporario) / nome)
+                        salvar_artefatos(recomendador, Path(diretorios[nome]))
+                    with ProcessPoolExecutor(max_workers=n_processos, initializer=_inicializar_worker_ranking,
+                                             initargs=(diretorios, descricao, k)) as pool:
+                        futuros = [pool.submit(_avaliar_ranking_fatia, nome, int(f[0]), int(f[-1]) + 1)
+                                   for nome in recomendadores for f in fatias if len(f)]
+                        for futuro in as_completed(futuros):
+                            nome, parcial = futuro.result()
+                            for metrica, valor in parcial.items():
+                                somas[nome][metrica] += valor
+            finally:
+                liberar_blocos(blocos)
+        print(f"⏱️  Avaliação de ranking: {time.perf_counter() - inicio:.2f}s\n")
+        
+        for nome, soma in somas.items():
+            self.resultados[nome].update({
+                f'P@{k}': soma['precisao'] / len(usuarios),
+                f'R@{k}': soma['recall'] / len(usuarios),
+                f'MAP@{k}': soma['map'] / len(usuarios),
+                f'NDCG@{k}': soma['ndcg'] / len(usuarios),
+            })
+            print(f"   {nome:20} | P@{k}: {self.resultados[nome][f'P@{k}']:.4f} "
+                  f"| R@{k}: {self.resultados[nome][f'R@{k}']:.4f} "
+                  f"| MAP@{k}: {self.resultados[nome][f'MAP@{k}']:.4f} "
+                  f"| NDCG@{k}: {self.resultados[nome][f'NDCG@{k}']:.4f}")
+        print()
+        
+    def comparar_modelos(self, criterio='RMSE'):
         print("=" * 70)
         print("📊 COMPARAÇÃO DE MODELOS")
         print("=" * 70)
         
-        df_resultados = pd.DataFrame(self.resultados).T.sort_values('RMSE')
+        # Erros (RMSE, MAE, RMSE_CV...): menor é melhor; métricas de ranking (NDCG@k...): maior é melhor
+        menor_melhor = criterio.startswith(('RMSE', 'MAE'))
+        df_resultados = pd.DataFrame(self.resultados).T.sort_values(criterio, ascending=menor_melhor)
+        ranking = [coluna for coluna in df_resultados.columns if '@' in coluna]
         
-        print("\nRanking por RMSE (menor é melhor):")
+        print(f"\nRanking por {criterio} ({'menor' if menor_melhor else 'maior'} é melhor):")
         print("-" * 70)
         for idx, (modelo, row) in enumerate(df_resultados.iterrows(), 1):
-            print(f"{idx}. {modelo:20} | RMSE: {row['RMSE']:.4f} | MAE: {row['MAE']:.4f}")
+            tempo = f" | Tempo: {self.tempos[modelo]:.2f}s" if modelo in self.tempos else ""
+            metricas = ''.join(f" | {coluna}: {row[coluna]:.4f}" if pd.notna(row[coluna]) else f" | {coluna}: -     "
+                               for coluna in ranking)
+            if pd.notna(row.get('RMSE_CV')):
+                metricas = f" | RMSE CV: {row['RMSE_CV']:.4f} ± {row['RMSE_CV_dp']:.4f}{metricas}"
+            print(f"{idx}. {modelo:20} | RMSE: {row['RMSE']:.4f} | MAE: {row['MAE']:.4f}{metricas}{tempo}")
         
         melhor_modelo = df_resultados.index[0]
         print(f"\n🏆 Melhor modelo: {melhor_modelo.upper()}")
         print("=" * 70)
         return melhor_modelo
         
-    def salvar_modelo(self, nome_modelo):
+    def salvar_modelo(self, nome_modelo, dados_auxiliares=True):
         print(f"\n💾 Salvando modelo '{nome_modelo}'...")
         
-        joblib.dump(self.modelos[nome_modelo], MODEL_PATH / f'modelo_{nome_modelo}.pkl')
-        joblib.dump({
-            'movies': self.movies, 
-            'ratings': self.ratings,
-            'user_item_matrix': self.user_item_matrix,
-            'train_data': self.train_data
-        }, MODEL_PATH / 'dados_auxiliares.pkl')
+        with self.perfil.etapa(f'salvar_modelo.{nome_modelo}.pkl'):
+            joblib.dump(self.modelos[nome_modelo], MODEL_PATH / f'modelo_{nome_modelo}.pkl')
+            if dados_auxiliares:
+                joblib.dump({
+                    'movies': self.movies, 
+                    'ratings': self.ratings,
+                    'user_item_matrix': self.user_item_matrix,
+                    'user_ids': self.user_ids,
+                    'item_ids': self.item_ids,
+                    'train_data': self.train_data
+                }, MODEL_PATH / 'dados_auxiliares.pkl')
         
         print(f"✅ Modelo salvo em: {MODEL_PATH / f'modelo_{nome_modelo}.pkl'}")
         
-    def treinar_todos(self):
+        # Pacote de artefatos usado pela API (só o necessário para servir, carregado via mmap)
+        if nome_modelo != 'random':
+            with self.perfil.etapa(f'salvar_modelo.{nome_modelo}.artefatos'):
+                recomendador = self.montar_recomendador(nome_modelo)
+                
+                # Top 50 de todos os usuários em uma passada, para o modo de serviço materializado
+                recomendador.materializado = TopMaterializado.calcular(recomendador, n=TOP_N_MATERIALIZADO)
+                
+                # Filmes similares a cada filme (exato em catálogos pequenos, IVF nos grandes)
+                vetores = recomendador.vetores_itens()
+                vizinhos = recomendador.vizinhos = VizinhosItens.calcular(vetores, metodo=self.metodo_similares)
+                if vizinhos.metodo == 'ivf':
+                    recall = vizinhos.recall(vetores)
+                    print(f"✅ Filmes similares (IVF): recall vs. exato {recall:.3f}")
+                    if recall < RECALL_MINIMO_IVF:
+                        print(f"⚠️  Recall abaixo de {RECALL_MINIMO_IVF}: considere --similares exato")
+                versao = salvar_artefatos(recomendador, ARTEFATOS_PATH / nome_modelo)
+            print(f"✅ Artefatos salvos em: {ARTEFATOS_PATH / nome_modelo / versao}")
+        
+    def montar_recomendador(self, nome_modelo):
+        """Recomendador (catálogo + índice + scorer) do modelo treinado, pronto para servir"""
+        catalogo = Catalogo.de_arquivos(self.data_path)
+        dados = {
+            'ratings': self.ratings,
+            'train_data': self.train_data,
+            'user_ids': self.user_ids,
+            'item_ids': self.item_ids
+        }
+        return montar_recomendador(nome_modelo, self.modelos[nome_modelo], dados, catalogo)
+        
+    def treinar_todos(self, salvar_todos=False, n_processos=1, validacao_cruzada=False, ranking_k=None):
         print("=" * 70)
         print("🚀 TREINAMENTO DE MODELOS DE RECOMENDAÇÃO")
         print("=" * 70)
         print()
         
-        self.carregar_dados()
-        self.preparar_dados()
-        self.recomendacao_aleatoria()
-        self.recomendacao_popularidade()
-        self.recomendacao_knn_user()
-        self.recomendacao_knn_item()
-        self.recomendacao_svd()
-        
-        melhor_modelo = self.comparar_modelos()
+        with self.perfil.etapa('carregar_dados'):
+            self.carregar_dados()
+        resumo_cv = None
+        if validacao_cruzada:
+            with self.perfil.etapa('validacao_cruzada'):
+                resumo_cv = self.validacao_cruzada(n_processos=n_processos)
+        with self.perfil.etapa('preparar_dados'):
+            self.preparar_dados()
+        inicio = time.perf_counter()
+        self.treinar_modelos(n_processos)
+        print(f"⏱️  Treinamento dos modelos: {time.perf_counter() - inicio:.2f}s\n")
+        
+        # RMSE médio dos 5 folds entra na comparação (mais estável que o de um único split)
+        criterio = 'RMSE'
+        if resumo_cv is not None:
+            for modelo, row in resumo_cv.iterrows():
+                self.resultados[modelo].update(RMSE_CV=row[('RMSE', 'mean')], RMSE_CV_dp=row[('RMSE', 'std')])
+            criterio = 'RMSE_CV'
+        # Com a avaliação de ranking, o melhor modelo é o de melhor top N (é o que a API serve)
+        if ranking_k:
+            with self.perfil.etapa('avaliar_ranking'):
+                self.avaliar_ranking(ranking_k, n_processos)
+            criterio = f'NDCG@{ranking_k}'
+        melhor_modelo = self.comparar_modelos(criterio=criterio)
         self.salvar_modelo(melhor_modelo)
+        # A API serve este modelo quando MODELO_API não é informado (escolhido pelo critério acima)
+        if melhor_modelo != 'random':
+            salvar_melhor_modelo(ARTEFATOS_PATH, melhor_modelo)
+            print(f"🌐 Modelo padrão da API: {melhor_modelo} ({ARTEFATOS_PATH / 'MELHOR'})")
+        if salvar_todos:
+            # Permite servir qualquer modelo na API (MODELO_API), não só o melhor
+            for nome_modelo in self.modelos:
+                if nome_modelo not in (melhor_modelo, 'random'):
+                    self.salvar_modelo(nome_modelo, dados_auxiliares=False)
+        
+        if self.perfil.ativo:
+            self.perfil.imprimir()
+            caminho = self.perfil.salvar(
+                MODEL_PATH / 'perfil_treino.json',
+                modelo_salvo=melhor_modelo,
+                n_processos=n_processos,
+                k_vizinhos=self.k_vizinhos,
+                dados={
+                    'avaliacoes': len(self.ratings),
+                    'usuarios': len(self.user_ids),
+                    'itens': len(self.item_ids),
+                    'nnz': int(self.user_item_matrix.nnz),
+                },
+            )
+            print(f"📈 Perfil salvo em: {caminho}")
         print("\n✅ Treinamento concluído!")
 
 def main():
-    sistema = SistemaRecomendacao()
-    sistema.treinar_todos()
+    parser = argparse.ArgumentParser(description='Treinar modelos de recomendação')
+    parser.add_argument('--salvar-todos', action='store_true',
+                        help='Salvar todos os modelos, não apenas o melhor')
+    parser.add_argument('--k-vizinhos', type=int, default=None,
+                        help='Manter só os k vizinhos mais similares nos modelos KNN (padrão: todos)')
+    parser.add_argument('--processos', type=int, default=1,
+                        help='Número de processos para treinar os modelos em paralelo (padrão: 1)')
+    parser.add_argument('--dados', type=Path, default=DATA_PATH,
+                        help='Diretório do dataset MovieLens: ml-100k, ml-1m, ml-10m, ml-25m... (padrão: ml-100k)')
+    parser.add_argument('--validacao-cruzada', action='store_true',
+                        help='Avaliar os modelos também nos 5 folds oficiais (u1..u5), um processo por fold')
+    parser.add_argument('--ranking', type=int, default=None, metavar='K',
+                        help='Avaliar o top K de cada modelo (precision, recall, MAP e NDCG@K) '
+                             'e escolher o melhor modelo pelo NDCG@K')
+    parser.add_argument('--perfil', action='store_true',
+                        help='Medir tempo, CPU e pico de memória de cada etapa e salvar em models/perfil_treino.json')
+    parser.add_argument('--perfil-tracemalloc', action='store_true',
+                        help='Com --perfil, medir também o pico de memória alocada pelo Python (mais lento)')
+    parser.add_argument('--als-rank', type=int, default=CONFIG_ALS['rank'],
+                        help=f"Fatores latentes do modelo ALS (padrão: {CONFIG_ALS['rank']})")
+    parser.add_argument('--als-regularizacao', type=float, default=CONFIG_ALS['regularizacao'],
+                        help=f"Regularização L2 do modelo ALS (padrão: {CONFIG_ALS['regularizacao']})")
+    parser.add_argument('--als-epocas', type=int, default=CONFIG_ALS['epocas'],
+                        help=f"Épocas do modelo ALS (padrão: {CONFIG_ALS['epocas']})")
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Threads dos passos do ALS (padrão: número de CPUs)')
+    parser.add_argument('--similares', choices=['auto', 'exato', 'ivf'], default='auto',
+                        help='Índice de filmes similares: exato, aproximado (IVF) ou auto, '
+                             'exato até 20.000 filmes (padrão: auto)')
+    args = parser.parse_args()
+    
+    config_als = {'rank': args.als_rank, 'regularizacao': args.als_regularizacao, 'epocas': args.als_epocas,
+                  'threads': args.threads}
+    perfil = PerfilTreino(ativo=args.perfil or args.perfil_tracemalloc, usar_tracemalloc=args.perfil_tracemalloc)
+    sistema = SistemaRecomendacao(k_vizinhos=args.k_vizinhos, data_path=args.dados, perfil=perfil,
+                                  config_als=config_als, metodo_similares=args.similares)
+    sistema.treinar_todos(salvar_todos=args.salvar_todos, n_processos=args.processos,
+                          validacao_cruzada=args.validacao_cruzada, ranking_k=args.ranking)
 
 if __name__ == "__main__":
     main()
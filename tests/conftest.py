@@ -0,0 +1,45 @@
+"""Fixtures compartilhadas: modelos sintéticos pequenos e a API servindo um pacote de artefatos temporário"""
+
+import importlib
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+RAIZ = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ))
+
+from servico_recomendacao import (Catalogo, IndiceAvaliacoes, Recomendador, ScorerSVD,  # noqa: E402
+                                  salvar_artefatos)
+
+
+def recomendador_sintetico(n_usuarios=20, n_itens=30, rank=4, semente=0):
+    """Recomendador SVD com catálogo, avaliações e fatores aleatórios"""
+    rng = np.random.default_rng(semente)
+    item_ids = np.arange(1, n_itens + 1)
+    catalogo = Catalogo(item_ids, np.array([f'Filme {i}' for i in item_ids]),
+                        rng.integers(0, 2, (n_itens, 3)).astype(np.int8), ['Ação', 'Comédia', 'Drama'])
+    ratings = pd.DataFrame({
+        'user_id': np.repeat(np.arange(1, n_usuarios + 1), 5),
+        'item_id': rng.integers(1, n_itens + 1, n_usuarios * 5),
+        'rating': rng.integers(1, 6, n_usuarios * 5).astype(float),
+    }).drop_duplicates(['user_id', 'item_id'])
+    scorer = ScorerSVD(np.arange(1, n_usuarios + 1), rng.normal(size=(n_usuarios, rank)),
+                       rng.normal(size=(n_itens, rank)), np.full(n_itens, 3.0))
+    return Recomendador(catalogo, IndiceAvaliacoes.de_avaliacoes(ratings, item_ids), scorer, 'svd')
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    """Módulo app servindo um modelo SVD sintético salvo em tmp_path/models"""
+    salvar_artefatos(recomendador_sintetico(), tmp_path / 'models' / 'artefatos' / 'svd')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('MODELO_API', 'svd')
+    monkeypatch.setenv('INTERVALO_RECARGA', '0')
+    monkeypatch.setenv('INTERVALO_COMPACTACAO', '0')
+    sys.modules.pop('app', None)
+    app = importlib.import_module('app')
+    yield app
+    sys.modules.pop('app', None)
@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+
+@pytest.mark.parametrize('nota', [float('nan'), float('inf'), float('-inf')])
+def test_avaliar_rejeita_nota_nao_finita(api, nota):
+    cliente = api.app.test_client()
+    resposta = cliente.post('/avaliar', data=json.dumps({'user_id': 1, 'item_id': 2, 'rating': nota}),
+                            content_type='application/json')
+
+    assert resposta.status_code == 400
+    assert not api.recarregador.atual.recentes
+    recomendacoes = cliente.post('/recomendar', json={'user_id': 1, 'n_recomendacoes': 3}).get_json()
+    assert len(recomendacoes['recomendacoes']) == 3
+
+
+def test_resposta_calculada_antes_de_avaliar_nao_entra_no_cache(api):
+    cliente = api.app.test_client()
+    recomendador = api.recarregador.atual
+    top = recomendador.recomendar(1, 1)[0]['item_id']
+
+    # /avaliar do filme do topo chega enquanto a recomendação do usuário está sendo calculada
+    recomendar = recomendador.recomendar
+    def recomendar_com_avaliacao(*args, **kwargs):
+        resultado = recomendar(*args, **kwargs)
+        cliente.post('/avaliar', json={'user_id': 1, 'item_id': top, 'rating': 5})
+        return resultado
+    recomendador.recomendar = recomendar_com_avaliacao
+    cliente.post('/recomendar', json={'user_id': 1, 'n_recomendacoes': 3})
+    recomendador.recomendar = recomendar
+
+    seguinte = cliente.post('/recomendar', json={'user_id': 1, 'n_recomendacoes': 3}).get_json()
+    assert top not in [r['item_id'] for r in seguinte['recomendacoes']]
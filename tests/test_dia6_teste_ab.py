@@ -0,0 +1,49 @@
+import pytest
+
+import dia6_teste_ab
+from dia6_teste_ab import agregados_vazios, atualizar_agregados, main_streaming
+
+
+LINHAS = [
+    'user_id,timestamp,group,converted',
+    '1,2024-01-01 10:00:00,control,0',
+    '2,2024-01-01 11:00:00,treatment,1',
+    '3,2024-01-02 09:00:00,treatment,0',
+]
+
+
+def _escrever_log(caminho, linhas, quebra_final):
+    caminho.write_text('\n'.join(linhas) + ('\n' if quebra_final else ''))
+
+
+def test_seguir_deixa_linha_incompleta_para_a_proxima_leitura(tmp_path):
+    log = tmp_path / 'eventos.csv'
+    _escrever_log(log, LINHAS, quebra_final=False)
+
+    agregados = agregados_vazios(str(log))
+    assert atualizar_agregados(agregados, str(log), seguir=True) == 2
+
+    # A linha é completada pelo escritor e entra na leitura seguinte
+    with open(log, 'a') as f:
+        f.write('\n')
+    assert atualizar_agregados(agregados, str(log), seguir=True) == 1
+    assert agregados['grupos']['treatment'] == {'n': 2, 'conversoes': 1}
+
+
+def test_fim_do_modo_seguir_conta_a_ultima_linha_sem_quebra(tmp_path, monkeypatch):
+    log = tmp_path / 'eventos.csv'
+    checkpoint = tmp_path / 'checkpoint.json'
+    _escrever_log(log, LINHAS, quebra_final=False)
+
+    # Ctrl+C durante a espera entre leituras encerra o stream
+    def interromper(segundos):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(dia6_teste_ab.time, 'sleep', interromper)
+    with pytest.raises(KeyboardInterrupt):
+        main_streaming(str(log), str(checkpoint), 1024, seguir=30)
+
+    agregados = dia6_teste_ab.carregar_checkpoint(str(checkpoint), str(log))
+    assert agregados['eventos'] == 3
+    assert agregados['offset'] == log.stat().st_size
+    assert agregados['grupos']['treatment'] == {'n': 2, 'conversoes': 1}
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+from conftest import recomendador_sintetico
+from servico_recomendacao import Catalogo, IndiceAvaliacoes, Recomendador, ScorerSVD, criar_scorer
+
+
+def _recomendador_treino_teste():
+    """SVD cujos fatores do usuário 1 vêm só do treino, com uma nota de teste a mais no índice"""
+    rng = np.random.default_rng(1)
+    item_ids = np.arange(1, 11)
+    catalogo = Catalogo(item_ids, np.array([f'Filme {i}' for i in item_ids]),
+                        np.zeros((10, 1), dtype=np.int8), ['Drama'])
+    treino = pd.DataFrame({'user_id': 1, 'item_id': [1, 2, 3], 'rating': [5.0, 4.0, 2.0]})
+    teste = pd.DataFrame({'user_id': 1, 'item_id': [4], 'rating': [5.0]})
+    indice = IndiceAvaliacoes.de_avaliacoes(pd.concat([treino, teste]), item_ids)
+
+    item_factors = rng.normal(size=(10, 3))
+    user_factors = (treino['rating'].values @ item_factors[:3])[None, :]
+    scorer = ScorerSVD(np.array([1]), user_factors, item_factors, np.full(10, 3.0))
+    return Recomendador(catalogo, indice, scorer, 'svd')
+
+
+def test_svd_reavaliar_filme_do_teste_substitui_a_nota_do_indice():
+    recomendador = _recomendador_treino_teste()
+    scorer = recomendador.scorer
+    vetor_treino = scorer.user_factors[0].copy()
+
+    # Filme 4 está no índice (teste), mas não nos fatores do treino: nota 5 -> 3
+    recomendador.registrar_avaliacao(1, 4, 3.0)
+
+    np.testing.assert_allclose(scorer.fatores_dobrados[1], vetor_treino + 3.0 * scorer.item_factors[3])
+
+
+def test_svd_reavaliar_filme_do_treino_aplica_so_a_diferenca():
+    recomendador = _recomendador_treino_teste()
+    scorer = recomendador.scorer
+    vetor_completo = scorer.user_factors[0] + 5.0 * scorer.item_factors[3]
+
+    recomendador.registrar_avaliacao(1, 1, 1.0)
+    np.testing.assert_allclose(scorer.fatores_dobrados[1], vetor_completo - 4.0 * scorer.item_factors[0])
+
+    # Segunda reavaliação parte da nota recente
+    recomendador.registrar_avaliacao(1, 1, 2.0)
+    np.testing.assert_allclose(scorer.fatores_dobrados[1], vetor_completo - 3.0 * scorer.item_factors[0])
+
+
+
+def test_popularidade_e_base_fria_usam_as_notas_do_indice():
+    recomendador = recomendador_sintetico()
+    catalogo = recomendador.catalogo
+    ratings = pd.DataFrame({
+        'user_id': np.repeat(recomendador.indice.user_ids, np.diff(recomendador.indice.indptr)),
+        'item_id': catalogo.item_ids[recomendador.indice.indices],
+        'rating': recomendador.indice.notas,
+    })
+    dados = {'ratings': ratings, 'train_data': ratings.iloc[::2], 'user_ids': np.arange(1, 21),
+             'item_ids': catalogo.item_ids}
+    svd = {'user_factors': recomendador.scorer.user_factors, 'item_factors': recomendador.scorer.item_factors}
+
+    popularidade = criar_scorer('popularity', {}, dados, catalogo)
+    np.testing.assert_allclose(criar_scorer('svd', svd, dados, catalogo).scores_padrao, popularidade.scores_itens)
+
+    # Reavaliar uma nota do índice substitui o voto, sem mudar a contagem
+    recomendador.scorer = popularidade
+    user_id, item_id, nota = ratings.iloc[0]
+    pos = int(catalogo.posicoes([item_id])[0])
+    contagem = int(popularidade.contagem[pos])
+    recomendador.registrar_avaliacao(int(user_id), int(item_id), 1.0)
+    assert popularidade.contagem[pos] == contagem
+    media = ratings[ratings['item_id'] == item_id]['rating']
+    assert np.isclose(popularidade.scores_itens[pos], (media.sum() - nota + 1.0) / len(media))
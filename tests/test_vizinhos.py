@@ -0,0 +1,30 @@
+import numpy as np
+
+from servico_recomendacao import RECALL_MINIMO_IVF, VizinhosItens
+
+
+def _vetores_agrupados(n_itens=4000, n_grupos=40, dimensao=32, ruido=1.0, semente=0):
+    """Vetores de filmes em grupos (como fatores de SVD/ALS de filmes de gêneros parecidos)"""
+    rng = np.random.default_rng(semente)
+    centros = rng.normal(size=(n_grupos, dimensao))
+    return centros[rng.integers(0, n_grupos, n_itens)] + ruido * rng.normal(size=(n_itens, dimensao))
+
+
+def test_ivf_encontra_os_vizinhos_da_busca_exata():
+    vetores = _vetores_agrupados()
+    ivf = VizinhosItens.calcular(vetores, n=20, metodo='ivf')
+    exato = VizinhosItens.calcular(vetores, n=20, metodo='exato')
+
+    sobreposicao = np.mean([len(np.intersect1d(ivf.itens[i], exato.itens[i])) / 20 for i in range(len(vetores))])
+    assert sobreposicao >= RECALL_MINIMO_IVF
+    assert ivf.recall(vetores) >= RECALL_MINIMO_IVF
+    # recall (amostra, com empates) deve concordar com a comparação direta
+    assert abs(ivf.recall(vetores) - sobreposicao) < 0.02
+
+
+def test_busca_exata_tem_recall_total():
+    vetores = _vetores_agrupados(n_itens=500)
+    exato = VizinhosItens.calcular(vetores, n=10, metodo='exato')
+
+    assert exato.recall(vetores) == 1.0
+    assert (exato.itens != np.arange(len(vetores))[:, None]).all()